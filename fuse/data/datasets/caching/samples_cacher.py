@@ -16,18 +16,31 @@ from typing import Hashable, List, Optional, Sequence, Union, Callable, Any, Tup
 
 from fuse.data.pipelines.pipeline_default import PipelineDefault
 from collections import OrderedDict
-from fuse.data.datasets.caching.object_caching_handlers import _object_requires_hdf5_recurse
-from fuse.utils.ndict import NDict
+from fuse.data.datasets.caching.samples_memory_cache import SamplesMemoryCache
+from fuse.data.datasets.caching.samples_storage import SamplesStorageBase, SamplesStorageFiles, is_key_requested
 import os
 import psutil
-from fuse.utils.file_io.file_io import load_hdf5, save_hdf5_safe, load_pickle, save_pickle_safe
+from fuse.utils.file_io.file_io import (
+    load_pickle,
+    save_pickle_safe,
+    append_pickle_record,
+    read_pickle_records,
+    get_randomized_postfix_name,
+)
 from fuse.data import get_sample_id, create_initial_sample, get_specific_sample_from_potentially_morphed
+from fuse.utils.ndict import NDict
 import hashlib
 from fuse.utils.file_io import delete_directory_tree
 from glob import glob
+from time import time
 from fuse.utils.multiprocessing.run_multiprocessed import run_multiprocessed, get_from_global_storage
 from fuse.data.datasets.sample_caching_audit import SampleCachingAudit
-from fuse.data.utils.sample import get_initial_sample_id, set_initial_sample_id
+from fuse.data.utils.sample import (
+    get_initial_sample_id,
+    set_initial_sample_id,
+    get_sample_id_key,
+    get_initial_sample_id_key,
+)
 from warnings import warn
 
 
@@ -39,9 +52,12 @@ class SamplesCacher:
         cache_dirs: Union[str, List[str]],
         custom_write_dir_callable: Optional[Callable] = None,
         custom_read_dirs_callable: Optional[Callable] = None,
-        restart_cache: bool = False,
+        restart_cache: Union[bool, str] = False,
         workers: int = 0,
         verbose=1,
+        storage: Optional[SamplesStorageBase] = None,
+        memory_cache_size: Optional[int] = None,
+        checkpoint_op_ids: Optional[List[str]] = None,
         **audit_kwargs: dict,
     ) -> None:
         """
@@ -58,7 +74,23 @@ class SamplesCacher:
         :param restart_cache: if set to True, will DELETE all of the content of the defined cache dirs.
         Should be used every time that any of the OPs participating in the "static cache" part changed in any way
         (for example, code change)
+        Set to "keep_prefixes" to delete the caches of other pipelines, but keep the caches of the prefixes of the current pipeline
+        (see checkpoint_op_ids) - e.g. after modifying the last ops, only the ops following the longest cached prefix will be executed.
         :param workers: number of multiprocessing workers used when building the cache. Default value is 0 (no multiprocessing)
+        :param storage: optional storage backend which determines how the cached samples are stored on disk.
+            By default SamplesStorageFiles is used (a few files per sample).
+            For large datasets, consider SamplesStoragePacked which packs all of the samples into a few large shard files.
+            Both accept a codec argument - the serialization of the non large array part of the samples (e.g. "pickle5" or "lz4" instead of the default "gzip").
+        :param memory_cache_size: optional, bytes budget of an in-memory (per process) LRU cache of loaded samples, in front of the disk cache.
+            Useful when the static pipeline output (or a large part of it) fits in RAM - it avoids re-reading and decompressing the samples every epoch.
+            Use get_memory_cache_stats() to get the hits/misses counters. Default is None (disabled).
+        :param checkpoint_op_ids: optional, op ids of the pipeline after which the intermediate samples are cached as well.
+            Caching is incremental - when a sample is not found in the cache, its processing is resumed from the longest cached prefix of the pipeline:
+            either a checkpoint, or the cache of a previous pipeline which is a prefix of the current one (e.g. when ops are appended to the pipeline).
+            Only the remaining ops are then executed. Set a checkpoint after expensive ops (for example after loading the images),
+            to avoid running them again when the following ops are modified.
+            Note that the cache of a different (non prefix) pipeline is still not allowed in the same uniquely named cache -
+            use restart_cache="keep_prefixes" to delete it while keeping the checkpoints.
         :param **audit_kwargs: optional custom kwargs to pass to SampleCachingAudit instance.
             auditing cached samples (usually periodically) is very important, in order to avoid "stale" cached samples.
             To disable pass audit_first_sample=False, audit_rate=None,
@@ -82,18 +114,42 @@ class SamplesCacher:
         else:
             self._read_dirs_logic = custom_read_dirs_callable
 
+        if storage is None:
+            storage = SamplesStorageFiles()
+        self._storage = storage
+
+        if memory_cache_size is not None:
+            self._memory_cache = SamplesMemoryCache(memory_cache_size)
+        else:
+            self._memory_cache = None
+
         self._pipeline = pipeline
         self._pipeline_desc_text = str(pipeline)
         self._pipeline_desc_hash = "hash_" + hashlib.md5(self._pipeline_desc_text.encode("utf-8")).hexdigest()
+        # hashes of the pipeline prefixes (excluding the entire pipeline)
+        self._prefixes_desc_hashes = ["hash_" + h for h in pipeline.get_prefixes_desc_hashes()[:-1]]
+
+        if checkpoint_op_ids is None:
+            checkpoint_op_ids = []
+        op_ids = pipeline.get_op_ids()
+        for op_id in checkpoint_op_ids:
+            if op_id not in op_ids:
+                raise Exception(f"checkpoint op id {op_id} was not found in pipeline op ids {op_ids}")
+        # prefix lengths to cache
+        self._checkpoints = sorted(set(op_ids.index(op_id) + 1 for op_id in checkpoint_op_ids) - {len(op_ids)})
+        # cached prefixes lengths, longest first. Lazily found.
+        self._cached_prefixes = None
 
         self._verbose = verbose
 
         if self._verbose > 0:
             print(f"pipeline description hash for [{unique_name}] is: {self._pipeline_desc_hash}")
 
+        if restart_cache not in [True, False, "keep_prefixes"]:
+            raise Exception(f'restart_cache should be True, False or "keep_prefixes", got {restart_cache}')
         self._restart_cache = restart_cache
         if self._restart_cache:
-            self.delete_cache()
+            self.delete_cache(keep_prefixes=self._restart_cache == "keep_prefixes")
 
         self._audit_kwargs = audit_kwargs
         self._audit = SampleCachingAudit(**self._audit_kwargs)
@@ -114,16 +170,19 @@ class SamplesCacher:
             for found_dir in found_sub_dirs:
                 if not os.path.isdir(found_dir):
                     continue
-                if os.path.basename(found_dir) != self._pipeline_desc_hash:
+                if os.path.basename(found_dir) != self._pipeline_desc_hash and (
+                    os.path.basename(found_dir) not in self._prefixes_desc_hashes
+                ):
                     raise Exception(
                         f"Found samples cache for pipeline hash {os.path.basename(found_dir)} which is different from the current loaded pipeline hash {self._pipeline_desc_hash} !!\n"
                         "This is not allowed, you may only use a single pipeline per uniquely named cache.\n"
-                        'You can use "restart_cache=True" to rebuild the cache or delete the different cache manually.\n'
+                        'You can use "restart_cache=True" to rebuild the cache, "restart_cache=\'keep_prefixes\'" to rebuild it while keeping the caches of the pipeline prefixes, or delete the different cache manually.\n'
                     )
 
-    def delete_cache(self) -> None:
+    def delete_cache(self, keep_prefixes: bool = False) -> None:
         """
         Will delete this specific named cache from all read and write dirs
+        :param keep_prefixes: keep the caches of the prefixes of the current pipeline (checkpoints and caches of previous shorter pipelines)
         """
         dirs_to_delete = self._get_read_dirs() + [self._get_write_dir()]
         dirs_to_delete = list(set(dirs_to_delete))
@@ -142,16 +201,39 @@ class SamplesCacher:
             for found in all_found:
                 if not os.path.isdir(found):
                     continue
+                if keep_prefixes and os.path.basename(found) in self._prefixes_desc_hashes:
+                    continue
                 delete_directory_tree(found)
 
-    def _get_write_dir(self):
+    def _get_write_dir(self, pipeline_desc_hash: Optional[str] = None):
+        """
+        :param pipeline_desc_hash: optional, the hash of a pipeline prefix. By default the hash of the entire pipeline.
+        """
+        if pipeline_desc_hash is None:
+            pipeline_desc_hash = self._pipeline_desc_hash
         ans = self._write_dir_logic(self._cache_dirs)
-        ans = os.path.join(ans, self._pipeline_desc_hash)
+        ans = os.path.join(ans, pipeline_desc_hash)
         return ans
 
-    def _get_read_dirs(self):
+    def _get_read_dirs(self, pipeline_desc_hash: Optional[str] = None):
+        """
+        :param pipeline_desc_hash: optional, the hash of a pipeline prefix. By default the hash of the entire pipeline.
+        """
+        if pipeline_desc_hash is None:
+            pipeline_desc_hash = self._pipeline_desc_hash
         ans = self._read_dirs_logic()
-        ans = [os.path.join(x, self._pipeline_desc_hash) for x in ans]
+        ans = [os.path.join(x, pipeline_desc_hash) for x in ans]
+        return ans
+
+    def _find_cached_prefixes(self) -> List[int]:
+        """
+        :return: the lengths of the pipeline prefixes which have a cache directory, longest first
+        """
+        ans = []
+        for prefix_len in range(len(self._prefixes_desc_hashes), 0, -1):
+            read_dirs = self._get_read_dirs(self._prefixes_desc_hashes[prefix_len - 1])
+            if any(os.path.isdir(d) for d in read_dirs):
+                ans.append(prefix_len)
         return ans
 
     def cache_samples(self, orig_sample_ids: List[Any]) -> List[Tuple[str, Union[None, List[str]], str]]:
@@ -160,6 +242,10 @@ class SamplesCacher:
         returns information that helps to map from original sample id to the resulting sample id
         (an op might return None, discarding a sample, or optional generate different one or more samples from an original single sample_id)
         #TODO: have a single doc location that explains this concept and can be pointed to from any related location
+
+        The progress is recorded in a manifest file which is flushed after every cached sample,
+        so if caching is interrupted, the next call will process only the samples that are not in the manifest.
+        Once the entire set is cached, the information is consolidated into a single file and the manifests are removed.
         """
         # TODO: remember that it means that we need proper extraction of args (pos or kwargs...)
         # possibly by extracting info from __call__ signature or process() if we modify from call to it
@@ -178,27 +264,97 @@ class SamplesCacher:
                 print(f"entire samples set {hash_filename} already cached. Found {fullpath_filename}")
                 return load_pickle(fullpath_filename)
 
-        orig_sid_to_final = OrderedDict()
-        for_global_storage = {"samples_cacher_instance": self}
-        all_ans = run_multiprocessed(
-            SamplesCacher._cache_worker,
-            orig_sample_ids,
-            workers=self._workers,
-            copy_to_global_storage=for_global_storage,
-            verbose=1,
-        )
-
-        for initial_sample_id, output_sample_ids in zip(orig_sample_ids, all_ans):
-            orig_sid_to_final[initial_sample_id] = output_sample_ids
+        # resume from the progress manifests of previous (potentially interrupted) runs
+        completed = self._load_cache_manifests(samples_ids_hash)
+        remaining_sample_ids = [sid for sid in orig_sample_ids if sid not in completed]
+        if self._verbose > 0 and len(completed) > 0:
+            print(
+                f"found {len(orig_sample_ids) - len(remaining_sample_ids)} already cached samples in progress manifests, {len(remaining_sample_ids)} samples remaining"
+            )
 
         write_dir = self._get_write_dir()
         set_info_dir = os.path.join(write_dir, "full_sets_info")
         os.makedirs(set_info_dir, exist_ok=True)
+
+        if len(remaining_sample_ids) > 0:
+            self._cached_prefixes = self._find_cached_prefixes()
+            if self._verbose > 0 and len(self._cached_prefixes) > 0:
+                print(
+                    f"found caches of pipeline prefixes (number of ops) {self._cached_prefixes}, processing will resume from the longest cached prefix"
+                )
+
+            # each process building the cache writes its own manifest
+            manifest_filename = get_randomized_postfix_name(
+                os.path.join(set_info_dir, "samples_ids_hash@" + samples_ids_hash + ".manifest")
+            )
+            start_time = time()
+            for_global_storage = {"samples_cacher_instance": self}
+            all_ans = run_multiprocessed(
+                SamplesCacher._cache_worker,
+                remaining_sample_ids,
+                workers=self._workers,
+                copy_to_global_storage=for_global_storage,
+                verbose=1,
+                keep_results_order=False,
+                as_iterator=True,
+                # each sample is recorded in the manifest as soon as it is cached
+                chunksize=1,
+            )
+            with open(manifest_filename, "ab") as manifest_file:
+                for initial_sample_id, output_sample_ids in all_ans:
+                    completed[initial_sample_id] = output_sample_ids
+                    append_pickle_record(manifest_file, (initial_sample_id, output_sample_ids))
+
+            if self._verbose > 0:
+                elapsed = time() - start_time
+                print(
+                    f"cached {len(remaining_sample_ids)} samples in {elapsed:.1f} seconds ({len(remaining_sample_ids) / max(elapsed, 1e-6):.2f} samples/sec)"
+                )
+
+        orig_sid_to_final = OrderedDict()
+        for initial_sample_id in orig_sample_ids:
+            orig_sid_to_final[initial_sample_id] = completed[initial_sample_id]
+
+        for prefix_len in self._checkpoints:
+            checkpoint_write_dir = self._get_write_dir(self._prefixes_desc_hashes[prefix_len - 1])
+            if os.path.isdir(checkpoint_write_dir):
+                self._storage.finalize(checkpoint_write_dir)
+        self._storage.finalize(write_dir)
         fullpath_filename = os.path.join(set_info_dir, hash_filename)
         save_pickle_safe(orig_sid_to_final, fullpath_filename, compress=True)
 
+        # the progress manifests are no longer required once the full set info is saved
+        for manifest_filename in self._find_cache_manifests(samples_ids_hash):
+            try:
+                os.remove(manifest_filename)
+            except FileNotFoundError:  # removed by another process
+                pass
+
         return orig_sid_to_final
 
+    def _load_cache_manifests(self, samples_ids_hash: str) -> dict:
+        """
+        Loads the progress manifests written by cache_samples() for the samples set.
+        :return: a dictionary mapping original sample id to its output info
+        """
+        ans = {}
+        for manifest_filename in self._find_cache_manifests(samples_ids_hash):
+            with open(manifest_filename, "rb") as f:
+                records, _ = read_pickle_records(f.read())
+            for initial_sample_id, output_sample_ids in records:
+                ans.setdefault(initial_sample_id, output_sample_ids)
+        return ans
+
+    def _find_cache_manifests(self, samples_ids_hash: str) -> List[str]:
+        """
+        :return: the paths of the progress manifests of the samples set, in all of the read dirs and the write dir
+        """
+        ans = set()
+        for curr_dir in self._get_read_dirs() + [self._get_write_dir()]:
+            pattern = os.path.join(curr_dir, "full_sets_info", "samples_ids_hash@" + samples_ids_hash + ".manifest*")
+            ans.update(glob(pattern))
+        return sorted(ans)
+
     @staticmethod
     def get_final_sample_id_hash(sample_id):
         """
@@ -233,8 +389,12 @@ class SamplesCacher:
         """
         :param sample_id: the sample_id of the sample to load
         :param keys: optionally, provide a subset of the keys to load in this sample.
-        This is useful for speeding up loading.
+        This is useful for speeding up loading - only the requested hdf5 datasets will be read and decompressed.
+        A key may also point to a sub-tree (for example "data.cc"), in which case all of the keys under it will be loaded.
+        sample_id and initial_sample_id are always loaded.
         """
+        if keys is not None:
+            keys = _add_sample_id_keys(keys)
 
         sample_from_cache = self._load_sample_from_cache(sample_id, keys)
         audit_required = self._audit.update()
@@ -243,6 +403,8 @@ class SamplesCacher:
             initial_sample_id = get_initial_sample_id(sample_from_cache)
             fresh_sample = self._load_sample_using_pipeline(initial_sample_id, keys)
             fresh_sample = get_specific_sample_from_potentially_morphed(fresh_sample, sample_id)
+            if keys is not None:
+                fresh_sample = fresh_sample.get_multi(keys)
 
             self._audit.audit(sample_from_cache, fresh_sample)
 
@@ -255,27 +417,45 @@ class SamplesCacher:
 
     def _load_sample_from_cache(self, sample_id: Hashable, keys: Optional[Sequence[str]] = None):
         """
-        TODO: add comments
+        Loads a cached sample using the storage backend.
+        :param sample_id: the final sample_id of the sample to load
+        :param keys: optional, load only those keys (or sub-trees)
         """
+        if self._memory_cache is not None:
+            memory_cache_key = (sample_id, None if keys is None else tuple(keys))
+            loaded_sample = self._memory_cache.get(memory_cache_key)
+            if loaded_sample is not None:
+                return loaded_sample
+
         read_dirs = self._get_read_dirs()
         sample_hash = SamplesCacher.get_final_sample_id_hash(sample_id)
 
-        for curr_read_dir in read_dirs:
-            extension_less = os.path.join(curr_read_dir, sample_hash)
-            if os.path.isfile(extension_less + ".pkl.gz"):
-                loaded_sample = NDict(load_pickle(extension_less + ".pkl.gz"))
-                if os.path.isfile(extension_less + ".hdf5"):
-                    loaded_sample_hdf5_part = load_hdf5(extension_less + ".hdf5")
-                    loaded_sample.merge(loaded_sample_hdf5_part)
-                return loaded_sample
+        loaded_sample = self._storage.load_sample(read_dirs, sample_hash, keys)
+        if loaded_sample is None:
+            raise Exception(f"Expected to find a cached sample for sample_id={sample_id} but could not find any!")
+
+        if keys is not None:
+            # verifies that all of the requested keys were found
+            loaded_sample = loaded_sample.get_multi(keys)
 
-        raise Exception(f"Expected to find a cached sample for sample_id={sample_id} but could not find any!")
+        if self._memory_cache is not None:
+            self._memory_cache.put(memory_cache_key, loaded_sample)
+
+        return loaded_sample
+
+    def get_memory_cache_stats(self) -> Optional[dict]:
+        """
+        :return: the in-memory cache hits/misses/evictions counters and size (of the current process), or None if the memory cache is disabled
+        """
+        if self._memory_cache is None:
+            return None
+        return self._memory_cache.get_stats()
 
     @staticmethod
     def _cache_worker(orig_sample_id: Any):
         cacher = get_from_global_storage("samples_cacher_instance")
         ans = cacher._cache(orig_sample_id)
-        return ans
+        return orig_sample_id, ans
 
     def _cache(self, orig_sample_id: Any):
         """
@@ -289,59 +469,125 @@ class SamplesCacher:
         read_dirs = self._get_read_dirs()
 
         was_processed_hash = SamplesCacher.get_orig_sample_id_hash(orig_sample_id)
-        was_processed_fn = was_processed_hash + ".pkl"
 
         # checking in all read directories if information related to this sample(s) was already cached
-        for curr_read_dir in read_dirs:
-            fn = os.path.join(curr_read_dir, was_processed_fn)
-            if os.path.isfile(fn):
-                ans = load_pickle(fn)
-                return ans
-
-        result_sample = self._load_sample_using_pipeline(orig_sample_id)
-
-        if isinstance(result_sample, dict):
-            result_sample = [result_sample]
-
-        if isinstance(result_sample, list):
-            if 0 == len(result_sample):
-                result_sample = None
-            for s in result_sample:
-                set_initial_sample_id(s, orig_sample_id)
+        found, ans = self._storage.load_output_info(read_dirs, was_processed_hash)
+        if found:
+            return ans
+
+        # resume from the longest cached prefix of the pipeline (if any)
+        prefix_len, result_sample = self._load_from_cached_prefix(orig_sample_id)
+        if prefix_len == 0:
+            result_sample = [create_initial_sample(orig_sample_id)]
+
+        # run the rest of the pipeline, caching the intermediate samples in the checkpoints along the way
+        op_ids = self._pipeline.get_op_ids()
+        for next_prefix_len in [c for c in self._checkpoints if c > prefix_len] + [len(op_ids)]:
+            if result_sample is not None:
+                result_sample = self._run_pipeline_segment(result_sample, op_ids, prefix_len, next_prefix_len)
+            prefix_len = next_prefix_len
+            if prefix_len < len(op_ids):
+                checkpoint_write_dir = self._get_write_dir(self._prefixes_desc_hashes[prefix_len - 1])
+                self._save_samples(checkpoint_write_dir, orig_sample_id, result_sample)
+
+        return self._save_samples(write_dir, orig_sample_id, result_sample)
+
+    def _load_from_cached_prefix(self, orig_sample_id: Any) -> Tuple[int, Optional[List[NDict]]]:
+        """
+        Loads the result of the longest cached prefix of the pipeline for the sample
+        :return: the prefix length (0 if not found) and the resulting samples (None if the sample was dropped)
+        """
+        if self._cached_prefixes is None:
+            self._cached_prefixes = self._find_cached_prefixes()
 
-        if not isinstance(result_sample, (list, dict, type(None))):
-            raise Exception(
-                f"Unsupported sample type, got {type(result_sample)}. Supported types are dict, list-of-dicts and None."
+        was_processed_hash = SamplesCacher.get_orig_sample_id_hash(orig_sample_id)
+        for prefix_len in self._cached_prefixes:
+            prefix_read_dirs = self._get_read_dirs(self._prefixes_desc_hashes[prefix_len - 1])
+            found, output_info = self._storage.load_output_info(prefix_read_dirs, was_processed_hash)
+            if not found:
+                continue
+            if output_info is None:
+                return prefix_len, None
+
+            samples = []
+            for sample_id in output_info:
+                sample = self._storage.load_sample(
+                    prefix_read_dirs, SamplesCacher.get_final_sample_id_hash(sample_id), None
+                )
+                if sample is None:
+                    break
+                samples.append(sample)
+            else:
+                return prefix_len, samples
+
+        return 0, None
+
+    def _run_pipeline_segment(
+        self, samples: List[NDict], op_ids: List[str], start_prefix_len: int, end_prefix_len: int
+    ) -> Optional[List[NDict]]:
+        """
+        Runs ops [start_prefix_len, end_prefix_len) of the pipeline on each of the samples
+        :return: the list of resulting samples, or None if the sample was dropped
+        """
+        if start_prefix_len == end_prefix_len:
+            return samples
+
+        ans = []
+        for sample in samples:
+            result_sample = self._pipeline(
+                sample,
+                until_op_id=op_ids[end_prefix_len - 1],
+                start_after_op_id=op_ids[start_prefix_len - 1] if start_prefix_len > 0 else None,
             )
+            # the pipeline drops the entire sample if any of the split samples is dropped
+            if result_sample is None:
+                return None
+            if isinstance(result_sample, dict):
+                result_sample = [result_sample]
+            if not isinstance(result_sample, list):
+                raise Exception(
+                    f"Unsupported sample type, got {type(result_sample)}. Supported types are dict, list-of-dicts and None."
+                )
+            ans.extend(result_sample)
+
+        if len(ans) == 0:
+            return None
+        return ans
 
+    def _save_samples(self, write_dir: str, orig_sample_id: Any, result_sample: Optional[List[NDict]]):
+        """
+        Saves the samples generated from the original sample and the output info mapping the original sample id to them
+        :param result_sample: the result of the pipeline - None if it was dropped, or a list of samples
+        :return: the output info - None or the list of the resulting sample ids
+        """
+        os.makedirs(write_dir, exist_ok=True)
         if result_sample is not None:
             output_info = []
             for curr_sample in result_sample:
+                set_initial_sample_id(curr_sample, orig_sample_id)
                 curr_sample_id = get_sample_id(curr_sample)
                 output_info.append(curr_sample_id)
                 output_sample_hash = SamplesCacher.get_final_sample_id_hash(curr_sample_id)
-
-                requiring_hdf5_keys = _object_requires_hdf5_recurse(curr_sample)
-                if len(requiring_hdf5_keys) > 0:
-                    requiring_hdf5_dict = curr_sample.get_multi(requiring_hdf5_keys)
-                    requiring_hdf5_dict = requiring_hdf5_dict.flatten()
-
-                    hdf5_filename = os.path.join(write_dir, output_sample_hash + ".hdf5")
-                    save_hdf5_safe(hdf5_filename, **requiring_hdf5_dict)
-
-                    # remove all hdf5 entries from the sample_dict that will be pickled
-                    for k in requiring_hdf5_dict:
-                        _ = curr_sample.pop(k)
-
-                save_pickle_safe(curr_sample, os.path.join(write_dir, output_sample_hash + ".pkl.gz"), compress=True)
+                self._storage.save_sample(write_dir, output_sample_hash, curr_sample)
         else:
             output_info = None
-            # requiring_hdf5_keys = None
 
-        save_pickle_safe(output_info, os.path.join(write_dir, was_processed_fn))
+        was_processed_hash = SamplesCacher.get_orig_sample_id_hash(orig_sample_id)
+        self._storage.save_output_info(write_dir, was_processed_hash, output_info)
         return output_info
 
 
+def _add_sample_id_keys(keys: Sequence[str]) -> List[str]:
+    """
+    returns keys extended with sample_id and initial_sample_id keys (if not already included)
+    """
+    ans = list(keys)
+    for k in [get_sample_id_key(), get_initial_sample_id_key()]:
+        if not is_key_requested(k, ans):
+            ans.append(k)
+    return ans
+
+
 def _get_available_write_location(cache_dirs: List[str], max_allowed_used_space=0.95):
     """
     :param cache_dirs: write directories. Directories are checked in order that they are provided.
@@ -0,0 +1,131 @@
+"""
+(C) Copyright 2021 IBM Corp.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from typing import Any, List, Union
+import gzip
+import pickle
+import struct
+
+"""
+Serialization codecs used by the samples cacher storages for the (non large array) part of the cached samples.
+
+Supported codecs:
+"gzip" - the default. Pickle + gzip. Compatible with caches created by previous versions.
+"pickle5" - pickle protocol 5, with out-of-band buffers (arrays and bytes are stored as raw buffers, outside of the pickle stream,
+    and are not copied when loading). No compression. Usually the fastest option.
+"lz4" - "pickle5" + lz4 frame compression. Requires the lz4 package (pip install lz4).
+"zstd" - "pickle5" + zstandard compression. Requires the zstandard package (pip install zstandard).
+"""
+
+CODECS = ["gzip", "pickle5", "lz4", "zstd"]
+
+_CODECS_EXTENSIONS = {
+    "gzip": ".pkl.gz",
+    "pickle5": ".pkl5",
+    "lz4": ".pkl5.lz4",
+    "zstd": ".pkl5.zst",
+}
+
+
+def verify_codec(codec: str) -> None:
+    """
+    raises an exception if the codec is not supported (or its dependencies are not installed)
+    """
+    if codec not in CODECS:
+        raise Exception(f"Unsupported codec {codec}. Supported codecs are {CODECS}")
+    if codec != "gzip" and pickle.HIGHEST_PROTOCOL < 5:
+        raise Exception(f"codec {codec} requires pickle protocol 5 (python>=3.8)")
+    if codec == "lz4":
+        try:
+            import lz4.frame  # noqa
+        except ImportError:
+            raise Exception('codec "lz4" requires the lz4 package: pip install lz4')
+    if codec == "zstd":
+        try:
+            import zstandard  # noqa
+        except ImportError:
+            raise Exception('codec "zstd" requires the zstandard package: pip install zstandard')
+
+
+def get_codec_extension(codec: str) -> str:
+    """
+    returns the filename extension used for the files encoded with the codec
+    """
+    return _CODECS_EXTENSIONS[codec]
+
+
+def encode_object(obj: Any, codec: str) -> bytes:
+    """
+    serializes obj using the codec
+    """
+    if codec == "gzip":
+        return gzip.compress(pickle.dumps(obj))
+
+    data = _pickle5_dumps(obj)
+    if codec == "pickle5":
+        return data
+    if codec == "lz4":
+        import lz4.frame
+
+        return lz4.frame.compress(data)
+    if codec == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor().compress(data)
+
+    raise Exception(f"Unsupported codec {codec}. Supported codecs are {CODECS}")
+
+
+def decode_object(data: Union[bytes, bytearray], codec: str) -> Any:
+    """
+    deserializes data encoded by encode_object().
+    Pass a bytearray to get writable arrays without copying their data (relevant for "pickle5").
+    """
+    if codec == "gzip":
+        return pickle.loads(gzip.decompress(data))
+
+    if codec == "lz4":
+        import lz4.frame
+
+        data = lz4.frame.decompress(data, return_bytearray=True)
+    elif codec == "zstd":
+        import zstandard
+
+        data = bytearray(zstandard.ZstdDecompressor().decompress(data))
+    elif codec != "pickle5":
+        raise Exception(f"Unsupported codec {codec}. Supported codecs are {CODECS}")
+
+    return _pickle5_loads(data)
+
+
+def _pickle5_dumps(obj: Any) -> bytes:
+    """
+    pickles with protocol 5 and out-of-band buffers into a single frame:
+    [number of parts][size of each part][pickle stream][buffer 0][buffer 1]...
+    """
+    buffers = []
+    stream = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    parts = [memoryview(stream)] + [b.raw() for b in buffers]
+    header = struct.pack(f"<Q{len(parts)}Q", len(parts), *[p.nbytes for p in parts])
+    return b"".join([header] + parts)
+
+
+def _pickle5_loads(data: Union[bytes, bytearray]) -> Any:
+    view = memoryview(data)
+    (num_parts,) = struct.unpack_from("<Q", view, 0)
+    sizes = struct.unpack_from(f"<{num_parts}Q", view, 8)
+    pos = 8 * (num_parts + 1)
+    parts: List[memoryview] = []
+    for size in sizes:
+        parts.append(view[pos : pos + size])
+        pos += size
+    return pickle.loads(parts[0], buffers=parts[1:])
@@ -0,0 +1,123 @@
+"""
+(C) Copyright 2021 IBM Corp.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+import sys
+import threading
+
+import numpy as np
+import torch
+
+from fuse.utils.ndict import NDict
+
+
+class SamplesMemoryCache:
+    """
+    In-process LRU cache of loaded samples, limited by a bytes budget.
+    Used by SamplesCacher to avoid reading (and decompressing) the same samples from disk again every epoch.
+
+    Note - the content is per process: each DataLoader worker holds its own copy
+    (with "fork", workers start with the content cached by the main process so far).
+    The content is not pickled, so passing the cacher to a spawned process starts it with an empty memory cache.
+    """
+
+    def __init__(self, max_size_bytes: int):
+        """
+        :param max_size_bytes: the bytes budget. Least recently used samples are evicted once exceeded.
+        """
+        self._max_size_bytes = max_size_bytes
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._samples = OrderedDict()
+        self._size_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __getstate__(self) -> dict:
+        return {"_max_size_bytes": self._max_size_bytes}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def get(self, key: Hashable) -> Optional[NDict]:
+        """
+        :return: a copy of the cached sample, or None if not cached
+        """
+        with self._lock:
+            item = self._samples.get(key, None)
+            if item is None:
+                self._misses += 1
+                return None
+            self._samples.move_to_end(key)
+            self._hits += 1
+            sample, _ = item
+
+        # the returned sample will be modified by the dynamic pipeline
+        return sample.clone(deepcopy=True)
+
+    def put(self, key: Hashable, sample: NDict) -> None:
+        """
+        Stores a copy of the sample. Samples that are larger than the entire budget are not stored.
+        """
+        sample_size = get_sample_size_bytes(sample)
+        if sample_size > self._max_size_bytes:
+            return
+        sample = sample.clone(deepcopy=True)
+        with self._lock:
+            if key in self._samples:
+                self._size_bytes -= self._samples.pop(key)[1]
+            self._samples[key] = (sample, sample_size)
+            self._size_bytes += sample_size
+            while self._size_bytes > self._max_size_bytes:
+                _, (_, evicted_size) = self._samples.popitem(last=False)
+                self._size_bytes -= evicted_size
+                self._evictions += 1
+
+    def get_stats(self) -> dict:
+        """
+        :return: a dictionary with the hits, misses and evictions counters and the current content size
+        """
+        with self._lock:
+            return dict(
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                num_samples=len(self._samples),
+                size_bytes=self._size_bytes,
+                max_size_bytes=self._max_size_bytes,
+            )
+
+
+def get_sample_size_bytes(sample: NDict) -> int:
+    """
+    Estimates the memory used by a sample - the exact size of arrays and tensors, and a shallow estimation for other values
+    """
+    ans = 0
+    for value in sample.flatten().values():
+        ans += _get_value_size_bytes(value)
+    return ans
+
+
+def _get_value_size_bytes(value: Any) -> int:
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, torch.Tensor):
+        return value.element_size() * value.nelement()
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_get_value_size_bytes(v) for v in value)
+    return sys.getsizeof(value)
@@ -0,0 +1,489 @@
+"""
+(C) Copyright 2021 IBM Corp.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+   http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from abc import ABC, abstractmethod
+from typing import Any, List, Optional, Sequence, Tuple
+import io
+import os
+import socket
+import threading
+import uuid
+from glob import glob
+
+import numpy as np
+
+from fuse.data.datasets.caching.object_caching_handlers import _object_requires_hdf5_recurse
+from fuse.data.datasets.caching.samples_codecs import verify_codec, get_codec_extension, encode_object, decode_object
+from fuse.utils.file_io.file_io import (
+    load_hdf5,
+    get_hdf5_keys,
+    save_hdf5_safe,
+    load_pickle,
+    save_pickle_safe,
+    save_npy_safe,
+    save_binary_file_safe,
+    read_binary_file,
+    append_pickle_record,
+    read_pickle_records,
+)
+from fuse.utils.ndict import NDict
+
+"""
+Storage backends used by SamplesCacher.
+A storage backend is responsible for the physical layout of the cache within a (pipeline hash) cache directory:
+ 1. the cached samples - the output of the static pipeline, keyed by the final sample id hash
+ 2. the "output info" of each original sample - the list of final sample ids it was morphed into (or None if it was discarded),
+    keyed by the original sample id hash. It is written last, and used to detect that an original sample was already processed.
+
+Available backends:
+SamplesStorageFiles - the default. Multiple files per sample (a gzipped pickle, an optional hdf5 and an output info pickle).
+SamplesStoragePacked - packs all samples into a few large append-only shard files with an offset index.
+
+Both backends support choosing the codec used to serialize the non array part of the samples, see samples_codecs.py
+"""
+
+
+class SamplesStorageBase(ABC):
+    @abstractmethod
+    def save_sample(self, write_dir: str, sample_hash: str, sample: NDict) -> None:
+        """
+        Stores a single (final) sample
+        :param write_dir: the cache directory to write into
+        :param sample_hash: a unique (within the cache) string identifying the sample, see SamplesCacher.get_final_sample_id_hash()
+        :param sample: the sample to store. Note - the storage is allowed to modify it.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_sample(
+        self, read_dirs: List[str], sample_hash: str, keys: Optional[Sequence[str]] = None
+    ) -> Optional[NDict]:
+        """
+        Loads a single (final) sample
+        :param read_dirs: cache directories to search in, in order
+        :param sample_hash: see save_sample()
+        :param keys: optional, load only those keys (or sub-trees). Set to None to load the entire sample.
+        :return: the loaded sample or None if not found
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_output_info(self, write_dir: str, orig_sample_hash: str, output_info: Optional[List[Any]]) -> None:
+        """
+        Stores the output info (the list of the final sample ids) of an original sample.
+        Called after all of its final samples were stored.
+        :param orig_sample_hash: see SamplesCacher.get_orig_sample_id_hash()
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_output_info(self, read_dirs: List[str], orig_sample_hash: str) -> Tuple[bool, Optional[List[Any]]]:
+        """
+        :return: a tuple (found, output_info)
+        """
+        raise NotImplementedError
+
+    def finalize(self, write_dir: str) -> None:
+        """
+        Called (from the main process) once caching a samples set was completed.
+        """
+        pass
+
+
+class SamplesStorageFiles(SamplesStorageBase):
+    """
+    The default storage - for each final sample: a gzipped (see codec argument) pickle with the small elements and an hdf5 file with the large arrays (if any),
+    and for each original sample a pickle file with its output info.
+
+    Alternatively, set arrays_format="npy" to store each large array in its own raw (uncompressed) npy file.
+    Those are loaded using memory mapping - nothing is decompressed or copied when loading,
+    DataLoader workers share the OS page cache, and an op that accesses only a part of the array (a crop or a slice selection)
+    reads only the relevant pages from disk. The price is larger files on disk.
+    """
+
+    def __init__(self, arrays_format: str = "hdf5", mmap_mode: Optional[str] = "c", codec: str = "gzip"):
+        """
+        :param arrays_format: the format used to store the large arrays of a sample. Supported options are "hdf5" (blosc compressed) and "npy"
+        :param mmap_mode: used only when arrays_format="npy". The mode in which the npy files are memory mapped, see numpy.load().
+            The default, "c" (copy-on-write), allows ops to modify the loaded arrays in place without affecting the cache.
+            Set to None to read the arrays into memory instead.
+        :param codec: the codec used to serialize the non large array part of the samples. See samples_codecs.py for the supported options.
+        """
+        verify_codec(codec)
+        self._codec = codec
+        self._extension = get_codec_extension(codec)
+        _arrays_format_options = ["hdf5", "npy"]
+        if arrays_format not in _arrays_format_options:
+            raise Exception(f"arrays_format must be one of {_arrays_format_options}, got {arrays_format}")
+        self._arrays_format = arrays_format
+        self._mmap_mode = mmap_mode
+
+    def save_sample(self, write_dir: str, sample_hash: str, sample: NDict) -> None:
+        if self._arrays_format == "npy":
+            self._save_sample_npy(write_dir, sample_hash, sample)
+            return
+
+        requiring_hdf5_keys = _object_requires_hdf5_recurse(sample)
+        if len(requiring_hdf5_keys) > 0:
+            requiring_hdf5_dict = sample.get_multi(requiring_hdf5_keys)
+            requiring_hdf5_dict = requiring_hdf5_dict.flatten()
+
+            hdf5_filename = os.path.join(write_dir, sample_hash + ".hdf5")
+            save_hdf5_safe(hdf5_filename, **requiring_hdf5_dict)
+
+            # remove all hdf5 entries from the sample_dict that will be pickled
+            for k in requiring_hdf5_dict:
+                _ = sample.pop(k)
+
+        save_binary_file_safe(
+            os.path.join(write_dir, sample_hash + self._extension), encode_object(sample, self._codec)
+        )
+
+    def load_sample(
+        self, read_dirs: List[str], sample_hash: str, keys: Optional[Sequence[str]] = None
+    ) -> Optional[NDict]:
+        if self._arrays_format == "npy":
+            return self._load_sample_npy(read_dirs, sample_hash, keys)
+
+        for curr_read_dir in read_dirs:
+            extension_less = os.path.join(curr_read_dir, sample_hash)
+            if os.path.isfile(extension_less + self._extension):
+                loaded_sample = NDict(decode_object(read_binary_file(extension_less + self._extension), self._codec))
+                if keys is not None:
+                    loaded_sample = _filter_keys(loaded_sample, keys)
+                if os.path.isfile(extension_less + ".hdf5"):
+                    if keys is None:
+                        loaded_sample_hdf5_part = load_hdf5(extension_less + ".hdf5")
+                    else:
+                        hdf5_keys = [k for k in get_hdf5_keys(extension_less + ".hdf5") if is_key_requested(k, keys)]
+                        loaded_sample_hdf5_part = {}
+                        if len(hdf5_keys) > 0:
+                            loaded_sample_hdf5_part = load_hdf5(
+                                extension_less + ".hdf5", custom_extract={k: None for k in hdf5_keys}
+                            )
+                    loaded_sample.merge(loaded_sample_hdf5_part)
+                return loaded_sample
+
+        return None
+
+    def _save_sample_npy(self, write_dir: str, sample_hash: str, sample: NDict) -> None:
+        arrays_filenames = {}
+        for i, k in enumerate(_object_requires_hdf5_recurse(sample)):
+            arrays_filenames[k] = f"{sample_hash}@{i}.npy"
+            save_npy_safe(os.path.join(write_dir, arrays_filenames[k]), sample.pop(k))
+
+        # the pickled part is written last, so a sample is never partially visible
+        save_binary_file_safe(
+            os.path.join(write_dir, sample_hash + self._extension),
+            encode_object(dict(sample=sample, arrays_filenames=arrays_filenames), self._codec),
+        )
+
+    def _load_sample_npy(
+        self, read_dirs: List[str], sample_hash: str, keys: Optional[Sequence[str]] = None
+    ) -> Optional[NDict]:
+        for curr_read_dir in read_dirs:
+            filename = os.path.join(curr_read_dir, sample_hash + self._extension)
+            if os.path.isfile(filename):
+                loaded = decode_object(read_binary_file(filename), self._codec)
+                loaded_sample = NDict(loaded["sample"])
+                if keys is not None:
+                    loaded_sample = _filter_keys(loaded_sample, keys)
+                for k, array_filename in loaded["arrays_filenames"].items():
+                    if keys is not None and not is_key_requested(k, keys):
+                        continue
+                    loaded_sample[k] = np.load(
+                        os.path.join(curr_read_dir, array_filename), mmap_mode=self._mmap_mode, allow_pickle=False
+                    )
+                return loaded_sample
+
+        return None
+
+    def save_output_info(self, write_dir: str, orig_sample_hash: str, output_info: Optional[List[Any]]) -> None:
+        save_pickle_safe(output_info, os.path.join(write_dir, orig_sample_hash + ".pkl"))
+
+    def load_output_info(self, read_dirs: List[str], orig_sample_hash: str) -> Tuple[bool, Optional[List[Any]]]:
+        for curr_read_dir in read_dirs:
+            fn = os.path.join(curr_read_dir, orig_sample_hash + ".pkl")
+            if os.path.isfile(fn):
+                return True, load_pickle(fn)
+        return False, None
+
+
+class SamplesStoragePacked(SamplesStorageBase):
+    """
+    Packs the samples into a few large append-only shard files, instead of multiple files per sample.
+    Useful for large datasets, and especially when the cache is located on a network file system.
+
+    Each writing process (or thread) appends to its own shard "shard@<unique>.bin", and records the offsets of what it wrote
+    in a matching append-only index file "shard@<unique>.idx".
+    A record is appended to the index only after its data was fully written, and a partially written index record is ignored when loading,
+    so a crash during caching never results in a corrupted sample.
+
+    Once a samples set is fully cached, all of the shard indices are consolidated into a single index file,
+    so opening a cache (in every process) costs a single index read.
+
+    The non-array part of each sample is serialized using the codec (by default a gzipped pickle, as in SamplesStorageFiles),
+    and every large array is stored separately in (uncompressed, 64 bytes aligned) npy format,
+    so a subset of the keys can be loaded without reading the rest, and arrays can optionally be memory mapped directly from the shard.
+    """
+
+    CONSOLIDATED_INDEX_FILENAME = "packed_index.pkl.gz"
+    ARRAYS_ALIGNMENT = 64
+
+    def __init__(self, max_shard_size: int = 4 * 1024**3, mmap_mode: Optional[str] = None, codec: str = "gzip"):
+        """
+        :param max_shard_size: once a shard file reaches this size (in bytes), the writer moves to a new shard
+        :param mmap_mode: optional, set to "r" or "c" (copy-on-write) to load the large arrays as memory maps of the shard files, see numpy.memmap().
+            Set to None (default) to read the arrays into memory.
+        :param codec: the codec used to serialize the non large array part of the samples. See samples_codecs.py for the supported options.
+        """
+        verify_codec(codec)
+        self._codec = codec
+        self._max_shard_size = max_shard_size
+        self._mmap_mode = mmap_mode
+        self._writers = {}
+        self._readers = {}
+        self._indices = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # open files and loaded indices are per process
+        state = self.__dict__.copy()
+        state["_writers"] = {}
+        state["_readers"] = {}
+        state["_indices"] = {}
+        state["_lock"] = None
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def save_sample(self, write_dir: str, sample_hash: str, sample: NDict) -> None:
+        requiring_array_keys = _object_requires_hdf5_recurse(sample)
+        arrays = {}
+        for k in requiring_array_keys:
+            arrays[k] = sample.pop(k)
+
+        segments = {"pickle": encode_object(sample, self._codec)}
+        for k, arr in arrays.items():
+            segments[k] = _npy_dumps(arr)
+
+        writer = self._get_writer(write_dir)
+        entry = {}
+        for name, data in segments.items():
+            offset = writer["data_file"].tell()
+            if name != "pickle" and offset % self.ARRAYS_ALIGNMENT != 0:
+                padding = self.ARRAYS_ALIGNMENT - offset % self.ARRAYS_ALIGNMENT
+                writer["data_file"].write(b"\0" * padding)
+                offset += padding
+            entry[name] = (writer["shard"], offset, len(data))
+            writer["data_file"].write(data)
+        writer["data_file"].flush()
+
+        self._append_index_record(writer, ("sample", sample_hash, entry))
+
+    def load_sample(
+        self, read_dirs: List[str], sample_hash: str, keys: Optional[Sequence[str]] = None
+    ) -> Optional[NDict]:
+        found_dir, entry = self._find(read_dirs, "sample", sample_hash)
+        if entry is None:
+            # the cache might have been extended since we loaded the index
+            found_dir, entry = self._find(read_dirs, "sample", sample_hash, refresh=True)
+            if entry is None:
+                return None
+
+        loaded_sample = NDict(decode_object(self._read(found_dir, *entry["pickle"]), self._codec))
+        if keys is not None:
+            loaded_sample = _filter_keys(loaded_sample, keys)
+        for name, location in entry.items():
+            if name == "pickle":
+                continue
+            if keys is not None and not is_key_requested(name, keys):
+                continue
+            if self._mmap_mode is not None:
+                loaded_sample[name] = _npy_memmap(
+                    os.path.join(found_dir, location[0] + ".bin"), location[1], self._mmap_mode
+                )
+            else:
+                loaded_sample[name] = np.load(io.BytesIO(self._read(found_dir, *location)), allow_pickle=False)
+
+        return loaded_sample
+
+    def save_output_info(self, write_dir: str, orig_sample_hash: str, output_info: Optional[List[Any]]) -> None:
+        writer = self._get_writer(write_dir)
+        self._append_index_record(writer, ("output_info", orig_sample_hash, output_info))
+
+    def load_output_info(self, read_dirs: List[str], orig_sample_hash: str) -> Tuple[bool, Optional[List[Any]]]:
+        for curr_read_dir in read_dirs:
+            index = self._get_index(curr_read_dir)
+            if orig_sample_hash in index["output_info"]:
+                return True, index["output_info"][orig_sample_hash]
+        return False, None
+
+    def finalize(self, write_dir: str) -> None:
+        """
+        Consolidates all of the shard indices into a single index file
+        """
+        self._close_writers()
+        index = self._get_index(write_dir, refresh=True)
+        save_pickle_safe(index, os.path.join(write_dir, self.CONSOLIDATED_INDEX_FILENAME), compress=True)
+
+    ### internal methods
+
+    def _find(
+        self, read_dirs: List[str], record_type: str, key: str, refresh: bool = False
+    ) -> Tuple[Optional[str], Optional[Any]]:
+        for curr_read_dir in read_dirs:
+            index = self._get_index(curr_read_dir, refresh=refresh)
+            if key in index[record_type]:
+                return curr_read_dir, index[record_type][key]
+        return None, None
+
+    def _get_index(self, cache_dir: str, refresh: bool = False) -> dict:
+        """
+        Returns the index of cache_dir, loading it if not loaded yet (or if refresh is set).
+        The consolidated index is loaded first, and then only the parts of the shard indices that were appended after it was created.
+        """
+        with self._lock:
+            index = self._indices.get(cache_dir, None)
+            if index is not None and not refresh:
+                return index
+
+            if index is None:
+                consolidated_filename = os.path.join(cache_dir, self.CONSOLIDATED_INDEX_FILENAME)
+                if os.path.isfile(consolidated_filename):
+                    index = load_pickle(consolidated_filename)
+                else:
+                    index = {"sample": {}, "output_info": {}, "parsed_sizes": {}}
+
+            for idx_filename in glob(os.path.join(cache_dir, "shard@*.idx")):
+                shard_name = os.path.basename(idx_filename)[: -len(".idx")]
+                parsed_size = index["parsed_sizes"].get(shard_name, 0)
+                if os.path.getsize(idx_filename) <= parsed_size:
+                    continue
+                with open(idx_filename, "rb") as f:
+                    f.seek(parsed_size)
+                    content = f.read()
+                records, parsed_bytes = read_pickle_records(content)
+                for record_type, key, value in records:
+                    index[record_type][key] = value
+                index["parsed_sizes"][shard_name] = parsed_size + parsed_bytes
+
+            self._indices[cache_dir] = index
+            return index
+
+    def _read(self, cache_dir: str, shard: str, offset: int, length: int) -> bytearray:
+        """
+        Reads using the file descriptor of the shard without its file position, so threads (see DatasetPrefetch) read concurrently
+        """
+        reader_key = (os.getpid(), cache_dir, shard)
+        f = self._readers.get(reader_key, None)
+        if f is None:
+            with self._lock:
+                f = self._readers.get(reader_key, None)
+                if f is None:
+                    f = open(os.path.join(cache_dir, shard + ".bin"), "rb", buffering=0)
+                    self._readers[reader_key] = f
+        data = bytearray(length)
+        _pread_into(f.fileno(), data, offset)
+        return data
+
+    def _get_writer(self, write_dir: str) -> dict:
+        writer_key = (os.getpid(), threading.get_ident(), write_dir)
+        writer = self._writers.get(writer_key, None)
+        if writer is not None and writer["data_file"].tell() < self._max_shard_size:
+            return writer
+        if writer is not None:
+            writer["data_file"].close()
+            writer["index_file"].close()
+
+        os.makedirs(write_dir, exist_ok=True)
+        shard = f"shard@{socket.gethostname()}_{os.getpid()}_{uuid.uuid4().hex}"
+        writer = dict(
+            shard=shard,
+            data_file=open(os.path.join(write_dir, shard + ".bin"), "ab"),
+            index_file=open(os.path.join(write_dir, shard + ".idx"), "ab"),
+        )
+        self._writers[writer_key] = writer
+        return writer
+
+    def _append_index_record(self, writer: dict, record: tuple) -> None:
+        append_pickle_record(writer["index_file"], record)
+
+    def _close_writers(self) -> None:
+        for writer_key, writer in list(self._writers.items()):
+            if writer_key[0] != os.getpid():
+                continue
+            writer["data_file"].close()
+            writer["index_file"].close()
+            del self._writers[writer_key]
+
+
+def _pread_into(fd: int, data: bytearray, offset: int) -> None:
+    """
+    Reads len(data) bytes from offset into data, without using (or changing) the file position
+    """
+    view = memoryview(data)
+    while len(view) > 0:
+        if hasattr(os, "preadv"):
+            num_bytes = os.preadv(fd, [view], offset)
+        else:
+            chunk = os.pread(fd, len(view), offset)
+            num_bytes = len(chunk)
+            view[:num_bytes] = chunk
+        if num_bytes == 0:
+            raise Exception(f"Unexpected end of file at offset {offset} of a shard, expected {len(view)} more bytes")
+        view = view[num_bytes:]
+        offset += num_bytes
+
+
+def _npy_dumps(arr: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, arr, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def _npy_memmap(filename: str, offset: int, mmap_mode: str) -> np.memmap:
+    """
+    memory maps an npy formatted array which is stored in filename starting at offset
+    """
+    with open(filename, "rb") as f:
+        f.seek(offset)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        elif version == (2, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        else:
+            raise Exception(f"Unsupported npy format version {version} in {filename} at offset {offset}")
+        data_offset = f.tell()
+    return np.memmap(
+        filename, dtype=dtype, mode=mmap_mode, offset=data_offset, shape=shape, order="F" if fortran_order else "C"
+    )
+
+
+def _filter_keys(sample: NDict, keys: Sequence[str]) -> NDict:
+    """
+    returns a new sample, with only the requested keys (or keys nested under them)
+    """
+    return NDict({k: v for k, v in sample.flatten().items() if is_key_requested(k, keys)})
+
+
+def is_key_requested(key: str, requested_keys: Sequence[str]) -> bool:
+    """
+    returns True if key is one of requested_keys, or is nested under one of them
+    """
+    for requested_key in requested_keys:
+        if key == requested_key or key.startswith(requested_key + "."):
+            return True
+    return False
@@ -22,10 +22,13 @@ from fuse.data.pipelines.pipeline_default import PipelineDefault
 from fuse.data import get_sample_id, create_initial_sample
 import numpy as np
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 import os
 from fuse.data.ops.op_base import OpBase
 from typing import List, Union
 from fuse.data.datasets.caching.samples_cacher import SamplesCacher
+from fuse.data.datasets.caching.samples_storage import SamplesStorageFiles, SamplesStoragePacked
+from fuse.data.datasets.caching.samples_codecs import CODECS, verify_codec
 
 from fuse.utils.ndict import NDict
 
@@ -55,6 +58,29 @@ class OpFakeLoad(OpBase):
         return sample_dict
 
 
+class OpCountCalls(OpBase):
+    calls = 0
+
+    def __call__(self, sample_dict: NDict, **kwargs) -> Union[None, dict, List[dict]]:
+        OpCountCalls.calls += 1
+        return sample_dict
+
+
+class OpFailForTest(OpBase):
+    fail_sample_id = None
+
+    def __call__(self, sample_dict: NDict, **kwargs) -> Union[None, dict, List[dict]]:
+        if get_sample_id(sample_dict) == OpFailForTest.fail_sample_id:
+            raise Exception("test - failed to process the sample")
+        return sample_dict
+
+
+class OpSetValue(OpBase):
+    def __call__(self, sample_dict: NDict, val: int) -> Union[None, dict, List[dict]]:
+        sample_dict["data.value"] = val
+        return sample_dict
+
+
 class TestSampleCaching(unittest.TestCase):
     """
     Test sample caching
@@ -89,6 +115,218 @@ class TestSampleCaching(unittest.TestCase):
 
         banana = 123
 
+    def test_load_sample_keys(self):
+        orig_sample_ids = ["case_1", "case_2", "case_3", "case_4"]
+        tmpdir = tempfile.mkdtemp()
+        cache_dirs = [
+            os.path.join(tmpdir, "cache_e"),
+        ]
+
+        pipeline_desc = [
+            (OpFakeLoad(), {}),
+        ]
+        pl = PipelineDefault("example_pipeline", pipeline_desc)
+
+        cacher = SamplesCacher("unittests_cache", pl, cache_dirs, restart_cache=True)
+
+        cacher.cache_samples(orig_sample_ids)
+
+        full_sample = cacher.load_sample("case_1")
+        sample = cacher.load_sample("case_1", keys=["data.gt_labels_style_1", "data.cc"])
+        self.assertEqual(
+            set(sample.keypaths()),
+            {
+                "data.sample_id",
+                "data.initial_sample_id",
+                "data.gt_labels_style_1",
+                "data.cc.img",
+                "data.cc.seg",
+                "data.cc.dicom_tags",
+            },
+        )
+        self.assertTrue(np.array_equal(sample["data.cc.img"], full_sample["data.cc.img"]))
+        self.assertEqual(sample["data.gt_labels_style_1"], full_sample["data.gt_labels_style_1"])
+
+        # keys stored only in the pickled part
+        sample = cacher.load_sample("case_4_subcase_2", keys=["data.mlo.dicom_tags"])
+        self.assertEqual(set(sample.keypaths()), {"data.sample_id", "data.initial_sample_id", "data.mlo.dicom_tags"})
+
+        self.assertRaises(Exception, cacher.load_sample, "case_1", keys=["data.no_such_key"])
+
+    def test_packed_storage(self):
+        orig_sample_ids = ["case_1", "case_2", "case_3", "case_4"]
+        tmpdir = tempfile.mkdtemp()
+        cache_dirs = [
+            os.path.join(tmpdir, "cache_f"),
+        ]
+
+        pipeline_desc = [
+            (OpFakeLoad(), {}),
+        ]
+        pl = PipelineDefault("example_pipeline", pipeline_desc)
+
+        cacher = SamplesCacher(
+            "unittests_cache", pl, cache_dirs, restart_cache=True, workers=2, storage=SamplesStoragePacked()
+        )
+        output_info = cacher.cache_samples(orig_sample_ids)
+        self.assertIsNone(output_info["case_3"])
+        self.assertEqual(output_info["case_4"], ["case_4_subcase_1", "case_4_subcase_2"])
+
+        # all samples are packed into a few shards
+        cache_dir = cacher._get_write_dir()
+        self.assertTrue(os.path.isfile(os.path.join(cache_dir, SamplesStoragePacked.CONSOLIDATED_INDEX_FILENAME)))
+        self.assertEqual(len([f for f in os.listdir(cache_dir) if f.endswith(".hdf5") or f.endswith(".pkl.gz")]), 1)
+
+        # a new cacher instance reads everything from the consolidated index
+        cacher = SamplesCacher("unittests_cache", pl, cache_dirs, storage=SamplesStoragePacked())
+        self.assertEqual(cacher.cache_samples(orig_sample_ids), output_info)
+
+        sample = cacher.load_sample("case_4_subcase_1")
+        expected_sample = _generate_sample_1(41)
+        for k in expected_sample.keypaths():
+            self.assertTrue(np.array_equal(np.asarray(sample[k]), np.asarray(expected_sample[k])))
+
+        sample = cacher.load_sample("case_2", keys=["data.cc.img", "data.gt_labels_style_1"])
+        self.assertEqual(
+            set(sample.keypaths()),
+            {"data.sample_id", "data.initial_sample_id", "data.cc.img", "data.gt_labels_style_1"},
+        )
+        self.assertTrue(np.array_equal(sample["data.cc.img"], _generate_sample_2()["data.cc.img"]))
+
+        # concurrent reads of the same shard (e.g. by DatasetPrefetch threads)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            samples = list(executor.map(cacher.load_sample, ["case_1", "case_2", "case_4_subcase_1"] * 20))
+        for sample in samples:
+            expected_sample = cacher.load_sample(sample["data.sample_id"])
+            for k in expected_sample.keypaths():
+                self.assertTrue(np.array_equal(np.asarray(sample[k]), np.asarray(expected_sample[k])))
+
+    def test_memory_mapped_arrays(self):
+        orig_sample_ids = ["case_1", "case_2", "case_3", "case_4"]
+        pipeline_desc = [
+            (OpFakeLoad(), {}),
+        ]
+        pl = PipelineDefault("example_pipeline", pipeline_desc)
+
+        for storage in [SamplesStorageFiles(arrays_format="npy"), SamplesStoragePacked(mmap_mode="c")]:
+            tmpdir = tempfile.mkdtemp()
+            cacher = SamplesCacher("unittests_cache", pl, [tmpdir], restart_cache=True, storage=storage)
+            cacher.cache_samples(orig_sample_ids)
+
+            sample = cacher.load_sample("case_2")
+            expected_sample = _generate_sample_2()
+            self.assertIsInstance(sample["data.mlo.seg"], np.memmap)
+            for k in expected_sample.keypaths():
+                self.assertTrue(np.array_equal(np.asarray(sample[k]), np.asarray(expected_sample[k])))
+
+            # copy-on-write - modifying a loaded array doesn't affect the cache
+            sample["data.cc.img"][0, 0, 0] = -1.0
+            sample = cacher.load_sample("case_2", keys=["data.cc.img"])
+            self.assertEqual(sample["data.cc.img"][0, 0, 0], expected_sample["data.cc.img"][0, 0, 0])
+
+    def test_memory_cache(self):
+        orig_sample_ids = ["case_1", "case_2", "case_3", "case_4"]
+        tmpdir = tempfile.mkdtemp()
+        pipeline_desc = [
+            (OpFakeLoad(), {}),
+        ]
+        pl = PipelineDefault("example_pipeline", pipeline_desc)
+
+        # not enough for all of the samples
+        cacher = SamplesCacher("unittests_cache", pl, [tmpdir], restart_cache=True, memory_cache_size=80 * 1024**2)
+        cacher.cache_samples(orig_sample_ids)
+
+        sample = cacher.load_sample("case_1")
+        sample["data.cc.img"][:] = 0  # must not affect the memory cached sample
+        sample = cacher.load_sample("case_1")
+        self.assertTrue(np.array_equal(sample["data.cc.img"], _generate_sample_1()["data.cc.img"]))
+        stats = cacher.get_memory_cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+        cacher.load_sample("case_2")
+        cacher.load_sample("case_4_subcase_1")
+        cacher.load_sample("case_4_subcase_2")
+        stats = cacher.get_memory_cache_stats()
+        self.assertGreater(stats["evictions"], 0)
+        self.assertLessEqual(stats["size_bytes"], stats["max_size_bytes"])
+
+        # the most recently used sample is still cached
+        cacher.load_sample("case_4_subcase_2")
+        self.assertEqual(cacher.get_memory_cache_stats()["hits"], 2)
+
+    def test_resume_from_manifest(self):
+        orig_sample_ids = ["case_1", "case_2", "case_3", "case_4"]
+        tmpdir = tempfile.mkdtemp()
+        pipeline_desc = [
+            (OpCountCalls(), {}),
+            (OpFailForTest(), {}),
+            (OpFakeLoad(), {}),
+        ]
+        pl = PipelineDefault("example_pipeline", pipeline_desc)
+
+        # an interrupted run - fails while processing the third sample
+        OpCountCalls.calls = 0
+        OpFailForTest.fail_sample_id = "case_3"
+        cacher = SamplesCacher("unittests_cache", pl, [tmpdir], restart_cache=True, workers=0)
+        self.assertRaises(Exception, cacher.cache_samples, orig_sample_ids)
+        self.assertEqual(OpCountCalls.calls, 3)
+        set_info_dir = os.path.join(cacher._get_write_dir(), "full_sets_info")
+        self.assertEqual(len([f for f in os.listdir(set_info_dir) if ".manifest" in f]), 1)
+
+        # the samples in the manifest must not be processed again
+        OpFailForTest.fail_sample_id = None
+        cacher = SamplesCacher("unittests_cache", pl, [tmpdir], workers=0)
+        output_info = cacher.cache_samples(orig_sample_ids)
+        self.assertEqual(OpCountCalls.calls, 5)
+        self.assertEqual(list(output_info.keys()), orig_sample_ids)
+        self.assertIsNone(output_info["case_3"])
+        self.assertEqual(output_info["case_4"], ["case_4_subcase_1", "case_4_subcase_2"])
+
+        # the manifests are removed once the full set info is saved
+        self.assertListEqual([f for f in os.listdir(set_info_dir) if ".manifest" in f], [])
+        self.assertEqual(cacher.cache_samples(orig_sample_ids), output_info)
+        self.assertEqual(OpCountCalls.calls, 5)
+
+    def test_codecs(self):
+        orig_sample_ids = ["case_1", "case_2", "case_3", "case_4"]
+        pipeline_desc = [
+            (OpFakeLoad(), {}),
+        ]
+        pl = PipelineDefault("example_pipeline", pipeline_desc)
+
+        available_codecs = []
+        for codec in CODECS:
+            try:
+                verify_codec(codec)
+                available_codecs.append(codec)
+            except Exception:
+                pass
+
+        for codec in available_codecs:
+            for storage in [
+                SamplesStorageFiles(codec=codec),
+                SamplesStorageFiles(arrays_format="npy", codec=codec),
+                SamplesStoragePacked(codec=codec),
+            ]:
+                tmpdir = tempfile.mkdtemp()
+                cacher = SamplesCacher(
+                    "unittests_cache",
+                    pl,
+                    [os.path.join(tmpdir, "cache_c")],
+                    restart_cache=True,
+                    workers=0,
+                    storage=storage,
+                )
+                cacher.cache_samples(orig_sample_ids)
+
+                for sample_id, expected_sample in [
+                    ("case_1", _generate_sample_1()),
+                    ("case_4_subcase_2", _generate_sample_2(42)),
+                ]:
+                    sample = cacher.load_sample(sample_id)
+                    for k in expected_sample.keypaths():
+                        self.assertTrue(np.array_equal(np.asarray(sample[k]), np.asarray(expected_sample[k])))
+
     def test_same_uniquely_named_cache_and_multiple_pipeline_hashes(self):
         orig_sample_ids = ["case_1", "case_2", "case_3", "case_4"]
         tmpdir = tempfile.mkdtemp()
@@ -106,13 +344,52 @@ class TestSampleCaching(unittest.TestCase):
         cacher.cache_samples(orig_sample_ids)
 
         ### now, we modify the pipeline and we DO NOT set restart_cache, to verify an exception is thrown
+        # (appending ops is allowed - the previous pipeline is a prefix of the new one, so modifying the op kwargs instead)
         pipeline_desc = [
-            (OpFakeLoad(), {}),
-            (OpFakeLoad(), {}),  ###just doubled it to change the pipeline hash
+            (OpFakeLoad(), {"modified": True}),  ###just changed the kwargs to change the pipeline hash
         ]
         pl = PipelineDefault("example_pipeline", pipeline_desc)
         self.assertRaises(Exception, SamplesCacher, "unittests_cache", pl, cache_dirs, restart_cache=False)
 
+    def test_incremental_caching(self):
+        orig_sample_ids = ["case_1", "case_2", "case_3", "case_4"]
+        tmpdir = tempfile.mkdtemp()
+        cache_dirs = [os.path.join(tmpdir, "cache_i")]
+
+        OpCountCalls.calls = 0
+        pl = PipelineDefault("example_pipeline", [(OpCountCalls(), {}), (OpFakeLoad(), {})])
+        cacher = SamplesCacher("unittests_cache", pl, cache_dirs, restart_cache=True, checkpoint_op_ids=["0"])
+        output_info = cacher.cache_samples(orig_sample_ids)
+        self.assertEqual(OpCountCalls.calls, 4)
+
+        # appending an op - resumes from the cache of the previous pipeline, without running the first ops again
+        pl = PipelineDefault("example_pipeline", [(OpCountCalls(), {}), (OpFakeLoad(), {}), (OpSetValue(), {"val": 1})])
+        # (disabling the audit which runs the entire pipeline)
+        cacher = SamplesCacher("unittests_cache", pl, cache_dirs, audit_first_sample=False, audit_rate=None)
+        self.assertEqual(cacher.cache_samples(orig_sample_ids), output_info)
+        self.assertEqual(OpCountCalls.calls, 4)
+        sample = cacher.load_sample("case_4_subcase_2")
+        self.assertEqual(sample["data.value"], 1)
+        self.assertTrue(np.array_equal(sample["data.cc.img"], _generate_sample_2(42)["data.cc.img"]))
+        appended_pipeline_write_dir = cacher._get_write_dir()
+
+        # modifying the kwargs of the last op - the cache of the previous (non prefix) pipeline is not allowed,
+        # restart_cache="keep_prefixes" deletes it and resumes from the checkpoint
+        pl = PipelineDefault("example_pipeline", [(OpCountCalls(), {}), (OpFakeLoad(), {}), (OpSetValue(), {"val": 2})])
+        self.assertRaises(Exception, SamplesCacher, "unittests_cache", pl, cache_dirs)
+        cacher = SamplesCacher(
+            "unittests_cache", pl, cache_dirs, restart_cache="keep_prefixes", audit_first_sample=False, audit_rate=None
+        )
+        self.assertFalse(os.path.exists(appended_pipeline_write_dir))
+        self.assertEqual(cacher.cache_samples(orig_sample_ids), output_info)
+        self.assertEqual(OpCountCalls.calls, 4)
+        self.assertEqual(cacher.load_sample("case_1")["data.value"], 2)
+
+        # and again, without restarting the cache
+        cacher = SamplesCacher("unittests_cache", pl, cache_dirs, audit_first_sample=False, audit_rate=None)
+        self.assertEqual(cacher.cache_samples(orig_sample_ids), output_info)
+        self.assertEqual(OpCountCalls.calls, 4)
+
     def tearDown(self):
         pass
 
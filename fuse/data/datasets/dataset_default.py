@@ -25,6 +25,7 @@ from fuse.data.ops.ops_common import OpCollectMarker
 from fuse.data.pipelines.pipeline_default import PipelineDefault
 from fuse.data.datasets.caching.samples_cacher import SamplesCacher
 from fuse.utils.ndict import NDict
+from fuse.utils.cpu_profiling.ops_profiler import OpsProfiler
 from fuse.utils.multiprocessing.run_multiprocessed import run_multiprocessed, get_from_global_storage
 from fuse.data import get_sample_id, create_initial_sample, get_specific_sample_from_potentially_morphed
 import copy
@@ -58,6 +59,10 @@ class DatasetDefault(DatasetBase):
         self._cacher = cacher
         self._orig_sample_ids = sample_ids
         self._allow_uncached_sample_morphing = allow_uncached_sample_morphing
+        # collect marker name -> (dynamic pipeline version, collect marker info). See _get_collect_marker_info()
+        self._collect_marker_info_cache = {}
+        # optional instrumentation - see set_profiler()
+        self._profiler = None
 
         # verify unique names for dynamic pipelines
         if self._dynamic_pipeline is not None and self._static_pipeline is not None:
@@ -144,6 +149,16 @@ class DatasetDefault(DatasetBase):
         """
         return self.getitem(item)
 
+    def set_profiler(self, profiler: Optional[OpsProfiler]) -> None:
+        """
+        Opt-in instrumentation: record the cost of each op of the static and dynamic pipelines and of loading the samples from the cache.
+        Call before create() to profile the caching as well. See OpsProfiler.
+        :param profiler: OpsProfiler instance or None to disable
+        """
+        self._profiler = profiler
+        self._static_pipeline.set_profiler(profiler)
+        self._dynamic_pipeline.set_profiler(profiler)
+
     def getitem(
         self,
         item: Union[int, Hashable],
@@ -157,6 +172,17 @@ class DatasetDefault(DatasetBase):
         :param keys: Optional, return just the specified keys or everything available if set to None
         :return: sample_dict
         """
+        sample = self.getitem_static(item, collect_marker_name)
+        return self.getitem_dynamic(sample, collect_marker_name, keys)
+
+    def getitem_static(self, item: Union[int, Hashable], collect_marker_name: Optional[str] = None) -> NDict:
+        """
+        The first part of getitem() - get the output of the static pipeline, read from cache if possible.
+        Useful to read samples ahead of time (see DatasetPrefetch), typically this is the part dominated by I/O.
+        :param item: either int representing sample index or sample_id
+        :param collect_marker_name: Optional, specify name of collect marker op to optimize the running time
+        :return: sample_dict, to be processed by getitem_dynamic()
+        """
         if not self._created:
             raise Exception("you must first call create()")
 
@@ -171,7 +197,12 @@ class DatasetDefault(DatasetBase):
 
         # read sample
         if self._cacher is not None:
-            sample = self._cacher.load_sample(sample_id, collect_marker_info["static_keys_deps"])
+            if self._profiler is None:
+                sample = self._cacher.load_sample(sample_id, collect_marker_info["static_keys_deps"])
+            else:
+                profiler_state = self._profiler.start()
+                sample = self._cacher.load_sample(sample_id, collect_marker_info["static_keys_deps"])
+                self._profiler.stop(profiler_state, "cacher.load_sample", type(self._cacher).__name__, sample)
 
         if self._cacher is None:
             if not self._allow_uncached_sample_morphing:
@@ -189,6 +220,24 @@ class DatasetDefault(DatasetBase):
                 assert sample is not None
                 sample = get_specific_sample_from_potentially_morphed(sample, sample_id)
 
+        return sample
+
+    def getitem_dynamic(
+        self,
+        sample: NDict,
+        collect_marker_name: Optional[str] = None,
+        keys: Optional[Sequence[str]] = None,
+    ) -> NDict:
+        """
+        The second part of getitem() - apply the dynamic pipeline on a sample returned by getitem_static()
+        :param sample: the output of getitem_static()
+        :param collect_marker_name: Optional, specify name of collect marker op to optimize the running time
+        :param keys: Optional, return just the specified keys or everything available if set to None
+        :return: sample_dict
+        """
+        # get collect marker info
+        collect_marker_info = self._get_collect_marker_info(collect_marker_name)
+
         sample = self._dynamic_pipeline(sample, until_op_id=collect_marker_info["op_id"])
 
         if not isinstance(sample, dict):
@@ -221,12 +270,15 @@ class DatasetDefault(DatasetBase):
         workers: int = 10,
         verbose: int = 1,
         mp_context: Optional[str] = None,
+        shared_memory_min_bytes: Optional[int] = None,
         **kwargs,
     ) -> List[Dict]:
         """
         See super class
         :param workers: number of processes to read the data. set to 0 to not use multi processing (useful when debugging).
         :param mp_context: "fork", "spawn", "thread" or None for multiprocessing default
+        :param shared_memory_min_bytes: if set, arrays / tensors of at least this size (in bytes) are returned from the worker processes
+            via shared memory instead of being pickled. See run_multiprocessed().
         """
         if items is None:
             sample_ids = self._final_sample_ids
@@ -242,6 +294,7 @@ class DatasetDefault(DatasetBase):
             workers=workers,
             verbose=verbose,
             mp_context=mp_context,
+            shared_memory_min_bytes=shared_memory_min_bytes,
         )
         return list_sample_dict
 
@@ -289,9 +342,23 @@ class DatasetDefault(DatasetBase):
         if collect_marker_name is None:
             return {"name": None, "op_id": None, "static_keys_deps": None}
 
+        # the position of the collect marker is cached until the dynamic pipeline is modified
+        version = self._dynamic_pipeline.get_version()
+        cached_version, collect_marker_info = self._collect_marker_info_cache.get(collect_marker_name, (None, None))
+        if cached_version != version:
+            collect_marker_info = self._find_collect_marker_info(collect_marker_name)
+            self._collect_marker_info_cache[collect_marker_name] = (version, collect_marker_info)
+        return collect_marker_info
+
+    def _find_collect_marker_info(self, collect_marker_name: str) -> dict:
+        """
+        Scans the dynamic pipeline for the collect marker - see _get_collect_marker_info()
+        """
         # find the required collect markers and extract the info
         collect_marker_info = None
-        for (op, _), op_id in reversed(zip(self._dynamic_pipeline.ops_and_kwargs, self._dynamic_pipeline._op_ids)):
+        for (op, _), op_id in reversed(
+            list(zip(self._dynamic_pipeline._ops_and_kwargs, self._dynamic_pipeline._op_ids))
+        ):
             if isinstance(op, OpCollectMarker):
                 collect_marker_info_cur = op.get_info()
                 if collect_marker_info_cur["name"] == collect_marker_name:
@@ -302,10 +369,10 @@ class DatasetDefault(DatasetBase):
                     else:
                         # throw an error if found more than one collect marker
                         raise Exception(
-                            f"Error: two collect markers with name {collect_marker_info} found in dynamic pipeline"
+                            f"Error: two collect markers with name {collect_marker_name} found in dynamic pipeline"
                         )
         if collect_marker_info is None:
-            raise Exception(f"Error: didn't find collect marker with name {collect_marker_info} in dynamic pipeline.")
+            raise Exception(f"Error: didn't find collect marker with name {collect_marker_name} in dynamic pipeline.")
 
         return collect_marker_info
 
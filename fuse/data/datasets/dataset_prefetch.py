@@ -0,0 +1,126 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Hashable, Iterable, Iterator, List, Optional, Sequence, Union
+import os
+
+from torch.utils.data import Dataset
+
+from fuse.data.datasets.dataset_default import DatasetDefault
+from fuse.utils.ndict import NDict
+
+
+class DatasetPrefetch(Dataset):
+    """
+    Wraps DatasetDefault, and reads the static part of upcoming samples (typically I/O bound - reading from the samples cache)
+    on a background thread pool, while the current sample is processed by the dynamic pipeline.
+
+    Usage with a batch sampler - each DataLoader worker gets an entire batch (using __getitems__),
+    so all of the batch samples are read in parallel while the dynamic pipeline processes them one by one:
+        dataset = DatasetPrefetch(dataset, num_threads=4)
+        dl = DataLoader(dataset, batch_sampler=BatchSamplerDefault(...), collate_fn=CollateDefault(), num_workers=8)
+
+    Or, to iterate samples in a given order (reading up to num_prefetch samples ahead):
+        for sample in DatasetPrefetch(dataset).iter_items(items_order):
+            ...
+    """
+
+    def __init__(
+        self,
+        dataset: DatasetDefault,
+        num_threads: int = 4,
+        num_prefetch: int = 16,
+        collect_marker_name: Optional[str] = None,
+        keys: Optional[Sequence[str]] = None,
+    ):
+        """
+        :param dataset: the dataset to wrap
+        :param num_threads: number of background threads reading samples
+        :param num_prefetch: maximum number of samples read ahead (and held in memory) in iter_items()
+        :param collect_marker_name: Optional, passed to DatasetDefault.getitem() - see OpCollectMarker
+        :param keys: Optional, passed to DatasetDefault.getitem() - return just the specified keys
+        """
+        super().__init__()
+        self._dataset = dataset
+        self._num_threads = num_threads
+        self._num_prefetch = max(num_prefetch, 1)
+        self._collect_marker_name = collect_marker_name
+        self._keys = keys
+
+        self._executor = None
+        self._executor_pid = None
+
+    def __getstate__(self) -> dict:
+        # the thread pool is per process
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        state["_executor_pid"] = None
+        return state
+
+    def __len__(self) -> int:
+        return len(self._dataset)
+
+    def __getitem__(self, item: Union[int, Hashable, List[Union[int, Hashable]]]) -> Union[NDict, List[NDict]]:
+        """
+        :param item: either int representing sample index, a sample_id, or a list of those (when used with batch_size=None and a batch sampler)
+        :return: sample_dict or a list of sample_dict
+        """
+        if isinstance(item, list):
+            return self.__getitems__(item)
+        return self._dataset.getitem(item, self._collect_marker_name, self._keys)
+
+    def __getitems__(self, items: List[Union[int, Hashable]]) -> List[NDict]:
+        """
+        Reads an entire batch, overlapping reading the static part of the samples with running the dynamic pipeline.
+        Used by DataLoader (when using auto collation)
+        """
+        return list(self.iter_items(items))
+
+    def iter_items(self, items: Iterable[Union[int, Hashable]]) -> Iterator[NDict]:
+        """
+        Iterates the samples in the provided order, while reading up to num_prefetch samples ahead in background threads
+        :param items: either int representing sample index or sample_id
+        """
+        executor = self._get_executor()
+        pending = deque()
+        items_iter = iter(items)
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < self._num_prefetch:
+                    try:
+                        item = next(items_iter)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending.append(executor.submit(self._dataset.getitem_static, item, self._collect_marker_name))
+
+                if len(pending) == 0:
+                    return
+
+                sample = pending.popleft().result()
+                yield self._dataset.getitem_dynamic(sample, self._collect_marker_name, self._keys)
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self._num_threads)
+            self._executor_pid = os.getpid()
+        return self._executor
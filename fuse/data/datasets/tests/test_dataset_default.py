@@ -29,6 +29,7 @@ from fuse.data.ops.op_base import OpBase
 from typing import List, Union, Optional
 from fuse.data.datasets.caching.samples_cacher import SamplesCacher
 from fuse.data.datasets.dataset_default import DatasetDefault
+from fuse.data.ops.ops_common import OpCollectMarker
 from fuse.utils.ndict import NDict
 
 
@@ -213,6 +214,45 @@ class TestDatasetDefault(unittest.TestCase):
         self.assertEqual(sample_from_cached["data"]["cc"]["img"].sum(), 50012.88698394645)
         banana = 123
 
+    def test_get_multi_with_collect_marker(self):
+        tmpdir = tempfile.mkdtemp()
+        cache_dirs = [
+            os.path.join(tmpdir, "cache_a"),
+        ]
+
+        static_pl = PipelineDefault(
+            "static_pipeline",
+            [
+                (OpFakeLoad(), {}),
+            ],
+        )
+        dynamic_pl = PipelineDefault(
+            "dynamic_pipeline",
+            [
+                (OpCollectMarker(name="labels", static_key_deps=["data.gt_labels_style_2"]), {}),
+                (OpPrintContents(), {}),
+            ],
+        )
+
+        orig_sample_ids = ["case_1", "case_2"]
+        cacher = SamplesCacher("dataset_test_cache", static_pl, cache_dirs, restart_cache=True)
+
+        ds_cached = DatasetDefault(
+            orig_sample_ids,
+            static_pl,
+            dynamic_pipeline=dynamic_pl,
+            cacher=cacher,
+        )
+        ds_cached.create(num_workers=0)
+
+        samples = ds_cached.get_multi(workers=0, collect_marker_name="labels")
+        self.assertEqual(len(samples), 2)
+        for sample in samples:
+            self.assertEqual(
+                set(sample.keypaths()), {"data.sample_id", "data.initial_sample_id", "data.gt_labels_style_2"}
+            )
+        self.assertTrue(np.array_equal(samples[1]["data.gt_labels_style_2"], np.array([8, 14, 11, 1])))
+
     def tearDown(self):
         pass
 
@@ -0,0 +1,80 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import unittest
+import tempfile
+
+import numpy as np
+from torch.utils.data import DataLoader
+from torch.utils.data.sampler import BatchSampler, SequentialSampler
+
+from fuse.data import get_sample_id
+from fuse.data.ops.op_base import OpBase
+from fuse.data.pipelines.pipeline_default import PipelineDefault
+from fuse.data.datasets.caching.samples_cacher import SamplesCacher
+from fuse.data.datasets.dataset_default import DatasetDefault
+from fuse.data.datasets.dataset_prefetch import DatasetPrefetch
+from fuse.data.utils.collates import CollateDefault
+from fuse.utils.ndict import NDict
+
+
+class OpFakeLoad(OpBase):
+    def __call__(self, sample_dict: NDict) -> NDict:
+        sid = get_sample_id(sample_dict)
+        sample_dict["data.img"] = np.full((10, 20), sid, dtype=np.float32)
+        sample_dict["data.label"] = sid % 2
+        return sample_dict
+
+
+class OpAddOne(OpBase):
+    def __call__(self, sample_dict: NDict) -> NDict:
+        sample_dict["data.img"] = sample_dict["data.img"] + 1
+        return sample_dict
+
+
+class TestDatasetPrefetch(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp()
+        static_pl = PipelineDefault("static", [(OpFakeLoad(), {})])
+        dynamic_pl = PipelineDefault("dynamic", [(OpAddOne(), {})])
+        cacher = SamplesCacher("prefetch_test_cache", static_pl, tmpdir, restart_cache=True)
+        self.dataset = DatasetDefault(list(range(20)), static_pl, dynamic_pl, cacher=cacher)
+        self.dataset.create()
+
+    def test_iter_items(self):
+        order = [5, 3, 19, 0, 7, 7, 12]
+        prefetch_dataset = DatasetPrefetch(self.dataset, num_threads=3, num_prefetch=4)
+        samples = list(prefetch_dataset.iter_items(order))
+        self.assertEqual([get_sample_id(s) for s in samples], order)
+        for sid, sample in zip(order, samples):
+            self.assertTrue(np.all(sample["data.img"] == sid + 1))
+
+    def test_dataloader(self):
+        prefetch_dataset = DatasetPrefetch(self.dataset, num_threads=2, keys=["data.sample_id", "data.img"])
+        batch_sampler = BatchSampler(SequentialSampler(prefetch_dataset), batch_size=6, drop_last=False)
+        dl = DataLoader(prefetch_dataset, batch_sampler=batch_sampler, collate_fn=CollateDefault(), num_workers=2)
+        sample_ids = []
+        for batch in dl:
+            self.assertTrue("data.label" not in batch)
+            for sid, img in zip(batch["data.sample_id"], batch["data.img"]):
+                self.assertTrue((img == sid + 1).all())
+            sample_ids.extend(batch["data.sample_id"])
+        self.assertEqual(sample_ids, list(range(20)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,12 @@
 import inspect
-from typing import Callable, Any, Type, Optional, Sequence
-from inspect import stack
+from typing import Callable, Any, Dict, Tuple, Type, Optional, Sequence
+from types import CodeType
 import warnings
 
+# memoized source code (and module description) per code object - see get_source_cached()
+_SOURCE_CACHE: Dict[CodeType, str] = {}
+_FUNCTION_DESC_CACHE: Dict[CodeType, Tuple[str, str]] = {}
+
 
 def get_function_call_str(func, *_args, **_kwargs) -> str:
     """
@@ -21,14 +25,61 @@ def get_function_call_str(func, *_args, **_kwargs) -> str:
 
     args_flat_str = func.__name__ + "@"
     args_flat_str += "@".join(["{}@{}".format(str(k), value_to_string(kwargs[k])) for k in sorted(kwargs.keys())])
-    args_flat_str += "@" + str(
-        inspect.getmodule(func)
+    module_str, source = _get_function_module_and_source(func)
+    args_flat_str += (
+        "@" + module_str
     )  # adding full (including scope) name of the function, for the case of multiple functions with the same name
-    args_flat_str += "@" + inspect.getsource(func)  # considering the source code (first level of it...)
+    args_flat_str += "@" + source  # considering the source code (first level of it...)
 
     return args_flat_str
 
 
+def _get_function_module_and_source(func: Callable) -> Tuple[str, str]:
+    """
+    :return: str(inspect.getmodule(func)) and inspect.getsource(func), memoized per code object
+    """
+    code = _get_code(func)
+    if code is None:
+        return str(inspect.getmodule(func)), inspect.getsource(func)
+    ans = _FUNCTION_DESC_CACHE.get(code, None)
+    if ans is None:
+        ans = (str(inspect.getmodule(func)), get_source_cached(func))
+        _FUNCTION_DESC_CACHE[code] = ans
+    return ans
+
+
+def get_source_cached(obj: Any) -> str:
+    """
+    Same as inspect.getsource(obj), but memoized per code object - so the source file is read and parsed once per process.
+    Supports functions, methods, frames and code objects (other objects are not memoized).
+    Note - source code modifications made while the process is running will not be noticed.
+    """
+    code = _get_code(obj)
+    if code is None:
+        return inspect.getsource(obj)
+    ans = _SOURCE_CACHE.get(code, None)
+    if ans is None:
+        ans = inspect.getsource(code)
+        _SOURCE_CACHE[code] = ans
+    return ans
+
+
+def _get_code(obj: Any) -> Optional[CodeType]:
+    """
+    :return: the code object inspect.getsource() reads the source of, or None if not supported
+    """
+    if inspect.ismethod(obj):
+        obj = obj.__func__
+    if inspect.isfunction(obj):
+        obj = inspect.unwrap(obj)
+        return obj.__code__ if inspect.isfunction(obj) else None
+    if inspect.isframe(obj):
+        return obj.f_code
+    if inspect.iscode(obj):
+        return obj
+    return None
+
+
 def value_to_string(val: Any, warn_on_types: Optional[Sequence] = None) -> str:
     """
     Used by default in several caching related hash builders.
@@ -102,13 +153,26 @@ def get_callers_string_description(
     """
 
     str_desc = ""
+    # walking the frames directly (and only the required ones) - inspect.stack() is slow since it reads the source context of every frame in the stack
+    frame = inspect.currentframe()
+    curr_frame = None
+    curr_locals = None
     try:
-        curr_stack = stack()
-        curr_locals = None
         # note: frame 0 is this function, frame 1 is whoever called this (and wanted to know about its callers),
         # so both frames 0+1 are skipped.
-        for i in range(ignore_first_frames, min(len(curr_stack), max_look_up + ignore_first_frames)):
-            curr_locals = curr_stack[i].frame.f_locals
+        for _ in range(ignore_first_frames):
+            if frame is None:
+                break
+            frame = frame.f_back
+
+        for _ in range(max_look_up):
+            if frame is None:
+                break
+            curr_frame = frame
+            frame = frame.f_back
+
+            curr_locals = curr_frame.f_locals
+            function_name = curr_frame.f_code.co_name
             if expected_class is not None:
                 if "self" not in curr_locals:
                     continue
@@ -116,19 +180,19 @@ def get_callers_string_description(
                     continue
 
             if expected_function_name is not None:
-                if expected_function_name != str(curr_stack[i].function):
+                if expected_function_name != function_name:
                     continue
 
             curr_str = ".".join(
                 [
                     str(curr_locals["self"].__module__),  # module is probably not needed as class already contains it
                     str(curr_locals["self"].__class__),
-                    str(curr_stack[i].function),
+                    function_name,
                 ]
             )
 
-            curr_str += inspect.getsource(curr_stack[i].frame)
-            for k, d in curr_stack[i].frame.f_locals.items():
+            curr_str += get_source_cached(curr_frame)
+            for k, d in curr_locals.items():
                 if "self" == k:
                     continue
                 if k.startswith("__"):
@@ -139,6 +203,7 @@ def get_callers_string_description(
 
     finally:
         del curr_locals
-        del curr_stack
+        del curr_frame
+        del frame
 
     return str_desc
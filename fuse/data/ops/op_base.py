@@ -100,12 +100,19 @@ def op_call(op: OpBase, sample_dict: NDict, op_id: str, **kwargs):
             return op(sample_dict, **kwargs)
     except:
         # error messages are cryptic without this. For example, you can get "TypeError: __call__() got an unexpected keyword argument 'key_out_input'" , without any reference to the relevant op!
-        print(
-            f"error in __call__ method of op={op}, op_id={op_id}, sample_id={get_sample_id(sample_dict)} - more details below"
-        )
+        print_op_call_error(op, sample_dict, op_id)
         raise
 
 
+def print_op_call_error(op: OpBase, sample_dict: NDict, op_id: str) -> None:
+    """
+    print the op and the sample that failed - see op_call()
+    """
+    print(
+        f"error in __call__ method of op={op}, op_id={op_id}, sample_id={get_sample_id(sample_dict)} - more details below"
+    )
+
+
 def op_reverse(op, sample_dict: NDict, key_to_reverse: str, key_to_follow: str, op_id: Optional[str]):
     if isinstance(op, OpReversibleBase):
         try:
@@ -48,6 +48,28 @@ class TestOpBase(unittest.TestCase):
             [DataTypeForTesting.IMAGE_FOR_TESTING],
         )
 
+    def test_hashable_string_representation(self):
+        class OpWithArgs(OpBase):
+            def __init__(self, val: int, name: str = "default"):
+                super().__init__()
+                self._val = val
+
+            def __call__(self, sample_dict: NDict, **kwargs) -> Union[None, dict, List[dict]]:
+                return sample_dict
+
+        class OpWithArgsInherited(OpWithArgs):
+            def __init__(self, val: int, extra: str):
+                super().__init__(val)
+
+        op_repr = OpWithArgsInherited(1, "a").get_hashable_string_representation()
+        self.assertEqual(op_repr, OpWithArgsInherited(1, "a").get_hashable_string_representation())
+        self.assertNotEqual(op_repr, OpWithArgsInherited(2, "a").get_hashable_string_representation())
+        self.assertNotEqual(op_repr, OpWithArgsInherited(1, "b").get_hashable_string_representation())
+        self.assertIn("@extra@a", op_repr)
+        # the source code is part of the representation
+        self.assertIn("def __init__(self, val: int, extra: str):", op_repr)
+        self.assertIn("def __call__(self, sample_dict: NDict, **kwargs)", op_repr)
+
 
 if __name__ == "__main__":
     unittest.main()
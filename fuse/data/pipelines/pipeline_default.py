@@ -16,11 +16,13 @@ limitations under the License.
 Created on June 30, 2021
 
 """
-from typing import List, Tuple, Union, Optional
-from fuse.data.ops.op_base import OpBase, OpReversibleBase, op_call, op_reverse
+from typing import Dict, List, Tuple, Union, Optional
+import hashlib
+from fuse.data.ops.op_base import OpBase, OpReversibleBase, op_reverse, print_op_call_error
 from fuse.utils.misc.context import DummyContext
 from fuse.utils.ndict import NDict
 from fuse.utils.cpu_profiling.timer import Timer
+from fuse.utils.cpu_profiling.ops_profiler import OpsProfiler
 
 
 class PipelineDefault(OpReversibleBase):
@@ -53,6 +55,14 @@ class PipelineDefault(OpReversibleBase):
             assert len(set(op_ids)) == len(op_ids), "Expecting unique op id for every op."
             self._op_ids = op_ids
         self._verbose = verbose
+        # string representation per op - computed lazily, once (see _get_ops_desc())
+        self._ops_desc = None
+        # execution plan per op_id - compiled lazily, once (see compile())
+        self._plans: Dict[str, PipelinePlan] = {}
+        # incremented whenever the pipeline is modified - used to invalidate plans that include this pipeline
+        self._version = 0
+        # optional instrumentation - see set_profiler()
+        self._profiler = None
 
     def extend(self, ops_and_kwargs: List[Tuple[OpBase, dict]], op_ids: Optional[List[str]] = None):
         """
@@ -69,42 +79,136 @@ class PipelineDefault(OpReversibleBase):
 
         self._ops_and_kwargs.extend(ops_and_kwargs)
         self._op_ids.extend(op_ids)
+        self._ops_desc = None
+        self._plans = {}
+        self._version += 1
 
     def get_name(self) -> str:
         return self._name
 
+    def get_op_ids(self) -> List[str]:
+        return self._op_ids
+
+    def set_profiler(self, profiler: Optional[OpsProfiler]) -> None:
+        """
+        Opt-in instrumentation: record the cost of each op (including the ops of inlined nested pipelines). See OpsProfiler.
+        :param profiler: OpsProfiler instance or None to disable
+        """
+        self._profiler = profiler
+
+    def get_version(self) -> int:
+        """
+        :return: a counter incremented whenever the pipeline is modified (see extend())
+        """
+        return self._version
+
+    def compile(self, op_id: Optional[str] = None) -> "PipelinePlan":
+        """
+        Resolves the pipeline once into a flat execution plan: the op_id and kwargs of every op are bound in advance,
+        and nested PipelineDefault instances (without extra kwargs) are inlined.
+        Called implicitly by __call__(). The plan is cached per op_id and invalidated by extend().
+        Like _get_ops_desc(), assumes that the ops and their kwargs are not modified after the pipeline is created (other than using extend()).
+        :param op_id: the op_id of the pipeline - see __call__()
+        """
+        if op_id is None:
+            op_id = f"internal.{self._name}"
+        plan = self._plans.get(op_id, None)
+        if plan is not None and plan.is_valid():
+            return plan
+
+        plan = PipelinePlan()
+        for sub_op_id, (op, op_kwargs) in zip(self._op_ids, self._ops_and_kwargs):
+            full_op_id = f"{op_id}.{sub_op_id}"
+            if type(op) is PipelineDefault and not op_kwargs:
+                # inline the nested pipeline - identical to calling it with the same op_id
+                nested_plan = op.compile(full_op_id)
+                plan.steps.extend(nested_plan.steps)
+                plan.pipelines.extend(nested_plan.pipelines)
+            else:
+                if isinstance(op, OpReversibleBase):
+                    op_kwargs = dict(op_kwargs, op_id=full_op_id)
+                timer_desc = (
+                    f"Pipeline {self._name}: op {type(op).__name__}, op_id {sub_op_id}" if self._verbose else None
+                )
+                plan.steps.append((op, op_kwargs, full_op_id, timer_desc))
+            plan.end_index[sub_op_id] = len(plan.steps)
+        plan.pipelines.append((self, self._version))
+
+        self._plans[op_id] = plan
+        return plan
+
+    def _get_ops_desc(self) -> List[str]:
+        """
+        :return: a string representation per op (op_id, op and kwargs).
+        Computed once, on first use - the ops and their kwargs are not expected to be modified after the pipeline is created (other than using extend())
+        """
+        if self._ops_desc is None:
+            text = []
+            for (op_id, op_kwargs) in zip(self._op_ids, self._ops_and_kwargs):
+                op, kwargs = op_kwargs
+                text.append(str(op_id) + "@" + op.get_hashable_string_representation() + "@" + str(kwargs) + "@")
+            self._ops_desc = text
+        return self._ops_desc
+
     def __str__(self) -> str:
-        text = []
-        for (op_id, op_kwargs) in zip(self._op_ids, self._ops_and_kwargs):
-            op, kwargs = op_kwargs
-            text.append(str(op_id) + "@" + op.get_hashable_string_representation() + "@" + str(kwargs) + "@")
-        return "".join(text)  # this is faster than accumulate_str+=new_str
+        return "".join(self._get_ops_desc())  # this is faster than accumulate_str+=new_str
+
+    def get_prefixes_desc_hashes(self) -> List[str]:
+        """
+        Hashes of the string representation of each prefix of the pipeline.
+        The k-th element is the hash of the pipeline including just the first k+1 ops,
+        which is identical to md5(str(pipeline)) of a pipeline built from those ops (with the same op ids).
+        The last element is the hash of the entire pipeline.
+        Used for incremental caching - to identify previously cached results of the first steps of the pipeline.
+        """
+        ans = []
+        md5 = hashlib.md5()
+        for op_desc in self._get_ops_desc():
+            md5.update(op_desc.encode("utf-8"))
+            ans.append(md5.hexdigest())
+        return ans
 
     def __call__(
-        self, sample_dict: NDict, op_id: Optional[str] = None, until_op_id: Optional[str] = None
+        self,
+        sample_dict: NDict,
+        op_id: Optional[str] = None,
+        until_op_id: Optional[str] = None,
+        start_after_op_id: Optional[str] = None,
     ) -> Union[None, dict, List[dict]]:
         """
         See super class
         plus
         :param until_op_id: optional - stop after the specified op_id - might be used for optimization
+        :param start_after_op_id: optional - skip the ops up to (and including) the specified op_id.
+            Used to continue processing a sample which was already processed by the first ops of the pipeline.
         """
-        # set op_id if not specified
-        if op_id is None:
-            op_id = f"internal.{self._name}"
+        plan = self.compile(op_id)
 
+        first_step = 0
+        if start_after_op_id is not None:
+            first_step = plan.end_index[start_after_op_id]
+        last_step = len(plan.steps)
+        if until_op_id is not None:
+            # stop after the specified op id
+            last_step = plan.end_index.get(until_op_id, last_step)
+
+        profiler = self._profiler
         samples_to_process = [sample_dict]
-        for sub_op_id, (op, op_kwargs) in zip(self._op_ids, self._ops_and_kwargs):
-            if self._verbose:
-                context = Timer(f"Pipeline {self._name}: op {type(op).__name__}, op_id {sub_op_id}", self._verbose)
-            else:
-                context = DummyContext()
+        for op, op_kwargs, full_op_id, timer_desc in plan.steps[first_step:last_step]:
+            context = Timer(timer_desc) if timer_desc is not None else DummyContext()
             with context:
                 samples_to_process_next = []
-
                 for sample in samples_to_process:
-
-                    sample = op_call(op, sample, f"{op_id}.{sub_op_id}", **op_kwargs)
-
+                    try:
+                        if profiler is None:
+                            sample = op(sample, **op_kwargs)
+                        else:
+                            profiler_state = profiler.start(sample)
+                            sample = op(sample, **op_kwargs)
+                            profiler.stop(profiler_state, full_op_id, type(op).__name__, sample)
+                    except:
+                        print_op_call_error(op, sample, full_op_id)
+                        raise
                     # three options for return value:
                     # None - ignore the sample
                     # List of dicts - split sample
@@ -121,10 +225,6 @@ class PipelineDefault(OpReversibleBase):
             # continue to process with next op
             samples_to_process = samples_to_process_next
 
-            # if required - stop after the specified op id
-            if until_op_id is not None and sub_op_id == until_op_id:
-                break
-
         # if single sample - return it, otherwise return list of samples.
         if len(samples_to_process) == 1:
             return samples_to_process[0]
@@ -143,3 +243,26 @@ class PipelineDefault(OpReversibleBase):
             sample_dict = op_reverse(op, sample_dict, f"{op_id}.{sub_op_id}", key_to_reverse, key_to_follow)
 
         return sample_dict
+
+
+class PipelinePlan:
+    """
+    Flat execution plan of a pipeline - see PipelineDefault.compile()
+    """
+
+    def __init__(self):
+        # list of tuples (op, kwargs including the op_id if required, op_id, description for the timer or None)
+        self.steps: List[Tuple[OpBase, dict, str, Optional[str]]] = []
+        # the index of the step following the last step per (top level) op_id
+        self.end_index: Dict[str, int] = {}
+        # the pipelines compiled into this plan and their versions
+        self.pipelines: List[Tuple[PipelineDefault, int]] = []
+
+    def is_valid(self) -> bool:
+        """
+        :return: False if one of the (nested) pipelines was modified since the plan was compiled
+        """
+        for pipeline, version in self.pipelines:
+            if pipeline.get_version() != version:
+                return False
+        return True
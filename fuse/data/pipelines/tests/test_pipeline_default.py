@@ -3,6 +3,7 @@ import unittest
 from fuse.utils.ndict import NDict
 from typing import Any, Union, List
 import copy
+import hashlib
 from unittest.case import expectedFailure
 
 from fuse.data.ops.op_base import OpBase, OpReversibleBase
@@ -108,6 +109,76 @@ class TestPipelineDefault(unittest.TestCase):
         samples = [sample["data.sample_id"] for sample in sample_dict]
         self.assertListEqual(expected_samples, samples)
 
+    def test_partial_run(self):
+        """
+        Test running a part of the pipeline and the prefixes hashes
+        """
+        pipeline_seq = [
+            (OpSetForTest(), dict(key="data.test_pipeline", val=5)),
+            (OpSetForTest(), dict(key="data.test_pipeline", val=6)),
+            (OpSetForTest(), dict(key="data.test_pipeline_2", val=7)),
+        ]
+        pipe = PipelineDefault("test", pipeline_seq)
+
+        sample_dict = pipe(NDict({}), until_op_id="0")
+        self.assertEqual(sample_dict["data.test_pipeline"], 5)
+        self.assertFalse("data.test_pipeline_2" in sample_dict)
+        sample_dict = pipe(sample_dict, start_after_op_id="0")
+        self.assertEqual(sample_dict["data.test_pipeline"], 6)
+        self.assertEqual(sample_dict["data.test_pipeline_2"], 7)
+
+        prefixes_hashes = pipe.get_prefixes_desc_hashes()
+        self.assertEqual(len(prefixes_hashes), 3)
+        self.assertEqual(prefixes_hashes[-1], hashlib.md5(str(pipe).encode("utf-8")).hexdigest())
+        prefix_pipe = PipelineDefault("test", pipeline_seq[:2])
+        self.assertEqual(prefix_pipe.get_prefixes_desc_hashes(), prefixes_hashes[:2])
+
+        # the description is updated when extending the pipeline
+        prefix_pipe.extend(pipeline_seq[2:])
+        self.assertEqual(str(prefix_pipe), str(pipe))
+
+    def test_compiled_plan(self):
+        """
+        Test the execution plan - nested pipelines, partial runs and invalidation when extending the pipeline
+        """
+        nested_pipe = PipelineDefault(
+            "nested",
+            [
+                (OpSetForTest(), dict(key="data.test_nested", val=1)),
+                (OpSplitForTest(), dict()),
+                (OpSetForTest(), dict(key="data.test_nested", val=2)),
+            ],
+        )
+        pipe = PipelineDefault(
+            "test",
+            [
+                (OpSetForTest(), dict(key="data.test_pipeline", val=5)),
+                (nested_pipe, dict()),
+                (OpSetForTest(), dict(key="data.test_pipeline_2", val=7)),
+            ],
+        )
+        samples = pipe(NDict({"data": {"sample_id": 0}}))
+        self.assertEqual(len(samples), 10)
+        for sample in samples:
+            self.assertEqual(sample["data.test_nested"], 2)
+            self.assertEqual(sample["data.test_pipeline_2"], 7)
+            # same op ids as when calling the nested pipeline
+            self.assertEqual(sample["internal.test.1.2.key"], "data.test_nested")
+
+        sample_dict = pipe(NDict({"data": {"sample_id": 0}}), until_op_id="0")
+        self.assertFalse("data.test_nested" in sample_dict)
+        samples = pipe(sample_dict, start_after_op_id="0", until_op_id="1")
+        self.assertEqual(len(samples), 10)
+        self.assertFalse("data.test_pipeline_2" in samples[0])
+
+        # modifying the nested pipeline invalidates the plan
+        nested_pipe.extend([(OpSetForTest(), dict(key="data.test_nested", val=3))])
+        samples = pipe(NDict({"data": {"sample_id": 0}}))
+        self.assertEqual(samples[0]["data.test_nested"], 3)
+        pipe.extend([(OpSetForTest(), dict(key="data.test_pipeline_2", val=8))])
+        samples = pipe(NDict({"data": {"sample_id": 0}}))
+        self.assertEqual(samples[0]["data.test_pipeline_2"], 8)
+
     def tearDown(self) -> None:
         return super().tearDown()
 
@@ -21,7 +21,6 @@ Collection of useful functions to implement FuseMedML pytorch lightning based mo
 """
 import traceback
 from typing import Any, Dict, List, OrderedDict, Sequence, Union
-from statistics import mean
 from fuse.data.utils.sample import get_sample_id_key
 from fuse.utils.data.collate import uncollate
 import pandas as pd
@@ -34,6 +33,7 @@ from .pl_epoch_summary import ModelEpochSummary
 from fuse.utils import NDict
 from fuse.dl.losses.loss_base import LossBase
 from fuse.eval import MetricBase
+from fuse.eval.metrics.metrics_common import batch_to_numpy
 from fuse.eval.metrics.utils import PerSampleData
 
 
@@ -85,29 +85,37 @@ def convert_predictions_to_dataframe(predictions: List[NDict]) -> pd.DataFrame:
     return df
 
 
-def step_losses(losses: Dict[str, LossBase], batch_dict: NDict) -> torch.Tensor:
+def step_losses(losses: Dict[str, LossBase], batch_dict: NDict, deferred: bool = False) -> torch.Tensor:
     """
     Compute losses per step (batch) in pl.LightningModule.<training/validation/test>_step()
     :param losses: dict of FuseMedML style losses
     :param batch_dict: FuseMedML batch_dict including data and model outputs
+    :param deferred: if True, the values for tracking purpose are kept as (detached) tensors on the device instead of python floats.
+                     Avoids waiting for the device (to copy the value to host) on every step - the values are copied once in epoch_end_compute_and_log_losses().
     :return: total_loss (sum all losses results). The values for tracking purpose will be stored in batch_dict['losses']
     """
     total_loss = None
     for loss_name, loss_function in losses.items():
         current_loss_result = loss_function(batch_dict)
-        batch_dict["losses." + loss_name] = current_loss_result.data.item()
-        # sum all losses for backward
+        batch_dict["losses." + loss_name] = _loss_value(current_loss_result, deferred)
+        # sum all losses for backward (not in place - the tracked value might share the same storage when deferred)
         if total_loss is None:
             total_loss = current_loss_result
         else:
-            total_loss += current_loss_result
+            total_loss = total_loss + current_loss_result
 
     if total_loss is not None:
-        batch_dict["losses.total_loss"] = total_loss.data.item()
+        batch_dict["losses.total_loss"] = _loss_value(total_loss, deferred)
 
     return total_loss
 
 
+def _loss_value(loss: torch.Tensor, deferred: bool) -> Union[float, torch.Tensor]:
+    if deferred:
+        return loss.detach()
+    return loss.data.item()
+
+
 def step_metrics(metrics: OrderedDict[str, MetricBase], batch_dict: NDict) -> None:
     """
     Collect data to compute per epoch metrics
@@ -126,16 +134,15 @@ def step_extract_predictions(prediction_keys: Sequence[str], batch_dict: NDict)
     :param prediction_keys: the keys to extract
     :param batch_dict: FuseMedML batch_dict including data and model outputs
     """
-    outputs = {}
-    sample_ids = batch_dict[get_sample_id_key()]
-    if isinstance(sample_ids, torch.Tensor):
-        sample_ids = list(sample_ids.detach().cpu().numpy())
-    outputs["id"] = sample_ids
+    outputs = {"id": batch_dict[get_sample_id_key()]}
     for key in prediction_keys:
-        output = batch_dict[key]
-        if isinstance(output, torch.Tensor):
-            output = output.detach().cpu().numpy()
-        outputs[key] = output
+        outputs[key] = batch_dict[key]
+    ids_is_tensor = isinstance(outputs["id"], torch.Tensor)
+
+    # copy all of the tensors to host asynchronously (through pinned memory) and wait just once
+    outputs = batch_to_numpy(outputs)
+    if ids_is_tensor:
+        outputs["id"] = list(outputs["id"])
 
     return outputs
 
@@ -149,14 +156,33 @@ def epoch_end_compute_and_log_losses(pl: pl.LightningModule, mode: str, batch_lo
     :return: None
     """
     keys = batch_losses[0].keys()
+    # losses kept as tensors (see step_losses(deferred=True)) are summed on the device, and copied to host once
+    device_sums = {}
+    device_counts = {}
+    host_losses = {}
     for key in keys:
-        losses = []
+        tensors = []
+        host_losses[key] = []
         for elem in batch_losses:
             if isinstance(elem[key], torch.Tensor):
-                losses.extend(elem[key].detach().cpu().tolist())
+                tensors.append(elem[key].detach().reshape(-1))
             else:
-                losses.append(elem[key])
-        loss = mean(losses)
+                host_losses[key].append(elem[key])
+        if len(tensors) > 0:
+            device = tensors[0].device
+            values = torch.cat([t.to(device) for t in tensors])
+            device_sums[key] = values.sum(dtype=torch.float64)
+            device_counts[key] = values.numel()
+
+    sums = {}
+    if len(device_sums) > 0:
+        device = next(iter(device_sums.values())).device
+        sums = dict(zip(device_sums.keys(), torch.stack([v.to(device) for v in device_sums.values()]).tolist()))
+
+    for key in keys:
+        total = sums.get(key, 0.0) + sum(host_losses[key])
+        count = device_counts.get(key, 0) + len(host_losses[key])
+        loss = total / count
         pl.log(f"{mode}.losses.{key}", loss, on_epoch=True)
 
 
@@ -19,6 +19,7 @@ Created on June 30, 2021
 import pytorch_lightning as pl
 from typing import Optional
 from fuse.dl.lightning.pl_funcs import *  # noqa
+from fuse.data.pipelines.pipeline_default import PipelineDefault
 
 
 class LightningModuleDefault(pl.LightningModule):
@@ -39,6 +40,8 @@ class LightningModuleDefault(pl.LightningModule):
         callbacks: Optional[Sequence[pl.Callback]] = None,
         best_epoch_source: Optional[Union[Dict, List[Dict]]] = None,
         save_hyperparameters: Optional[List[str]] = None,
+        deferred_losses: bool = False,
+        batch_augmentation: Optional[PipelineDefault] = None,
         **kwargs
     ):
         """
@@ -54,6 +57,9 @@ class LightningModuleDefault(pl.LightningModule):
         :param best_epoch_source: Create list of pl.callbacks that saves checkpoints using (pl.callbacks.ModelCheckpoint) and print per epoch summary (fuse.dl.lightning.pl_epoch_summary.ModelEpochSummary).
                                   Either a dict with arguments to pass to ModelCheckpoint or list dicts for multiple ModelCheckpoint callbacks (to monitor and save checkpoints for more then one metric).
         :param save_hyperparameters: specify which hyperparameters you would like to save. Default None.  See pl.LightningModule.save_hyperparameters() for more details.
+        :param deferred_losses: keep the per step losses values on the device and copy them to host just once, on epoch end (avoids waiting for the device on every step).
+                                See step_losses() for more details.
+        :param batch_augmentation: Optional, pipeline of batch level ops (e.g. fuseimg.data.ops.aug.batch) applied on the training batches after they are moved to the device.
         """
         super().__init__(**kwargs)
         if save_hyperparameters is not None:
@@ -66,6 +72,8 @@ class LightningModuleDefault(pl.LightningModule):
         self._train_metrics = train_metrics
         self._validation_metrics = validation_metrics
         self._test_metrics = test_metrics
+        self._deferred_losses = deferred_losses
+        self._batch_augmentation = batch_augmentation
 
         self._optimizers_and_lr_schs = optimizers_and_lr_schs
         self._callbacks = callbacks if callbacks is not None else []
@@ -79,12 +87,19 @@ class LightningModuleDefault(pl.LightningModule):
     def forward(self, batch_dict: NDict) -> NDict:
         return self._model(batch_dict)
 
+    ## Batch augmentation
+    def on_after_batch_transfer(self, batch_dict: NDict, dataloader_idx: int) -> NDict:
+        # augment the entire training batch at once - on the device
+        if self._batch_augmentation is not None and self.trainer.training:
+            batch_dict = self._batch_augmentation(batch_dict)
+        return batch_dict
+
     ## Step
     def training_step(self, batch_dict: NDict, batch_idx: int) -> dict:
         # run forward function and store the outputs in batch_dict["model"]
         batch_dict["model"] = self.forward(batch_dict)
         # given the batch_dict and FuseMedML style losses - compute the losses, return the total loss and save losses values in batch_dict["losses"]
-        total_loss = step_losses(self._losses, batch_dict)
+        total_loss = step_losses(self._losses, batch_dict, deferred=self._deferred_losses)
         # given the batch_dict and FuseMedML style losses - collect the required values to compute the metrics on epoch_end
         step_metrics(self._train_metrics, batch_dict)
 
@@ -95,7 +110,7 @@ class LightningModuleDefault(pl.LightningModule):
         # run forward function and store the outputs in batch_dict["model"]
         batch_dict["model"] = self.forward(batch_dict)
         # given the batch_dict and FuseMedML style losses - compute the losses, return the total loss (ignored) and save losses values in batch_dict["losses"]
-        _ = step_losses(self._losses, batch_dict)
+        _ = step_losses(self._losses, batch_dict, deferred=self._deferred_losses)
         # given the batch_dict and FuseMedML style losses - collect the required values to compute the metrics on epoch_end
         step_metrics(self._validation_metrics, batch_dict)
 
@@ -106,7 +121,7 @@ class LightningModuleDefault(pl.LightningModule):
         # run forward function and store the outputs in batch_dict["model"]
         batch_dict["model"] = self.forward(batch_dict)
         # given the batch_dict and FuseMedML style losses - compute the losses, return the total loss (ignored) and save losses values in batch_dict["losses"]
-        _ = step_losses(self._losses, batch_dict)
+        _ = step_losses(self._losses, batch_dict, deferred=self._deferred_losses)
         # given the batch_dict and FuseMedML style losses - collect the required values to compute the metrics on epoch_end
         step_metrics(self._test_metrics, batch_dict)
 
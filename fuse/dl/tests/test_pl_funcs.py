@@ -0,0 +1,105 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+import unittest
+
+import numpy as np
+import torch
+
+from fuse.dl.lightning.pl_funcs import epoch_end_compute_and_log_losses, step_extract_predictions, step_losses
+from fuse.utils.ndict import NDict
+
+
+class FakeLightningModule:
+    """
+    Records the logged values
+    """
+
+    def __init__(self):
+        self.logged = {}
+
+    def log(self, name: str, value: float, on_epoch: bool) -> None:
+        self.logged[name] = value
+
+
+class TestPLFuncs(unittest.TestCase):
+    def test_losses(self):
+        """
+        Deferred and not deferred losses should log the same epoch averages
+        """
+        losses = {
+            "mse": lambda batch_dict: ((batch_dict["model.output"] - batch_dict["data.target"]) ** 2).mean(),
+            "l1": lambda batch_dict: (batch_dict["model.output"] - batch_dict["data.target"]).abs().mean(),
+        }
+        batches = [
+            NDict({"model.output": torch.tensor([1.0, 2.0, 3.0]), "data.target": torch.tensor([0.0, 2.0, 5.0])}),
+            NDict({"model.output": torch.tensor([0.5, -1.0]), "data.target": torch.tensor([0.0, 0.0])}),
+            NDict({"model.output": torch.tensor([4.0]), "data.target": torch.tensor([1.0])}),
+        ]
+        # tracked by the module itself - floats in some batches, per sample loss tensors in others
+        per_sample = [0.5, torch.tensor([1.0, 2.0, 3.0]), torch.tensor(4.0)]
+
+        logged = {}
+        for deferred in [False, True]:
+            batch_losses = []
+            for batch, extra in zip(batches, per_sample):
+                batch_dict = batch.clone()
+                total_loss = step_losses(losses, batch_dict, deferred=deferred)
+                self.assertIsInstance(total_loss, torch.Tensor)
+                value_type = torch.Tensor if deferred else float
+                self.assertIsInstance(batch_dict["losses.mse"], value_type)
+                self.assertIsInstance(batch_dict["losses.total_loss"], value_type)
+                batch_dict["losses.per_sample"] = extra
+                batch_losses.append(batch_dict["losses"])
+            pl = FakeLightningModule()
+            epoch_end_compute_and_log_losses(pl, "validation", batch_losses)
+            logged[deferred] = pl.logged
+
+        self.assertListEqual(sorted(logged[True].keys()), sorted(logged[False].keys()))
+        for name in logged[False]:
+            self.assertAlmostEqual(logged[True][name], logged[False][name], places=5)
+        self.assertAlmostEqual(logged[False]["validation.losses.mse"], ((5.0 / 3) + 0.625 + 9.0) / 3, places=5)
+        self.assertAlmostEqual(
+            logged[False]["validation.losses.per_sample"], (0.5 + 1.0 + 2.0 + 3.0 + 4.0) / 5, places=5
+        )
+        self.assertAlmostEqual(
+            logged[False]["validation.losses.total_loss"],
+            logged[False]["validation.losses.mse"] + logged[False]["validation.losses.l1"],
+            places=5,
+        )
+
+    def test_step_extract_predictions(self):
+        batch_dict = NDict(
+            {
+                "data.sample_id": torch.tensor([3, 7]),
+                "model.output": torch.tensor([[0.2, 0.8], [0.6, 0.4]], requires_grad=True),
+                "model.name": ["a", "b"],
+            }
+        )
+        outputs = step_extract_predictions(["model.output", "model.name"], batch_dict)
+        self.assertIsInstance(outputs["id"], list)
+        self.assertListEqual(outputs["id"], [3, 7])
+        self.assertIsInstance(outputs["model.output"], np.ndarray)
+        self.assertTrue(np.allclose(outputs["model.output"], [[0.2, 0.8], [0.6, 0.4]]))
+        self.assertListEqual(outputs["model.name"], ["a", "b"])
+
+        # ids which are not tensors are kept as is
+        batch_dict["data.sample_id"] = ["case_1", "case_2"]
+        self.assertListEqual(step_extract_predictions([], batch_dict)["id"], ["case_1", "case_2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
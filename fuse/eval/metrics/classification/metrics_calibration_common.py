@@ -1,6 +1,9 @@
-from typing import Optional, Union
+from typing import Dict, Optional, Union
+
+import numpy as np
 
 from fuse.eval.metrics.libs.calibration import Calibration
+from fuse.eval.metrics.metrics_common import MetricStreamingBase
 from .metrics_classification_common import MetricMultiClassDefault
 
 from functools import partial
@@ -47,15 +50,70 @@ class MetricECE(MetricMultiClassDefault):
     """
 
     def __init__(
-        self, pred: str, target: str, num_bins: Optional[int] = 10, num_quantiles: Optional[int] = None, **kwargs
+        self,
+        pred: str,
+        target: str,
+        num_bins: Optional[int] = 10,
+        num_quantiles: Optional[int] = None,
+        classwise: bool = False,
+        **kwargs
     ):
         """
         :param pred: key name for the model prediction scores
         :param target: key name for the ground truth target values
         :param class_names: class names. required for multi-class classifiers
+        :param classwise: compute also the classwise ECE (see Calibration.classwise_ece())
+        """
+        ece = partial(Calibration.ece, num_bins=num_bins, num_quantiles=num_quantiles, classwise=classwise)
+        # the bins edges of quantiles depend on the sampled data, so can't be reused across bootstrap replicates
+        ece_bootstrap = (
+            partial(Calibration.ece_bootstrap, num_bins=num_bins, classwise=classwise)
+            if num_quantiles is None
+            else None
+        )
+        super().__init__(pred=pred, target=target, metric_func=ece, bootstrap_metric_func=ece_bootstrap, **kwargs)
+
+
+class MetricECEStreaming(MetricStreamingBase):
+    """
+    Streaming version of MetricECE (equal width bins only) - accumulates the number of samples and of correct predictions per confidence bin
+    """
+
+    def __init__(self, pred: str, target: str, num_bins: int = 10, **kwargs):
+        """
+        :param pred: key name for the model prediction scores
+        :param target: key name for the ground truth target values
+        :param num_bins: number of equal width confidence bins
         """
-        ece = partial(Calibration.ece, num_bins=num_bins, num_quantiles=num_quantiles)
-        super().__init__(pred=pred, target=target, metric_func=ece, **kwargs)
+        self._conf_vec = np.linspace(0, 1, num_bins + 1)
+        super().__init__(pred=pred, target=target, **kwargs)
+
+    def reset_state(self) -> None:
+        num_bins = len(self._conf_vec) - 1
+        self._num_samples_per_bin = np.zeros(num_bins)
+        self._num_correct_per_bin = np.zeros(num_bins)
+        self._total_samples = 0
+
+    def update(self, pred: np.ndarray, target: np.ndarray) -> None:
+        pred = pred.astype(np.float64)
+        if pred.ndim == 1:  # binary case
+            pred = np.stack((1 - pred, pred), axis=1)
+        max_pred = pred.max(axis=1)
+        correct = pred.argmax(axis=1) == target.reshape(-1)
+
+        # same bins as Calibration.reliability_diagram()
+        num_bins = len(self._conf_vec) - 1
+        bins = Calibration.assign_bins(max_pred, self._conf_vec)
+        self._num_samples_per_bin += Calibration.bin_sums(bins, num_bins)
+        self._num_correct_per_bin += Calibration.bin_sums(bins, num_bins, correct)
+        self._total_samples += len(pred)
+
+    def compute(self) -> Dict[str, float]:
+        accuracy_per_bin = self._num_correct_per_bin / np.maximum(self._num_samples_per_bin, np.finfo(float).eps)
+        ece, mce = Calibration.ece_from_bins(
+            self._num_samples_per_bin, accuracy_per_bin, self._total_samples, self._conf_vec
+        )
+        return {"ece": ece, "mce": mce}
 
 
 class MetricFindTemperature(MetricMultiClassDefault):
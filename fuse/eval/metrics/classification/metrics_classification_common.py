@@ -23,7 +23,14 @@ import traceback
 
 import numpy as np
 
-from fuse.eval.metrics.metrics_common import MetricDefault, MetricWithCollectorBase
+import pandas as pd
+
+from fuse.eval.metrics.metrics_common import (
+    MetricDefault,
+    MetricStreamingBase,
+    MetricWithCollectorBase,
+    split_bootstrap_results,
+)
 from fuse.eval.metrics.libs.classification import MetricsLibClass
 
 
@@ -40,6 +47,7 @@ class MetricMultiClassDefault(MetricWithCollectorBase):
         metric_func: Callable,
         class_names: Optional[Sequence[str]] = None,
         class_weights: Optional[Sequence[float]] = None,
+        bootstrap_metric_func: Optional[Callable] = None,
         **kwargs,
     ):
         """
@@ -49,12 +57,17 @@ class MetricMultiClassDefault(MetricWithCollectorBase):
                             the function should return a result or a dictionary of results
         :param class_names: class names for multi-class evaluation or None for binary evaluation
         :param class_weight: weight per class - the macro_average result will be a weighted sum rather than an average
+        :param bootstrap_metric_func: Optional, vectorized version of metric_func, used to evaluate many bootstrap replicates at once (see CI).
+                            Gets the same arguments as metric_func plus "indices" - integer array [num_replicates, num_samples]
+                            with the indices of the samples drawn in each replicate.
+                            Should return an array with a result per replicate or a dictionary of such arrays.
         :param kwargs: additional kw arguments for MetricWithCollectorBase
         """
         super().__init__(pred=pred, target=target, **kwargs)
         self._metric_func = metric_func
         self._class_names = class_names
         self._class_weights = class_weights
+        self._bootstrap_metric_func = bootstrap_metric_func
 
     def eval(
         self, results: Dict[str, Any] = None, ids: Optional[Sequence[Hashable]] = None
@@ -74,54 +87,104 @@ class MetricMultiClassDefault(MetricWithCollectorBase):
                 print(f"Error in metric: {track}")
                 metric_results = None
         else:
-            metric_results = {}
-
             # one vs rest evaluation per class, including average
             try:
                 # compute one-vs-rest metrics
-                is_dict = False
-                all_classes = []
-                for cls_index, cls_name in enumerate(self._class_names):
-                    cls_res = self._metric_func(pos_class_index=cls_index, **kwargs)
-                    if isinstance(cls_res, dict):
-                        is_dict = True
-                        for sub_metric_name in cls_res:
-                            metric_results[f"{sub_metric_name}.{cls_name}"] = cls_res[sub_metric_name]
-                    else:
-                        assert (
-                            is_dict is False
-                        ), "expect all sub metric results to either return dictionary or single value"
-                        metric_results[f"{cls_name}"] = cls_res
-
-                    all_classes.append(cls_res)
-
-                # compute macro average
-                if is_dict:
-                    for key in all_classes[0]:
-                        all_classes_elem = np.array([d[key] for d in all_classes])
-                        indices = ~np.isnan(all_classes_elem)
-                        if self._class_weights is None:
-                            weights = None
-                        else:
-                            weights = self._class_weights[indices]
-                        metric_results[f"{key}.macro_avg"] = np.average(all_classes_elem[indices], weights=weights)
-                else:
-                    all_classes = np.array(all_classes)
-                    indices = ~np.isnan(all_classes)
-                    if self._class_weights is None:
-                        weights = None
-                    else:
-                        weights = self._sum_weights[indices]
-                    metric_results["macro_avg"] = np.average(all_classes[indices], weights=weights)
+                all_classes = [
+                    self._metric_func(pos_class_index=cls_index, **kwargs)
+                    for cls_index in range(len(self._class_names))
+                ]
+                metric_results = self._aggregate_classes_results(all_classes)
             except:
                 track = traceback.format_exc()
                 print(f"Error in metric: {type(self).__name__} - {track}")
-                for cls_name in self._class_names:
-                    metric_results[f"{cls_name}"] = None
-                metric_results["macro_avg"] = None
+                metric_results = self._failed_classes_results()
+
+        return metric_results
+
+    def eval_bootstrap(
+        self, results: Dict[str, Any], ids: Sequence[Hashable], boot_indices: np.ndarray
+    ) -> Sequence[Union[Dict[str, Any], Any]]:
+        """
+        See super class
+        """
+        kwargs = None
+        if self._bootstrap_metric_func is not None:
+            kwargs = self._extract_arguments_bootstrap(results, ids, boot_indices)
+        if kwargs is None:
+            return super().eval_bootstrap(results, ids, boot_indices)
+
+        num_replicates = len(boot_indices)
+        if self._class_names is None:
+            # single evaluation for all classes at once / binary classifier
+            try:
+                return split_bootstrap_results(self._bootstrap_metric_func(**kwargs), num_replicates)
+            except:
+                track = traceback.format_exc()
+                print(f"Error in metric: {track}")
+                return [None] * num_replicates
+
+        # one vs rest evaluation per class, including average
+        try:
+            all_classes = [
+                split_bootstrap_results(
+                    self._bootstrap_metric_func(pos_class_index=cls_index, **kwargs), num_replicates
+                )
+                for cls_index in range(len(self._class_names))
+            ]
+            return [
+                self._aggregate_classes_results([cls_res[index] for cls_res in all_classes])
+                for index in range(num_replicates)
+            ]
+        except:
+            track = traceback.format_exc()
+            print(f"Error in metric: {type(self).__name__} - {track}")
+            return [self._failed_classes_results() for _ in range(num_replicates)]
+
+    def _aggregate_classes_results(self, all_classes: List[Union[Dict[str, Any], Any]]) -> Dict[str, Any]:
+        """
+        Names the one-vs-rest result of each class and computes the macro average
+        :param all_classes: the result of each class - either a single value or a dictionary
+        """
+        metric_results = {}
+        is_dict = False
+        for cls_name, cls_res in zip(self._class_names, all_classes):
+            if isinstance(cls_res, dict):
+                is_dict = True
+                for sub_metric_name in cls_res:
+                    metric_results[f"{sub_metric_name}.{cls_name}"] = cls_res[sub_metric_name]
+            else:
+                assert is_dict is False, "expect all sub metric results to either return dictionary or single value"
+                metric_results[f"{cls_name}"] = cls_res
+
+        # compute macro average
+        if is_dict:
+            for key in all_classes[0]:
+                all_classes_elem = np.array([d[key] for d in all_classes])
+                indices = ~np.isnan(all_classes_elem)
+                if self._class_weights is None:
+                    weights = None
+                else:
+                    weights = self._class_weights[indices]
+                metric_results[f"{key}.macro_avg"] = np.average(all_classes_elem[indices], weights=weights)
+        else:
+            all_classes = np.array(all_classes)
+            indices = ~np.isnan(all_classes)
+            if self._class_weights is None:
+                weights = None
+            else:
+                weights = self._sum_weights[indices]
+            metric_results["macro_avg"] = np.average(all_classes[indices], weights=weights)
 
         return metric_results
 
+    def _failed_classes_results(self) -> Dict[str, Any]:
+        metric_results = {}
+        for cls_name in self._class_names:
+            metric_results[f"{cls_name}"] = None
+        metric_results["macro_avg"] = None
+        return metric_results
+
 
 class MetricAUCROC(MetricMultiClassDefault):
     """
@@ -142,7 +205,16 @@ class MetricAUCROC(MetricMultiClassDefault):
                         If not ``None``, the standardized partial AUC over the range [0, max_fpr] is returned.
         """
         auc_roc = partial(MetricsLibClass.auc_roc, max_fpr=max_fpr)
-        super().__init__(pred, target, metric_func=auc_roc, class_names=class_names, **kwargs)
+        # the vectorized version does not support partial auc
+        auc_roc_bootstrap = MetricsLibClass.auc_roc_bootstrap if max_fpr is None else None
+        super().__init__(
+            pred,
+            target,
+            metric_func=auc_roc,
+            class_names=class_names,
+            bootstrap_metric_func=auc_roc_bootstrap,
+            **kwargs,
+        )
 
 
 class MetricROCCurve(MetricDefault):
@@ -191,7 +263,12 @@ class MetricAccuracy(MetricDefault):
         :param sample_weight: weight per sample for the final accuracy score. Keep None if not required.
         """
         super().__init__(
-            pred=pred, target=target, sample_weight=sample_weight, metric_func=MetricsLibClass.accuracy, **kwargs
+            pred=pred,
+            target=target,
+            sample_weight=sample_weight,
+            metric_func=MetricsLibClass.accuracy,
+            bootstrap_metric_func=MetricsLibClass.accuracy_bootstrap,
+            **kwargs,
         )
 
 
@@ -219,6 +296,7 @@ class MetricConfusion(MetricMultiClassDefault):
             target=target,
             metric_func=MetricsLibClass.confusion_metrics,
             class_names=class_names,
+            bootstrap_metric_func=MetricsLibClass.confusion_metrics_bootstrap,
             metrics=metrics,
             **kwargs,
         )
@@ -264,3 +342,135 @@ class MetricBSS(MetricDefault):
         See super class
         """
         super().__init__(pred=pred, target=target, metric_func=MetricsLibClass.multi_class_bss, **kwargs)
+
+
+class MetricAccuracyStreaming(MetricStreamingBase):
+    """
+    Streaming version of MetricAccuracy - accumulates the (weighted) number of correct predictions
+    """
+
+    def __init__(self, pred: str, target: str, sample_weight: Optional[str] = None, **kwargs):
+        """
+        :param pred: key name for the class predictions
+        :param target: key name for the ground truth labels
+        :param sample_weight: weight per sample for the final accuracy score. Keep None if not required.
+        """
+        super().__init__(pred=pred, target=target, sample_weight=sample_weight, **kwargs)
+
+    def reset_state(self) -> None:
+        self._correct = 0.0
+        self._total = 0.0
+
+    def update(self, pred: np.ndarray, target: np.ndarray, sample_weight: Optional[np.ndarray] = None) -> None:
+        weight = np.ones(len(target)) if sample_weight is None else sample_weight.astype(np.float64)
+        self._correct += float(np.sum(weight * (pred.reshape(target.shape) == target)))
+        self._total += float(np.sum(weight))
+
+    def compute(self) -> float:
+        return self._correct / self._total
+
+
+class MetricConfusionMatrixStreaming(MetricStreamingBase):
+    """
+    Streaming version of MetricConfusionMatrix - accumulates the confusion matrix
+    """
+
+    def __init__(
+        self, cls_pred: str, target: str, class_names: Sequence[str], sample_weight: Optional[str] = None, **kwargs
+    ) -> None:
+        """
+        :param cls_pred: key name for the class predictions
+        :param target: key name for the ground truth labels
+        :param class_names: string name per class
+        :param sample_weight: optional, weight per sample.
+        """
+        self._class_names = class_names
+        super().__init__(cls_pred=cls_pred, target=target, sample_weight=sample_weight, **kwargs)
+
+    def reset_state(self) -> None:
+        self._conf_matrix = np.zeros((len(self._class_names), len(self._class_names)), dtype=np.int64)
+
+    def update(self, cls_pred: np.ndarray, target: np.ndarray, sample_weight: Optional[np.ndarray] = None) -> None:
+        num_classes = len(self._class_names)
+        index = target.astype(np.int64).ravel() * num_classes + cls_pred.astype(np.int64).ravel()
+        counts = np.bincount(index, weights=sample_weight, minlength=num_classes**2)
+        if sample_weight is not None and self._conf_matrix.dtype != np.float64:
+            self._conf_matrix = self._conf_matrix.astype(np.float64)
+        self._conf_matrix += counts.reshape(num_classes, num_classes).astype(self._conf_matrix.dtype)
+
+    def compute(self) -> Dict[str, pd.DataFrame]:
+        """
+        :return: {"count": <confusion matrix>, "percent" : <confusion matrix - percent>) - see MetricsLibClass.confusion_matrix()
+        """
+        conf_matrix_count = pd.DataFrame(self._conf_matrix, columns=self._class_names, index=self._class_names)
+        conf_matrix_total = self._conf_matrix.sum(axis=1)
+        conf_matrix_count["total"] = conf_matrix_total
+        conf_matrix_percent = pd.DataFrame(
+            self._conf_matrix / conf_matrix_total[:, None], columns=self._class_names, index=self._class_names
+        )
+        return {"count": conf_matrix_count, "percent": conf_matrix_percent}
+
+
+class MetricAUCROCBinned(MetricStreamingBase):
+    """
+    Streaming approximation of MetricAUCROC (one vs rest).
+    Accumulates, per class, histograms of the predicted probabilities of the positive and of the negative samples.
+    Predictions that fall in the same bin are considered as ties - the error is bounded by the fraction of (positive, negative) pairs sharing a bin.
+    """
+
+    def __init__(
+        self, pred: str, target: str, class_names: Optional[Sequence[str]] = None, num_bins: int = 1000, **kwargs
+    ):
+        """
+        :param pred: key name for the predicted probabilities. Each element shape is [num_classes],
+                     for a binary classifier, can also be the probability of the positive class.
+        :param target: key name for the ground truth labels. Each element is an integer in range [0 - num_classes)
+        :param class_names: class names for multi-class evaluation or None for binary evaluation (the last class is the positive class)
+        :param num_bins: number of equal width bins in range [0, 1]
+        """
+        self._class_names = class_names
+        self._num_bins = num_bins
+        super().__init__(pred=pred, target=target, **kwargs)
+
+    def reset_state(self) -> None:
+        self._pos_hist = None
+        self._neg_hist = None
+
+    def update(self, pred: np.ndarray, target: np.ndarray) -> None:
+        pred = pred.astype(np.float64)
+        if pred.ndim == 1:  # binary case
+            pred = np.stack((1 - pred, pred), axis=1)
+        target = target.reshape(-1)
+
+        num_classes = pred.shape[1]
+        if self._pos_hist is None:
+            self._pos_hist = np.zeros((num_classes, self._num_bins), dtype=np.int64)
+            self._neg_hist = np.zeros((num_classes, self._num_bins), dtype=np.int64)
+
+        bins = np.clip((pred * self._num_bins).astype(np.int64), 0, self._num_bins - 1)
+        for cls_index in range(num_classes):
+            positive = target == cls_index
+            self._pos_hist[cls_index] += np.bincount(bins[positive, cls_index], minlength=self._num_bins)
+            self._neg_hist[cls_index] += np.bincount(bins[~positive, cls_index], minlength=self._num_bins)
+
+    def compute(self) -> Union[Dict[str, float], float]:
+        aucs = [self._binned_auc(pos_hist, neg_hist) for pos_hist, neg_hist in zip(self._pos_hist, self._neg_hist)]
+        if self._class_names is None:
+            return aucs[-1]
+
+        metric_results = {cls_name: auc for cls_name, auc in zip(self._class_names, aucs)}
+        aucs = np.array(aucs)
+        metric_results["macro_avg"] = np.mean(aucs[~np.isnan(aucs)])
+        return metric_results
+
+    @staticmethod
+    def _binned_auc(pos_hist: np.ndarray, neg_hist: np.ndarray) -> float:
+        """
+        the probability that a positive sample is ranked above a negative sample, counting pairs in the same bin as half
+        """
+        num_pos = pos_hist.sum()
+        num_neg = neg_hist.sum()
+        if num_pos == 0 or num_neg == 0:
+            return float("nan")
+        neg_below = np.cumsum(neg_hist) - neg_hist
+        return float(np.sum(pos_hist * (neg_below + 0.5 * neg_hist)) / (num_pos * num_neg))
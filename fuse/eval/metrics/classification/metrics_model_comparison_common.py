@@ -17,7 +17,8 @@ Created on June 30, 2021
 
 """
 
-from typing import Optional, Sequence
+from functools import partial
+from typing import Any, Dict, Optional, Sequence
 
 from .metrics_classification_common import MetricMultiClassDefault
 from fuse.eval.metrics.libs.model_comparison import ModelComparison
@@ -25,23 +26,69 @@ from fuse.eval.metrics.metrics_common import MetricDefault
 
 
 class MetricDelongsTest(MetricMultiClassDefault):
-    def __init__(self, pred1: str, pred2: str, target: str, class_names: Optional[Sequence[str]] = None, **kwargs):
+    def __init__(
+        self,
+        pred1: Optional[str] = None,
+        pred2: Optional[str] = None,
+        target: Optional[str] = None,
+        class_names: Optional[Sequence[str]] = None,
+        preds: Optional[Dict[str, str]] = None,
+        **kwargs,
+    ):
         # :param pred1: key name for the predictions of model 1
         # :param pred2: key name for the predictions of model 2
         # :param target: key name for the ground truth labels
         # :param class_names: class names. required for multi-class classifiers
+        # :param preds: compare K models at once instead of pred1 and pred2 - map from model name to the key name of its predictions.
+        #               returns the AUC of each model ("auc_<name>"), and the z-score and p-value of each pair of models
+        #               ("z_<name1>_vs_<name2>", "p_value_<name1>_vs_<name2>") - see ModelComparison.delong_auc_test_multi()
+        if target is None:
+            raise Exception("Error: MetricDelongsTest requires target")
 
+        if preds is None:
+            super().__init__(
+                pred=None,
+                target=target,
+                metric_func=ModelComparison.delong_auc_test,
+                class_names=class_names,
+                pred1=pred1,
+                pred2=pred2,
+                **kwargs,
+            )
+            return
+
+        if pred1 is not None or pred2 is not None:
+            raise Exception("Error: MetricDelongsTest expects either pred1 and pred2 or preds")
+        model_names = list(preds.keys())
         super().__init__(
             pred=None,
             target=target,
-            metric_func=ModelComparison.delong_auc_test,
+            metric_func=partial(_delong_auc_test_multi, model_names=model_names),
             class_names=class_names,
-            pred1=pred1,
-            pred2=pred2,
-            **kwargs
+            **{f"pred_{name}": key for name, key in preds.items()},
+            **kwargs,
         )
 
 
+def _delong_auc_test_multi(
+    target: Sequence, model_names: Sequence[str], pos_class_index: int = -1, **preds: Sequence
+) -> Dict[str, Any]:
+    """
+    Runs ModelComparison.delong_auc_test_multi() and names the results
+    """
+    results = ModelComparison.delong_auc_test_multi(
+        [preds[f"pred_{name}"] for name in model_names], target, pos_class_index=pos_class_index
+    )
+    named_results = {}
+    for index, name in enumerate(model_names):
+        named_results[f"auc_{name}"] = results["auc"][index]
+    for index1, name1 in enumerate(model_names):
+        for index2, name2 in enumerate(model_names[index1 + 1 :], start=index1 + 1):
+            named_results[f"z_{name1}_vs_{name2}"] = results["z"][index1, index2]
+            named_results[f"p_value_{name1}_vs_{name2}"] = results["p_value"][index1, index2]
+    return named_results
+
+
 class MetricContingencyTable(MetricDefault):
     def __init__(self, var1: str, var2: str, **kwargs):
         """
@@ -76,5 +123,5 @@ class MetricMcnemarsTest(MetricMultiClassDefault):
             target=target,
             exact=exact,
             metric_func=ModelComparison.mcnemars_test,
-            **kwargs
+            **kwargs,
         )
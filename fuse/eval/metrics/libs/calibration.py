@@ -1,8 +1,7 @@
 from re import T
-from typing import Sequence, Union, Dict, Optional
+from typing import Sequence, Tuple, Union, Dict, Optional
 import numpy as np
 import matplotlib.pyplot as plt
-import math
 import torch
 from torch import nn, optim
 from scipy import stats
@@ -33,40 +32,24 @@ class Calibration:
         """
         assert num_bins is None or num_quantiles is None
 
-        if isinstance(pred[0], float):  # binary case
-            pred = [np.array([1 - p, p]) for p in pred]
+        pred = Calibration._stack_pred(pred)
+        target = np.asarray(target).reshape(-1)
 
-        max_pred = [np.max(p) for p in pred]
-        cls_pred = [np.argmax(p) for p in pred]
+        # make sure that the inputs make proper probabilities
+        pred_sum = pred.sum(axis=1)
+        assert np.all(np.abs(pred_sum - 1) <= 1e-5 * np.maximum(np.abs(pred_sum), 1))
 
-        assert all(
-            [math.isclose(p.sum(), 1, rel_tol=1e-5) for p in pred]
-        )  # make sure that the inputs make proper probabilities
+        max_pred = pred.max(axis=1)
+        correct = pred.argmax(axis=1) == target
 
         total_samples = len(pred)
-        max_pred = np.array(max_pred)
-        if num_bins is not None:
-            conf_vec = np.linspace(0, 1, num_bins + 1)
-        else:
-            quantiles_vec = np.linspace(0, 1, num_quantiles + 1)
-            conf_vec = stats.mstats.mquantiles(max_pred, quantiles_vec.tolist())
-        acc_vec = np.zeros(len(conf_vec) - 1)
-        fraction_of_samples = np.zeros(len(conf_vec) - 1)
-        num_samples = np.zeros(len(conf_vec) - 1)
-        for i in range(len(conf_vec) - 1):
-            cnt_correct_in_conf = sum(
-                [
-                    p_cls == t
-                    for (p_cls, p, t) in zip(cls_pred, max_pred, target)
-                    if p >= conf_vec[i] and p < conf_vec[i + 1]
-                ]
-            )
-            cnt_conf = len([p for p in max_pred if p >= conf_vec[i] and p < conf_vec[i + 1]])
-            num_samples[i] = cnt_conf
-            fraction_of_samples[i] = cnt_conf / np.max([total_samples, np.finfo(float).eps])
-            acc_vec[i] = cnt_correct_in_conf / np.max([cnt_conf, np.finfo(float).eps])
+        conf_vec = Calibration._get_conf_vec(max_pred, num_bins, num_quantiles)
+        bins = Calibration.assign_bins(max_pred, conf_vec)
+        num_samples = Calibration.bin_sums(bins, len(conf_vec) - 1)
+        fraction_of_samples = num_samples / np.max([total_samples, np.finfo(float).eps])
+        acc_vec = Calibration.bin_sums(bins, len(conf_vec) - 1, correct) / np.maximum(num_samples, np.finfo(float).eps)
         mid_conf_vec = np.diff(conf_vec) / 2 + conf_vec[:-1]
-        cnt_correct_total = sum([p_cls == t for (p_cls, t) in zip(cls_pred, target)])
+        cnt_correct_total = correct.sum()
         avg_acc = cnt_correct_total / total_samples
         avg_conf = np.mean(max_pred)
         # extract info for the plot
@@ -107,35 +90,193 @@ class Calibration:
         target: Sequence[Union[np.ndarray, int]],
         num_bins: Optional[int] = 10,
         num_quantiles: Optional[int] = None,
-    ) -> float:
+        classwise: bool = False,
+    ) -> Dict[str, float]:
         """
         :param pred: prediction array per sample. Each element shape [num_classes]
         :param target: target per sample. Each element is an integer in range [0 - num_classes)
         :num_bins: Integer denoting the number of equal width bins in the diagram's x-axis.
         :num_quantiles: Integer denoting the number of equal number of samples quantiles in the diagram's x-axis.
             Note, either num_bins or num_quantiles should be set to None, as they define different ways to split the x-axis.
+        :param classwise: compute also the classwise ECE - see classwise_ece()
         :return Expected Calibration Error (ECE) score
         """
         reliability_results = Calibration.reliability_diagram(
             pred, target, num_bins=num_bins, num_quantiles=num_quantiles, output_filename=None
         )
-        conf_vec = reliability_results["conf_vec"][1:]
-        total_samples = reliability_results["total_samples"]
-        num_samples_per_bin = reliability_results["num_samples_per_bin"]
-        existing_bins = num_samples_per_bin > 0
-        accuracy_vec = reliability_results["accuracy"]
-        # expected calibration error
-        ece = (1.0 / total_samples) * np.sum(num_samples_per_bin * np.abs(accuracy_vec - conf_vec))
-        # maximum calibration error
-        # we filter out bins which don't contain any samples
-        mce = np.max(np.abs(accuracy_vec[existing_bins] - conf_vec[existing_bins]))
+        ece, mce = Calibration.ece_from_bins(
+            reliability_results["num_samples_per_bin"],
+            reliability_results["accuracy"],
+            reliability_results["total_samples"],
+            reliability_results["conf_vec"],
+        )
+
+        results = {}
+        results["ece"] = ece
+        results["mce"] = mce
+        if classwise:
+            results["classwise_ece"] = Calibration.classwise_ece(
+                pred, target, num_bins=num_bins, num_quantiles=num_quantiles
+            )
+
+        return results
+
+    @staticmethod
+    def ece_bootstrap(
+        pred: Sequence[Union[np.ndarray, float]],
+        target: Sequence[Union[np.ndarray, int]],
+        indices: np.ndarray,
+        num_bins: int = 10,
+        classwise: bool = False,
+    ) -> Dict[str, np.ndarray]:
+        """
+        Vectorized version of ece() for bootstrapping: computes the ECE of many bootstrap replicates at once.
+        The bin of each sample is computed once, and reused by all of the replicates (equal width bins only).
+        See ece() for the other params
+        :param indices: integer array [num_replicates, num_samples] - each row includes the indices of the samples drawn in a replicate
+        :return: dictionary of arrays - a value per replicate
+        """
+        pred = Calibration._stack_pred(pred)
+        target = np.asarray(target).reshape(-1)
+        total_samples = indices.shape[1]
+
+        max_pred = pred.max(axis=1)
+        correct = pred.argmax(axis=1) == target
+        conf_vec = Calibration._get_conf_vec(max_pred, num_bins, None)
+        bins = Calibration.assign_bins(max_pred, conf_vec)[indices]
+        num_samples = Calibration.bin_sums(bins, num_bins)
+        accuracy = Calibration.bin_sums(bins, num_bins, correct[indices]) / np.maximum(num_samples, np.finfo(float).eps)
+        ece, mce = Calibration.ece_from_bins(num_samples, accuracy, total_samples, conf_vec)
 
         results = {}
         results["ece"] = ece
         results["mce"] = mce
+        if classwise:
+            classes_ece = []
+            for cls_index in range(pred.shape[1]):
+                cls_pred = pred[:, cls_index]
+                bins = Calibration.assign_bins(cls_pred, conf_vec)[indices]
+                classes_ece.append(
+                    Calibration._classwise_ece_from_bin_sums(
+                        Calibration.bin_sums(bins, num_bins),
+                        Calibration.bin_sums(bins, num_bins, (target == cls_index)[indices]),
+                        Calibration.bin_sums(bins, num_bins, cls_pred[indices]),
+                        total_samples,
+                    )
+                )
+            results["classwise_ece"] = np.mean(classes_ece, axis=0)
 
         return results
 
+    @staticmethod
+    def classwise_ece(
+        pred: Sequence[Union[np.ndarray, float]],
+        target: Sequence[Union[np.ndarray, int]],
+        num_bins: Optional[int] = 10,
+        num_quantiles: Optional[int] = None,
+    ) -> float:
+        """
+        Classwise ECE (https://arxiv.org/abs/1910.12656): the calibration error of the predicted probability of each class
+        (not just the top class), averaged over the classes.
+        Per class, the samples are binned by the predicted probability of the class,
+        and the frequency of the class in each bin is compared to the average predicted probability in the bin.
+        See ece() for the params
+        """
+        assert num_bins is None or num_quantiles is None
+
+        pred = Calibration._stack_pred(pred)
+        target = np.asarray(target).reshape(-1)
+
+        classes_ece = []
+        for cls_index in range(pred.shape[1]):
+            cls_pred = pred[:, cls_index]
+            conf_vec = Calibration._get_conf_vec(cls_pred, num_bins, num_quantiles)
+            bins = Calibration.assign_bins(cls_pred, conf_vec)
+            classes_ece.append(
+                Calibration._classwise_ece_from_bin_sums(
+                    Calibration.bin_sums(bins, len(conf_vec) - 1),
+                    Calibration.bin_sums(bins, len(conf_vec) - 1, target == cls_index),
+                    Calibration.bin_sums(bins, len(conf_vec) - 1, cls_pred),
+                    len(pred),
+                )
+            )
+        return float(np.mean(classes_ece))
+
+    @staticmethod
+    def assign_bins(confidence: np.ndarray, conf_vec: np.ndarray) -> np.ndarray:
+        """
+        :param confidence: confidence per sample
+        :param conf_vec: the bins edges
+        :return: the bin index of each sample: i such that conf_vec[i] <= confidence < conf_vec[i + 1].
+                 Samples out of the bins range get -1 or len(conf_vec) - 1 (ignored by bin_sums())
+        """
+        return np.digitize(confidence, conf_vec) - 1
+
+    @staticmethod
+    def bin_sums(bins: np.ndarray, num_bins: int, weights: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Sums the weights (or counts the samples) in each bin
+        :param bins: bin index per sample (see assign_bins()). Shape [num_samples], or [num_replicates, num_samples] to sum each replicate separately
+        :param num_bins: number of bins. Bin indices out of range [0, num_bins) are ignored.
+        :param weights: Optional, weight per sample - same shape as bins
+        :return: float array [num_bins] or [num_replicates, num_bins]
+        """
+        bins_2d = np.atleast_2d(bins)
+        valid = (bins_2d >= 0) & (bins_2d < num_bins)
+        flat_bins = (bins_2d + np.arange(len(bins_2d))[:, None] * num_bins)[valid]
+        if weights is not None:
+            weights = np.atleast_2d(np.asarray(weights, dtype=np.float64))[valid]
+        sums = np.bincount(flat_bins, weights=weights, minlength=len(bins_2d) * num_bins).astype(np.float64)
+        sums = sums.reshape(len(bins_2d), num_bins)
+        return sums if np.ndim(bins) > 1 else sums[0]
+
+    @staticmethod
+    def ece_from_bins(
+        num_samples_per_bin: np.ndarray, accuracy_per_bin: np.ndarray, total_samples: int, conf_vec: np.ndarray
+    ) -> Tuple[Union[float, np.ndarray], Union[float, np.ndarray]]:
+        """
+        Computes the expected and maximum calibration errors from the number of samples and the accuracy in each bin.
+        Supports also arrays of shape [num_replicates, num_bins] - returns a value per replicate.
+        :param conf_vec: the bins edges - the upper edge is used as the confidence of the bin
+        :return: tuple (ece, mce)
+        """
+        calibration_error = np.abs(accuracy_per_bin - conf_vec[1:])
+        # expected calibration error
+        ece = (1.0 / total_samples) * np.sum(num_samples_per_bin * calibration_error, axis=-1)
+        # maximum calibration error
+        # we filter out bins which don't contain any samples
+        mce = np.max(np.where(num_samples_per_bin > 0, calibration_error, -np.inf), axis=-1)
+        return ece, mce
+
+    @staticmethod
+    def _classwise_ece_from_bin_sums(
+        num_samples_per_bin: np.ndarray,
+        num_positive_per_bin: np.ndarray,
+        sum_pred_per_bin: np.ndarray,
+        total_samples: int,
+    ) -> Union[float, np.ndarray]:
+        return (1.0 / total_samples) * np.sum(np.abs(num_positive_per_bin - sum_pred_per_bin), axis=-1)
+
+    @staticmethod
+    def _stack_pred(pred: Sequence[Union[np.ndarray, float]]) -> np.ndarray:
+        """
+        :return: array [num_samples, num_classes]
+        """
+        if isinstance(pred[0], float):  # binary case
+            pred = np.asarray(pred, dtype=np.float64)
+            return np.stack((1 - pred, pred), axis=1)
+        return np.stack(pred)
+
+    @staticmethod
+    def _get_conf_vec(confidence: np.ndarray, num_bins: Optional[int], num_quantiles: Optional[int]) -> np.ndarray:
+        """
+        :return: the bins edges - either equal width bins or quantiles
+        """
+        if num_bins is not None:
+            return np.linspace(0, 1, num_bins + 1)
+        quantiles_vec = np.linspace(0, 1, num_quantiles + 1)
+        return stats.mstats.mquantiles(confidence, quantiles_vec.tolist())
+
     @staticmethod
     def find_temperature(pred: Sequence[Union[np.ndarray, float]], target: Sequence[Union[np.ndarray, int]]) -> float:
         """
@@ -24,6 +24,8 @@ import numpy as np
 from sklearn import metrics
 import sklearn
 
+from fuse.eval.metrics.utils import bootstrap_counts
+
 import matplotlib.pyplot as plt
 
 
@@ -175,22 +177,38 @@ class MetricsLibClass:
         if sample_weight is None:
             sample_weight = np.ones_like(class_target_t)
 
-        res = {}
         tp = (np.logical_and(class_target_t, class_pred_t) * sample_weight).sum()
         fn = (np.logical_and(class_target_t, np.logical_not(class_pred_t)) * sample_weight).sum()
         fp = (np.logical_and(np.logical_not(class_target_t), class_pred_t) * sample_weight).sum()
         tn = (np.logical_and(np.logical_not(class_target_t), np.logical_not(class_pred_t)) * sample_weight).sum()
 
+        return MetricsLibClass._confusion_metrics_from_counts(tp, fn, fp, tn, metrics)
+
+    @staticmethod
+    def _confusion_metrics_from_counts(
+        tp: Union[float, np.ndarray],
+        fn: Union[float, np.ndarray],
+        fp: Union[float, np.ndarray],
+        tn: Union[float, np.ndarray],
+        metrics: Sequence[str],
+    ) -> Dict[str, Union[float, np.ndarray]]:
+        """
+        Computes the required metrics from the (weighted) confusion counts. Supports either scalars or an array per count (element per bootstrap replicate).
+        """
+        res = {}
         for metric in metrics:
             if metric in ["sensitivity", "recall", "tpr"]:
                 res[metric] = tp / (tp + fn)
             elif metric in ["specificity", "selectivity", "tnr"]:
                 res[metric] = tp / (tn + fp)
             elif metric in ["precision", "ppv"]:
-                if tp + fp != 0:
-                    res[metric] = tp / (tp + fp)
+                if np.isscalar(tp):
+                    if tp + fp != 0:
+                        res[metric] = tp / (tp + fp)
+                    else:
+                        res[metric] = 0
                 else:
-                    res[metric] = 0
+                    res[metric] = np.where(tp + fp != 0, tp / (tp + fp), 0)
             elif metric in ["f1"]:
                 res[metric] = 2 * tp / (2 * tp + fp + fn)
             elif metric in ["matrix"]:
@@ -203,6 +221,102 @@ class MetricsLibClass:
 
         return res
 
+    @staticmethod
+    def auc_roc_bootstrap(
+        pred: Sequence[Union[np.ndarray, float]],
+        target: Sequence[Union[np.ndarray, int]],
+        indices: np.ndarray,
+        sample_weight: Optional[Sequence[Union[np.ndarray, float]]] = None,
+        pos_class_index: int = -1,
+    ) -> np.ndarray:
+        """
+        Vectorized version of auc_roc() for bootstrapping: computes the auc of many bootstrap replicates at once.
+        Each replicate is represented by the number of times each sample was drawn (used as a sample weight),
+        and the area under the roc curve of all of the replicates is computed with a few array operations.
+        See auc_roc() for the other params
+        :param indices: integer array [num_replicates, num_samples] - each row includes the indices of the samples drawn in a replicate
+        :return: auc per replicate - NaN if a replicate includes a single class
+        """
+        if not isinstance(pred[0], np.ndarray):
+            pos_class_index = 1
+            y_score = np.asarray(pred, dtype=np.float64)
+        else:
+            if pos_class_index < 0:
+                pos_class_index = pred[0].shape[0] - 1
+            y_score = np.asarray(pred)[:, pos_class_index]
+        y_true = np.asarray(target) == pos_class_index
+        weight = np.ones(len(y_score)) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+
+        # group the samples by (tied) score - from the highest score (threshold) to the lowest
+        order = np.argsort(y_score, kind="mergesort")[::-1]
+        sorted_score = y_score[order]
+        group_starts = np.concatenate([[0], np.nonzero(sorted_score[1:] != sorted_score[:-1])[0] + 1])
+        pos_weight = (y_true * weight)[order]
+        neg_weight = (~y_true * weight)[order]
+
+        # the roc curve points of each replicate: the (weighted) true and false positives at each threshold
+        counts = bootstrap_counts(indices, len(y_score))[:, order]
+        tps = np.cumsum(np.add.reduceat(counts * pos_weight, group_starts, axis=1), axis=1)
+        fps = np.cumsum(np.add.reduceat(counts * neg_weight, group_starts, axis=1), axis=1)
+        tps = np.concatenate([np.zeros((len(tps), 1)), tps], axis=1)
+        fps = np.concatenate([np.zeros((len(fps), 1)), fps], axis=1)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            tpr = tps / tps[:, -1:]
+            fpr = fps / fps[:, -1:]
+            # trapezoidal rule
+            auc = (np.diff(fpr, axis=1) * (tpr[:, 1:] + tpr[:, :-1]) / 2.0).sum(axis=1)
+        valid = np.logical_and(tps[:, -1] > 0, fps[:, -1] > 0)
+        return np.where(valid, auc, np.nan)
+
+    @staticmethod
+    def accuracy_bootstrap(
+        pred: Sequence[Union[np.ndarray, int]],
+        target: Sequence[Union[np.ndarray, int]],
+        indices: np.ndarray,
+        sample_weight: Optional[Sequence[Union[np.ndarray, float]]] = None,
+    ) -> np.ndarray:
+        """
+        Vectorized version of accuracy() for bootstrapping: computes the accuracy of many bootstrap replicates at once.
+        See accuracy() for the other params
+        :param indices: integer array [num_replicates, num_samples] - each row includes the indices of the samples drawn in a replicate
+        :return: accuracy per replicate
+        """
+        correct = (np.asarray(pred) == np.asarray(target)).astype(np.float64)
+        if sample_weight is None:
+            return correct[indices].mean(axis=1)
+        weight = np.asarray(sample_weight, dtype=np.float64)
+        return (correct * weight)[indices].sum(axis=1) / weight[indices].sum(axis=1)
+
+    @staticmethod
+    def confusion_metrics_bootstrap(
+        pred: Sequence[Union[np.ndarray, int]],
+        target: Sequence[Union[np.ndarray, int]],
+        indices: np.ndarray,
+        pos_class_index: int = 1,
+        metrics: Sequence[str] = tuple(),
+        sample_weight: Optional[Sequence[Union[np.ndarray, float]]] = None,
+    ) -> Dict[str, np.ndarray]:
+        """
+        Vectorized version of confusion_metrics() for bootstrapping: computes the metrics of many bootstrap replicates at once.
+        See confusion_metrics() for the other params
+        :param indices: integer array [num_replicates, num_samples] - each row includes the indices of the samples drawn in a replicate
+        :return: dictionary, including an array with a value per replicate for each of the required metrics
+        """
+        class_target_t = np.asarray(target) == pos_class_index
+        class_pred_t = np.asarray(pred) == pos_class_index
+        weight = np.ones(len(class_target_t)) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+
+        # weighted contribution of each sample to each confusion count, summed over the samples drawn in each replicate
+        counts = bootstrap_counts(indices, len(class_target_t))
+        tp = counts @ (np.logical_and(class_target_t, class_pred_t) * weight)
+        fn = counts @ (np.logical_and(class_target_t, ~class_pred_t) * weight)
+        fp = counts @ (np.logical_and(~class_target_t, class_pred_t) * weight)
+        tn = counts @ (np.logical_and(~class_target_t, ~class_pred_t) * weight)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return MetricsLibClass._confusion_metrics_from_counts(tp, fn, fp, tn, metrics)
+
     @staticmethod
     def confusion_matrix(
         cls_pred: Sequence[int],
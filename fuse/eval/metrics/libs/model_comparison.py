@@ -152,64 +152,11 @@ class ModelComparison:
              cov12 is the 12 element of DeLong's covariance matrix (equal to the 21 element - symmetric matrix)
              cov22 is the 22 element of DeLong's covariance matrix (variance of the 2nd model's AUC)
         """
-        if isinstance(pred1[0], float):
-            predictions_1 = np.array(pred1)
-            predictions_2 = np.array(pred2)
-            ground_truth = np.array(target)
-        else:
-            if pos_class_index < 0:
-                pos_class_index = pred1[0].shape[0] - 1
-            predictions_1 = np.asarray(pred1)[:, pos_class_index]
-            predictions_2 = np.asarray(pred2)[:, pos_class_index]
-            ground_truth = (np.array(target) == pos_class_index) * 1
-
-        positive_labels = ground_truth == 1
-        negative_labels = ground_truth == 0
-        m = (positive_labels).sum()  # number of positives
-        n = (negative_labels).sum()  # number of negatives
-        x1 = predictions_1[positive_labels]
-        y1 = predictions_1[negative_labels]
-        x2 = predictions_2[positive_labels]
-        y2 = predictions_2[negative_labels]
-        # convert to matrix:
-        X1 = x1[:, np.newaxis].repeat(n, 1)
-        X2 = x2[:, np.newaxis].repeat(n, 1)
-        Y1 = y1[np.newaxis, :].repeat(m, 0)
-        Y2 = y2[np.newaxis, :].repeat(m, 0)
-
-        PSI1 = (Y1 < X1) * 1.0
-        PSI1[Y1 == X1] = 0.5
-
-        PSI2 = (Y2 < X2) * 1.0
-        PSI2[Y2 == X2] = 0.5
-
-        # empirical AUC:
-        emp_auc_1 = (1.0 / (m * n)) * PSI1.sum()
-        emp_auc_2 = (1.0 / (m * n)) * PSI2.sum()
-
-        # structural components (DeLong et al. 1988):
-        V10_1 = (1.0 / n) * PSI1.sum(1)
-        V10_2 = (1.0 / n) * PSI2.sum(1)
+        predictions_1, ground_truth = ModelComparison._delong_binary_inputs(pred1, target, pos_class_index)
+        predictions_2, _ = ModelComparison._delong_binary_inputs(pred2, target, pos_class_index)
 
-        V01_1 = (1.0 / m) * PSI1.sum(0)
-        V01_2 = (1.0 / m) * PSI2.sum(0)
-
-        # covariance matrix
-        S10 = (1.0 / (m - 1)) * np.array(
-            [
-                [np.linalg.norm(V10_1 - emp_auc_1) ** 2, (V10_1 - emp_auc_1).dot(V10_2 - emp_auc_2)],
-                [(V10_2 - emp_auc_2).dot(V10_1 - emp_auc_1), np.linalg.norm(V10_2 - emp_auc_2) ** 2],
-            ]
-        )
-
-        S01 = (1.0 / (n - 1)) * np.array(
-            [
-                [np.linalg.norm(V01_1 - emp_auc_1) ** 2, (V01_1 - emp_auc_1).dot(V01_2 - emp_auc_2)],
-                [(V01_2 - emp_auc_2).dot(V01_1 - emp_auc_1), np.linalg.norm(V01_2 - emp_auc_2) ** 2],
-            ]
-        )
-
-        S = (1.0 / m) * S10 + (1.0 / n) * S01
+        aucs, S = ModelComparison.delong_covariance(np.stack((predictions_1, predictions_2)), ground_truth)
+        emp_auc_1, emp_auc_2 = aucs
 
         # z-score:
         z = (emp_auc_1 - emp_auc_2) / ((S[0, 0] + S[1, 1] - 2 * S[0, 1]) ** 0.5 + np.finfo(float).eps)
@@ -229,6 +176,91 @@ class ModelComparison:
 
         return results
 
+    @staticmethod
+    def delong_auc_test_multi(
+        preds: Sequence[Sequence[np.ndarray]],
+        target: Sequence[np.ndarray],
+        pos_class_index: int = -1,
+    ) -> Dict[str, np.ndarray]:
+        """
+        DeLong's test for K models at once - compares the ROC AUCs of every pair of models (see delong_auc_test()).
+        The covariance matrix is computed once for all of the models, in O(K * N log N) time.
+        :param preds: the predictions of each model - same format as pred1 in delong_auc_test()
+        :param target: target per sample. Each element is an integer in range [0 - num_classes)
+        :param pos_class_index: index of the positive class (for one vs. rest) - see delong_auc_test()
+        :return {'auc', 'cov', 'z', 'p_value'},
+             auc is an array [K] with the AUC of each model
+             cov is DeLong's covariance matrix [K, K]
+             z is a matrix [K, K] - z[i, j] is the Z-score comparing model i to model j
+             p_value is a matrix [K, K] - p_value[i, j] is the p-value comparing model i to model j
+        """
+        predictions = []
+        for pred in preds:
+            model_predictions, ground_truth = ModelComparison._delong_binary_inputs(pred, target, pos_class_index)
+            predictions.append(model_predictions)
+
+        aucs, cov = ModelComparison.delong_covariance(np.stack(predictions), ground_truth)
+
+        # z-score for each pair of models
+        var = np.diag(cov)
+        diff_var = var[:, np.newaxis] + var[np.newaxis, :] - 2 * cov
+        z = (aucs[:, np.newaxis] - aucs[np.newaxis, :]) / (np.sqrt(np.maximum(diff_var, 0)) + np.finfo(float).eps)
+
+        # p-value:
+        p_value = 2 * scipy.stats.norm.sf(abs(z), loc=0, scale=1)
+
+        return {"auc": aucs, "cov": cov, "z": z, "p_value": p_value}
+
+    @staticmethod
+    def delong_covariance(predictions: np.ndarray, ground_truth: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Computes the empirical ROC AUCs of K models and DeLong's covariance matrix of the AUCs.
+        Uses the fast, midrank based, algorithm (Sun & Xu 2014) - O(K * N log N) time and O(K * N) memory,
+        instead of comparing every (positive, negative) pair of samples.
+        :param predictions: array [K, N] - the prediction of each model for each sample
+        :param ground_truth: array [N] - 1 for positive samples, 0 for negative samples
+        :return: tuple (aucs [K], covariance matrix [K, K])
+        """
+        positives = predictions[:, ground_truth == 1]
+        negatives = predictions[:, ground_truth == 0]
+        m = positives.shape[1]  # number of positives
+        n = negatives.shape[1]  # number of negatives
+
+        # midranks (ties get the average rank)
+        tx = scipy.stats.rankdata(positives, axis=1)
+        ty = scipy.stats.rankdata(negatives, axis=1)
+        tz = scipy.stats.rankdata(np.concatenate((positives, negatives), axis=1), axis=1)
+
+        # empirical AUC:
+        aucs = (tz[:, :m].sum(axis=1) / m - (m + 1) / 2.0) / n
+
+        # structural components (DeLong et al. 1988):
+        # V10 - for each positive, the fraction of negatives ranked below it (ties count as half)
+        # V01 - for each negative, the fraction of positives ranked above it
+        V10 = (tz[:, :m] - tx) / n
+        V01 = 1.0 - (tz[:, m:] - ty) / m
+
+        # covariance matrix
+        S10 = np.atleast_2d(np.cov(V10))
+        S01 = np.atleast_2d(np.cov(V01))
+        S = (1.0 / m) * S10 + (1.0 / n) * S01
+
+        return aucs, S
+
+    @staticmethod
+    def _delong_binary_inputs(
+        pred: Sequence[np.ndarray], target: Sequence[np.ndarray], pos_class_index: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: tuple (prediction of the positive class per sample, 1 for positive samples and 0 otherwise)
+        """
+        if isinstance(pred[0], float):
+            return np.array(pred), np.array(target)
+
+        if pos_class_index < 0:
+            pos_class_index = pred[0].shape[0] - 1
+        return np.asarray(pred)[:, pos_class_index], (np.array(target) == pos_class_index) * 1
+
     @staticmethod
     def contingency_table(var1: Sequence[bool], var2: Sequence[bool]) -> np.ndarray:
         """
@@ -1,13 +1,18 @@
-from typing import Any, Dict, Optional, Sequence, Tuple, Union
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
 import numpy as np
+import torch
 
-from scipy.spatial import distance
+from scipy import ndimage
 from scipy.spatial.distance import directed_hausdorff
 
 import matplotlib.pyplot as plt
 
 
+# the overlap scores computed by MetricsSegmentation.segmentation_scores()
+SEGMENTATION_SCORES = ("dice", "iou_jaccard", "overlap", "pixel_accuracy")
+
+
 class MetricsSegmentation:
     @staticmethod
     def get_tf_ft_values_from_bool_array_with_weights(u: np.ndarray, v: np.ndarray, w: Optional[Dict[int, np.ndarray]]):
@@ -28,36 +33,14 @@ class MetricsSegmentation:
     @staticmethod
     def dice(pred: np.ndarray, target: np.ndarray, pixel_weight: Optional[Dict[int, np.ndarray]] = None) -> Dict:
         """
-        Compute dice similarity score (2*|X&Y| / (|X|+|Y|)) using sklearn , pred and target should be of same shape
+        Compute dice similarity score (2*|X&Y| / (|X|+|Y|)), pred and target should be of same shape
         Supports multiclass (semantic segmentation)
         :param pred: single sample prediction matrix ( np.ndarray of any shape of type int/bool ) per sample
         :param target: target mask ( np.ndarray of any shape of type int/bool) per sample
         :param pixel_weight: Optional dictionary - key = label ,value = weight per pixel . Each element is  float in range [0-1]
         :return dice score
         """
-
-        labels = np.unique(target)
-        labels = labels[labels != 0]
-        scores = {}
-        for label in labels:
-            mask_pred = pred == label
-            mask_gt = target == label
-            label = str(int(label))
-            gt_empty = np.sum(mask_gt) == 0
-            pred_empty = np.sum(mask_pred) == 0
-
-            # dice not defined if both are empty ( 0/0 situation)
-            if gt_empty and pred_empty:
-                scores[label] = 1.0
-            else:
-                if pixel_weight is None or pixel_weight[label] is None:
-                    scores[label] = 1.0 - distance.dice(mask_pred.flatten(), mask_gt.flatten())
-                else:
-                    scores[label] = 1.0 - distance.dice(
-                        mask_pred.flatten(), mask_gt.flatten(), pixel_weight[label].flatten()
-                    )
-
-        return scores
+        return MetricsSegmentation.segmentation_scores(pred, target, ("dice",), pixel_weight)["dice"]
 
     @staticmethod
     def iou_jaccard(pred: np.ndarray, target: np.ndarray, pixel_weight: Optional[Dict[int, np.ndarray]] = None) -> Dict:
@@ -69,34 +52,7 @@ class MetricsSegmentation:
         :param pixel_weight: Optional dictionary - key = label ,value = weight per pixel . Each element is  float in range [0-1]
         :return: iou score
         """
-        # extract info for the plot
-        labels = np.unique(target)
-        labels = labels[labels != 0]
-        scores = {}
-        for label in labels:
-            mask_pred = pred == label
-            mask_gt = target == label
-            label = str(int(label))
-            gt_empty = np.sum(mask_gt) == 0
-            pred_empty = np.sum(mask_pred) == 0
-
-            # iou jaccard not defined if both are empty ( 0/0 situation)
-            if gt_empty and pred_empty:
-                scores[label] = 1.0
-            else:
-                if pixel_weight is None or pixel_weight[label] is None:
-                    intersection = np.logical_and(pred, target)
-                    union = np.logical_or(pred, target)
-                    iou_score = np.sum(intersection) / np.sum(union)
-                    scores[label] = iou_score
-                else:
-                    ntt = (pred * target * pixel_weight[label]).sum()
-                    (nft, ntf) = MetricsSegmentation.get_tf_ft_values_from_bool_array_with_weights(
-                        pred, target, pixel_weight[label]
-                    )
-                    iou_score = ntt / (nft + ntf + ntt)
-                    scores[label] = iou_score
-        return scores
+        return MetricsSegmentation.segmentation_scores(pred, target, ("iou_jaccard",), pixel_weight)["iou_jaccard"]
 
     @staticmethod
     def overlap(pred: np.ndarray, target: np.ndarray, pixel_weight: Optional[Dict[int, np.ndarray]] = None) -> Dict:
@@ -108,34 +64,164 @@ class MetricsSegmentation:
         :param pixel_weight: Optional dictionary - key = label ,value = weight per pixel . Each element is  float in range [0-1]
         :return: overlap score
         """
-        # extract info for the plot
-        labels = np.unique(target)
-        labels = labels[labels != 0]
-        scores = {}
-        for label in labels:
-            mask_pred = pred == label
-            mask_gt = target == label
-            label = str(int(label))
-            gt_empty = np.sum(mask_gt) == 0
-            pred_empty = np.sum(mask_pred) == 0
+        return MetricsSegmentation.segmentation_scores(pred, target, ("overlap",), pixel_weight)["overlap"]
 
-            # overlap not defined if both are empty ( 0/0 situation)
-            if gt_empty and pred_empty:
-                scores[label] = 1.0
-            elif gt_empty or pred_empty:
-                scores[label] = 0.0
+    @staticmethod
+    def pixel_accuracy(
+        pred: np.ndarray, target: np.ndarray, pixel_weight: Optional[Dict[int, np.ndarray]] = None
+    ) -> Dict:
+        """
+        Calculates pixel accuracy score (|X&Y| / |Y| ) based on predicted and target segmentation mask
+        Supports multiclass (semantic segmentation)
+        :param pred: single sample prediction matrix ( np.ndarray of any shape of type int/bool) per sample
+        :param target: target mask ( np.ndarray of any shape of type int/bool) per sample
+        :param pixel_weight: Optional dictionary - key = label ,value = weight per pixel . Each element is  float in range [0-1]
+        :return: pixel accuracy score
+        """
+        return MetricsSegmentation.segmentation_scores(pred, target, ("pixel_accuracy",), pixel_weight)[
+            "pixel_accuracy"
+        ]
+
+    @staticmethod
+    def segmentation_scores(
+        pred: np.ndarray,
+        target: np.ndarray,
+        metrics: Sequence[str] = SEGMENTATION_SCORES,
+        pixel_weight: Optional[Dict[int, np.ndarray]] = None,
+    ) -> Dict[str, Dict[str, float]]:
+        """
+        Computes several overlap scores at once, per label, from a single confusion matrix of the sample (see confusion_matrix()).
+        The scores are computed for the (non zero) labels that appear in the target.
+        :param pred: single sample prediction matrix ( np.ndarray of any shape of type int/bool) per sample
+        :param target: target mask ( np.ndarray of any shape of type int/bool) per sample
+        :param metrics: the scores to compute, subset of SEGMENTATION_SCORES: "dice", "iou_jaccard", "overlap", "pixel_accuracy"
+        :param pixel_weight: Optional dictionary - key = label ,value = weight per pixel . Each element is  float in range [0-1]
+        :return: dictionary - per metric, a dictionary with the score of each label
+        """
+        for metric in metrics:
+            if metric not in SEGMENTATION_SCORES:
+                raise Exception(
+                    f"Error: unsupported segmentation score {metric}. Supported scores: {SEGMENTATION_SCORES}"
+                )
+
+        labels, conf_matrix = MetricsSegmentation.confusion_matrix(pred, target)
+        target_size = conf_matrix.sum(axis=1)
+        pred_size = conf_matrix.sum(axis=0)
+
+        results = {metric: {} for metric in metrics}
+        for index, label_value in enumerate(labels):
+            if label_value == 0 or target_size[index] == 0:
+                continue
+            label = str(int(label_value))
+            if pixel_weight is not None and pixel_weight[label] is not None:
+                weight = pixel_weight[label].flatten()
+                mask_pred = np.asarray(pred).flatten() == label_value
+                mask_gt = np.asarray(target).flatten() == label_value
+                label_sizes = (
+                    np.sum(weight[mask_pred & mask_gt]),
+                    np.sum(weight[mask_pred]),
+                    np.sum(weight[mask_gt]),
+                )
             else:
-                if pixel_weight is None or pixel_weight[label] is None:
-                    intersection = np.logical_and(pred, target)
-                    overlap = np.sum(intersection) / min(np.sum(pred), np.sum(target))
-                    scores[label] = overlap
-                else:
-                    intersection = pred * target * pixel_weight[label]
-                    overlap = np.sum(intersection) / min(
-                        np.sum(pred * pixel_weight[label]), np.sum(target * pixel_weight[label])
-                    )
-                    scores[label] = overlap
-        return scores
+                label_sizes = (conf_matrix[index, index], pred_size[index], target_size[index])
+
+            for metric in metrics:
+                results[metric][label] = MetricsSegmentation.score_from_sizes(metric, *label_sizes)
+
+        return results
+
+    @staticmethod
+    def score_from_sizes(
+        metric: str,
+        intersection: Union[float, np.ndarray],
+        pred_size: Union[float, np.ndarray],
+        target_size: Union[float, np.ndarray],
+    ) -> Union[float, np.ndarray]:
+        """
+        Computes an overlap score of a label given the (possibly weighted) number of pixels:
+        :param metric: one of SEGMENTATION_SCORES
+        :param intersection: number of pixels with the label in both the prediction and the target
+        :param pred_size: number of pixels with the label in the prediction
+        :param target_size: number of pixels with the label in the target (expected to be positive)
+        """
+        if metric == "dice":
+            return 2.0 * intersection / (pred_size + target_size)
+        if metric == "iou_jaccard":
+            return intersection / (pred_size + target_size - intersection)
+        if metric == "overlap":
+            # overlap is zero when the prediction is empty
+            return np.where(pred_size > 0, intersection / np.maximum(np.minimum(pred_size, target_size), 1e-12), 0.0)[
+                ()
+            ]
+        if metric == "pixel_accuracy":
+            return intersection / target_size
+        raise Exception(f"Error: unsupported segmentation score {metric}. Supported scores: {SEGMENTATION_SCORES}")
+
+    @staticmethod
+    def confusion_matrix(pred: np.ndarray, target: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Computes the confusion matrix of a single sample in a single pass (np.bincount over target * K + pred)
+        :param pred: single sample prediction matrix ( np.ndarray of any shape of type int/bool) per sample
+        :param target: target mask ( np.ndarray of any shape of type int/bool) per sample
+        :return: tuple (labels, conf_matrix) - conf_matrix[i, j] is the number of pixels with target labels[i] and prediction labels[j]
+        """
+        pred = np.asarray(pred).ravel()
+        target = np.asarray(target).ravel()
+
+        if MetricsSegmentation._is_small_non_negative_int(pred) and MetricsSegmentation._is_small_non_negative_int(
+            target
+        ):
+            num_labels = int(max(pred.max(initial=0), target.max(initial=0))) + 1
+            labels = np.arange(num_labels)
+            pred_index = pred.astype(np.int64)
+            target_index = target.astype(np.int64)
+        else:
+            # map arbitrary label values to consecutive indices
+            labels, inverse = np.unique(np.concatenate((target, pred)), return_inverse=True)
+            num_labels = len(labels)
+            target_index = inverse[: len(target)]
+            pred_index = inverse[len(target) :]
+
+        conf_matrix = np.bincount(target_index * num_labels + pred_index, minlength=num_labels**2)
+        return labels, conf_matrix.reshape(num_labels, num_labels)
+
+    @staticmethod
+    def batch_confusion_matrix(
+        pred: Union[np.ndarray, torch.Tensor], target: Union[np.ndarray, torch.Tensor], num_labels: int
+    ) -> Union[np.ndarray, torch.Tensor]:
+        """
+        Computes the confusion matrix of each sample in a batch in a single pass.
+        Supports torch tensors (computed on the tensors device, e.g. in validation_step) and numpy arrays.
+        :param pred: batch of predicted labels [batch_size, ...] - integers in range [0, num_labels)
+        :param target: batch of target labels [batch_size, ...] - integers in range [0, num_labels)
+        :param num_labels: number of labels
+        :return: array/tensor [batch_size, num_labels, num_labels] - [b, i, j] is the number of pixels of sample b with target i and prediction j
+        """
+        batch_size = pred.shape[0]
+        if isinstance(pred, torch.Tensor):
+            pred = pred.reshape(batch_size, -1).long()
+            target = target.reshape(batch_size, -1).long()
+            offsets = torch.arange(batch_size, device=pred.device)[:, None] * num_labels**2
+            index = (offsets + target * num_labels + pred).reshape(-1)
+            conf_matrix = torch.bincount(index, minlength=batch_size * num_labels**2)
+        else:
+            pred = np.asarray(pred).reshape(batch_size, -1).astype(np.int64)
+            target = np.asarray(target).reshape(batch_size, -1).astype(np.int64)
+            offsets = np.arange(batch_size)[:, None] * num_labels**2
+            index = (offsets + target * num_labels + pred).reshape(-1)
+            conf_matrix = np.bincount(index, minlength=batch_size * num_labels**2)
+        return conf_matrix.reshape(batch_size, num_labels, num_labels)
+
+    @staticmethod
+    def _is_small_non_negative_int(values: np.ndarray, max_value: int = 1024) -> bool:
+        """
+        :return: True if the values can be used directly as confusion matrix indices
+        """
+        if values.dtype == bool:
+            return True
+        if values.dtype.kind not in "iu":
+            return False
+        return len(values) == 0 or (values.min() >= 0 and values.max() < max_value)
 
     @staticmethod
     def hausdorff_2d_distance(pred: np.ndarray, target: np.ndarray) -> Dict:
@@ -170,38 +256,124 @@ class MetricsSegmentation:
         return scores
 
     @staticmethod
-    def pixel_accuracy(
-        pred: np.ndarray, target: np.ndarray, pixel_weight: Optional[Dict[int, np.ndarray]] = None
+    def hausdorff_distance(
+        pred: np.ndarray,
+        target: np.ndarray,
+        spacing: Optional[Sequence[float]] = None,
+        percentile: float = 100,
     ) -> Dict:
         """
-        Calculates pixel accuracy score (|X&Y| / |Y| ) based on predicted and target segmentation mask
+        Calculates the (symmetric) Hausdorff distance between the surfaces of the predicted and target segmentation masks, per label.
+        Works for 2D, 3D or any dimension, using euclidean distance transforms restricted to the bounding box of the label.
         Supports multiclass (semantic segmentation)
         :param pred: single sample prediction matrix ( np.ndarray of any shape of type int/bool) per sample
         :param target: target mask ( np.ndarray of any shape of type int/bool) per sample
-        :param pixel_weight: Optional dictionary - key = label ,value = weight per pixel . Each element is  float in range [0-1]
-        :return: pixel accuracy score
+        :param spacing: Optional, the voxel spacing along each axis (e.g. in mm). Default is 1 along each axis.
+        :param percentile: use 95 for HD95 - the 95th percentile of the surface distances instead of the maximum
+        :return: distance per label. If the prediction of a label is empty, the distance is the diagonal of the volume.
         """
-        # extract info for the plot
-        labels = np.unique(target)
-        labels = labels[labels != 0]
         scores = {}
+        for label, distances in MetricsSegmentation._labels_surface_distances(pred, target, spacing):
+            if distances is None:
+                scores[label] = MetricsSegmentation._max_distance(target.shape, spacing)
+            else:
+                pred_to_target, target_to_pred = distances
+                scores[label] = max(
+                    np.percentile(pred_to_target, percentile), np.percentile(target_to_pred, percentile)
+                )
+        return scores
+
+    @staticmethod
+    def average_surface_distance(
+        pred: np.ndarray, target: np.ndarray, spacing: Optional[Sequence[float]] = None
+    ) -> Dict:
+        """
+        Calculates the average symmetric surface distance between the predicted and target segmentation masks, per label:
+        the mean distance from each surface voxel of one mask to the surface of the other mask.
+        See hausdorff_distance() for the params
+        :return: distance per label. If the prediction of a label is empty, the distance is the diagonal of the volume.
+        """
+        scores = {}
+        for label, distances in MetricsSegmentation._labels_surface_distances(pred, target, spacing):
+            if distances is None:
+                scores[label] = MetricsSegmentation._max_distance(target.shape, spacing)
+            else:
+                pred_to_target, target_to_pred = distances
+                scores[label] = (pred_to_target.sum() + target_to_pred.sum()) / (
+                    len(pred_to_target) + len(target_to_pred)
+                )
+        return scores
+
+    @staticmethod
+    def surface_distances(
+        mask_pred: np.ndarray, mask_gt: np.ndarray, spacing: Optional[Sequence[float]] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Computes the distances between the surfaces of two non empty binary masks.
+        The masks are cropped to the bounding box of their union, so the cost depends on the size of the objects, not on the size of the volume.
+        :param mask_pred: binary mask
+        :param mask_gt: binary mask - same shape as mask_pred
+        :param spacing: Optional, the voxel spacing along each axis
+        :return: tuple (distance from each surface voxel of mask_pred to the surface of mask_gt,
+                        distance from each surface voxel of mask_gt to the surface of mask_pred)
+        """
+        # crop to the bounding box of both masks, with a margin of one voxel
+        union = mask_pred | mask_gt
+        crop = tuple(
+            slice(indices.min(), indices.max() + 1)
+            for indices in (np.nonzero(union.any(axis=other_axes))[0] for other_axes in _other_axes(union.ndim))
+        )
+        mask_pred = np.pad(mask_pred[crop], 1)
+        mask_gt = np.pad(mask_gt[crop], 1)
+
+        surface_pred = MetricsSegmentation._surface(mask_pred)
+        surface_gt = MetricsSegmentation._surface(mask_gt)
+
+        # distance of each voxel to the nearest surface voxel of the other mask
+        distance_to_gt = ndimage.distance_transform_edt(~surface_gt, sampling=spacing)
+        distance_to_pred = ndimage.distance_transform_edt(~surface_pred, sampling=spacing)
+        return distance_to_gt[surface_pred], distance_to_pred[surface_gt]
+
+    @staticmethod
+    def _labels_surface_distances(
+        pred: np.ndarray, target: np.ndarray, spacing: Optional[Sequence[float]]
+    ) -> List[Tuple[str, Optional[Tuple[np.ndarray, np.ndarray]]]]:
+        """
+        :return: list of tuples (label, surface distances or None if the prediction is empty) for each (non zero) label in target
+        """
+        if MetricsSegmentation._is_small_non_negative_int(target.ravel()):
+            # avoid sorting the entire volume
+            labels = np.nonzero(np.bincount(target.ravel()))[0]
+        else:
+            labels = np.unique(target)
+        labels = labels[labels != 0]
+        ans = []
         for label in labels:
             mask_pred = pred == label
             mask_gt = target == label
-            label = str(int(label))
-            gt_empty = np.sum(mask_gt) == 0
-            pred_empty = np.sum(mask_pred) == 0
+            distances = MetricsSegmentation.surface_distances(mask_pred, mask_gt, spacing) if mask_pred.any() else None
+            ans.append((str(int(label)), distances))
+        return ans
 
-            # dice not defined if both are empty ( 0/0 situation)
-            if gt_empty and pred_empty:
-                scores[label] = 1.0
-            else:
-                if pixel_weight is None or pixel_weight[label] is None:
-                    intersection = np.logical_and(pred, target)
-                    pixel_accuracy = np.sum(intersection) / np.sum(target)
-                    scores[label] = pixel_accuracy
-                else:
-                    intersection = pred * target * pixel_weight[label]
-                    pixel_accuracy = np.sum(intersection) / np.sum(target * pixel_weight[label])
-                    scores[label] = pixel_accuracy
-        return scores
+    @staticmethod
+    def _surface(mask: np.ndarray) -> np.ndarray:
+        """
+        :return: the voxels of the mask that have a neighbor (along one of the axes) outside of the mask
+        """
+        structure = ndimage.generate_binary_structure(mask.ndim, 1)
+        return mask & ~ndimage.binary_erosion(mask, structure=structure, border_value=0)
+
+    @staticmethod
+    def _max_distance(shape: Sequence[int], spacing: Optional[Sequence[float]]) -> float:
+        """
+        :return: the diagonal of the volume - used as the distance when the prediction is empty
+        """
+        spacing = np.ones(len(shape)) if spacing is None else np.asarray(spacing, dtype=np.float64)
+        return float(np.linalg.norm(np.asarray(shape) * spacing))
+
+
+def _other_axes(ndim: int) -> List[Tuple[int, ...]]:
+    """
+    :return: for each axis, a tuple of all of the other axes
+    """
+    return [tuple(other for other in range(ndim) if other != axis) for axis in range(ndim)]
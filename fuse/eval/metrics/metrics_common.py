@@ -18,7 +18,7 @@ Created on June 30, 2021
 """
 
 from abc import ABC, abstractmethod
-from typing import Any, Callable, Dict, Hashable, Optional, Sequence, Tuple, Union
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple, Union
 import copy
 from fuse.utils import uncollate
 
@@ -28,6 +28,86 @@ import numpy as np
 import scipy
 
 from fuse.utils import NDict
+from fuse.utils.multiprocessing import run_multiprocessed, get_from_global_storage
+
+# number of replicates evaluated by each bootstrap shard (see run_bootstrap_shards())
+BOOTSTRAP_SHARD_SIZE = 250
+
+
+def split_bootstrap_results(
+    boot_results: Union[np.ndarray, Dict[str, np.ndarray]], num_replicates: int
+) -> List[Union[Dict[str, Any], Any]]:
+    """
+    Converts the results of a vectorized bootstrap evaluation - an array with a value per replicate, or a dictionary of such arrays,
+    to a list with the result of each replicate
+    """
+    if isinstance(boot_results, dict):
+        return [{key: value[index] for key, value in boot_results.items()} for index in range(num_replicates)]
+    return list(boot_results)
+
+
+def run_bootstrap_shards(
+    shard_func: Callable, shard_data: Dict[str, Any], num_of_bootstraps: int, rnd_seed: int, workers: int = 0
+) -> List[Any]:
+    """
+    Evaluates the bootstrap replicates in shards of BOOTSTRAP_SHARD_SIZE replicates, using a process pool.
+    Each shard draws its replicates from an independent random stream, spawned from rnd_seed using SeedSequence.
+    The split to shards does not depend on the number of workers - so the results are identical for any number of workers (including 0).
+    :param shard_func: evaluates a single shard. Gets a tuple (rnd, num_replicates) and returns a list with the result of each replicate.
+                       The shard_data is available using get_from_global_storage("bootstrap_shard_data").
+                       Must be picklable (a module level function).
+    :param shard_data: data required by shard_func (e.g. the metrics and the collected data). Copied once to each worker process.
+    :param num_of_bootstraps: total number of replicates
+    :param rnd_seed: seed for random number generator
+    :param workers: number of processes to use. Use 0 to evaluate the shards in the main process.
+    :return: list with the result of each replicate
+    """
+    num_shards = (num_of_bootstraps + BOOTSTRAP_SHARD_SIZE - 1) // BOOTSTRAP_SHARD_SIZE
+    seeds = np.random.SeedSequence(rnd_seed).spawn(num_shards)
+    args_list = [
+        (seed, min(BOOTSTRAP_SHARD_SIZE, num_of_bootstraps - shard_index * BOOTSTRAP_SHARD_SIZE))
+        for shard_index, seed in enumerate(seeds)
+    ]
+    shards_results = run_multiprocessed(
+        _bootstrap_shard_worker,
+        [(shard_func, seed, num_replicates) for seed, num_replicates in args_list],
+        workers=workers,
+        copy_to_global_storage={"bootstrap_shard_data": shard_data},
+    )
+    return [result for shard_results in shards_results for result in shard_results]
+
+
+def _bootstrap_shard_worker(args: Tuple[Callable, np.random.SeedSequence, int]) -> List[Any]:
+    shard_func, seed, num_replicates = args
+    rnd = np.random.RandomState(np.random.MT19937(seed))
+    return shard_func((rnd, num_replicates))
+
+
+def batch_to_numpy(values: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Converts the tensors to numpy arrays (other values are kept as is).
+    Tensors on GPU are copied asynchronously into pinned host memory, and waited for once - after all of the copies were issued.
+    """
+    ans = {}
+    devices = set()
+    for name, value in values.items():
+        if isinstance(value, torch.Tensor):
+            value = value.detach()
+            if value.is_cuda:
+                host_value = torch.empty(value.shape, dtype=value.dtype, pin_memory=True)
+                host_value.copy_(value, non_blocking=True)
+                devices.add(value.device)
+                value = host_value
+        ans[name] = value
+
+    for device in devices:
+        torch.cuda.synchronize(device)
+
+    for name, value in ans.items():
+        if isinstance(value, torch.Tensor):
+            ans[name] = value.numpy()
+
+    return ans
 
 
 class MetricBase(ABC):
@@ -70,6 +150,20 @@ class MetricBase(ABC):
         """
         raise NotImplementedError
 
+    def eval_bootstrap(
+        self, results: Dict[str, Any], ids: Sequence[Hashable], boot_indices: np.ndarray
+    ) -> Sequence[Union[Dict[str, Any], Any]]:
+        """
+        evaluate the collected data on many bootstrap replicates at once
+        The default implementation evaluates each replicate separately using eval(). Override to provide a vectorized implementation.
+        :param results: results aggergated by the previous metrics
+        :param ids: sequence of sample ids - the population the replicates are drawn from
+        :param boot_indices: integer array [num_replicates, num_samples] - each row includes the indices (in ids) of the samples drawn in a replicate
+        :return: sequence including the result of each replicate
+        """
+        ids = np.asarray(ids)
+        return [self.eval(results, ids[replicate_indices]) for replicate_indices in boot_indices]
+
 
 class MetricCollector(MetricBase):
     """
@@ -104,10 +198,30 @@ class MetricCollector(MetricBase):
     def collect(self, batch: Dict) -> None:
         """
         See super class
+        When there is no pre/post collect process func, the batch is collected as a whole:
+        each batched tensor is copied to host memory once, and appended to the collected data as a single slice.
+        Otherwise, the batch is split to samples and each sample is processed and collected separately.
         """
         if not isinstance(batch, NDict):
             batch = NDict(batch)
 
+        if not self._collect_batched(batch):
+            self._collect_per_sample(batch)
+
+        # extract ids and store it in self._collected_ids
+        ids = None
+        for key in self._id_keys:
+            if key in batch:
+                ids = batch[key]
+                break
+
+        if ids is not None:
+            self._add_ids(ids)
+
+    def _collect_per_sample(self, batch: NDict) -> None:
+        """
+        split the batch to samples and collect each one of them
+        """
         samples = uncollate(batch)
         for sample in samples:
             sample_to_collect = {}
@@ -129,15 +243,37 @@ class MetricCollector(MetricBase):
             for name in sample_to_collect:
                 self._collected_data[name].append(sample_to_collect[name])
 
-        # extract ids and store it in self._collected_ids
-        ids = None
-        for key in self._id_keys:
-            if key in batch:
-                ids = batch[key]
-                break
+    def _collect_batched(self, batch: NDict) -> bool:
+        """
+        collect the entire batch at once
+        :return: False if not supported for this batch (then it should be collected per sample)
+        """
+        if self._pre_collect_process_func is not None or self._post_collect_process_func is not None:
+            return False
 
-        if ids is not None:
-            self._collected_ids.extend(ids)
+        values = {}
+        lists_lengths = {}
+        for name, key in self._keys_to_collect.items():
+            value = batch[key]
+            if isinstance(value, (torch.Tensor, np.ndarray)):
+                values[name] = value
+            elif isinstance(value, (list, tuple)):
+                # a value per sample (e.g. variable shape tensors) - the tensors are converted element by element
+                lists_lengths[name] = len(value)
+                for index, element in enumerate(value):
+                    values[(name, index)] = element
+            else:
+                # a single value for the entire batch
+                return False
+
+        values = batch_to_numpy(values)
+        for name in self._keys_to_collect:
+            if name in lists_lengths:
+                self._collected_data[name].extend([values[(name, index)] for index in range(lists_lengths[name])])
+            else:
+                self._collected_data[name].extend_array(values[name])
+
+        return True
 
     @staticmethod
     def _df_dict_apply(data: pd.Series, func: Callable) -> pd.Series:
@@ -182,19 +318,29 @@ class MetricCollector(MetricBase):
                 break
 
         if ids is not None:
-            self._collected_ids.extend(ids)
+            self._add_ids(ids)
+
+    def _add_ids(self, ids: Sequence[Hashable]) -> None:
+        """
+        store the ids of the collected samples, and index them
+        """
+        for sample_id in ids:
+            # keep the first occurrence in case of duplicated ids
+            self._id_to_row.setdefault(sample_id, len(self._collected_ids))
+            self._collected_ids.append(sample_id)
 
     def reset(self) -> None:
         """
         See super class
         """
         if self._post_collect_process_func is None:
-            self._collected_data = {name: [] for name in self._keys_to_collect}
+            self._collected_data = {name: CollectedColumn() for name in self._keys_to_collect}
         else:
             # collect everything you get from post_collect_process_args
-            self._collected_data = {"post_args": []}
+            self._collected_data = {"post_args": CollectedColumn()}
 
         self._collected_ids = []  # the original collected ids
+        self._id_to_row = {}  # map from collected id to its position in the collected data
 
         self._sampled_ids = None  # the required ids - set be sample() method
 
@@ -204,25 +350,30 @@ class MetricCollector(MetricBase):
         """
         return self._collected_ids
 
+    def get_rows(self, ids: Sequence[Hashable]) -> np.ndarray:
+        """
+        :return: the positions of the given ids in the collected data
+        """
+        id_to_row = self._id_to_row
+        return np.fromiter((id_to_row[sample_id] for sample_id in ids), dtype=np.int64, count=len(ids))
+
     def get(self, ids: Optional[Sequence[Hashable]] = None) -> Tuple[Dict[str, Any]]:
         """
         Get collected data - collected data dictionary and collected ids.
-        each element in the dictionary will be a list of values from all samples
+        each element in the dictionary will include the values from all samples:
+        a numpy array (first dimension is the sample) if all of the values are numbers or numeric arrays of the same shape, otherwise a list.
+        Note - numeric columns used to be returned as lists. Code that relies on list semantics (e.g. truth value, "==" or "+")
+        should convert them with list() or .tolist().
+        :param ids: Optional, the ids of the samples to get, in the required order. By default, all of the samples in the collected order.
         """
-        if ids is None:
-            return copy.copy(self._collected_data)
-        else:
-            # convert required ids to permutation
-            original_ids = self._collected_ids
-            required_ids = ids
-            permutation = [original_ids.index(sample_id) for sample_id in required_ids]
+        # convert required ids to permutation
+        rows = None if ids is None else self.get_rows(ids)
 
-            # create the permuted dictionary
-            data = {}
-            for name, values in self._collected_data.items():
-                data[name] = [values[i] for i in permutation]
+        data = {}
+        for name, column in self._collected_data.items():
+            data[name] = column.get(rows)
 
-            return data
+        return data
 
     def eval(self, results: Dict[str, Any] = None) -> Union[Dict[str, Any], Any]:
         """
@@ -231,6 +382,127 @@ class MetricCollector(MetricBase):
         pass
 
 
+class CollectedColumn:
+    """
+    Growable column of values collected by MetricCollector - a value per sample.
+    Numeric values (numbers or numeric arrays) of the same shape are stored in a single contiguous, preallocated numpy array,
+    which is reallocated with double capacity when full. Other values are stored in an object array.
+    """
+
+    _INITIAL_CAPACITY = 16
+
+    def __init__(self):
+        self._data = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, value: Any) -> None:
+        """
+        add a single value
+        """
+        if self._data is None:
+            self._data = np.empty(
+                (CollectedColumn._INITIAL_CAPACITY,) + self._value_shape(value), self._value_dtype(value)
+            )
+        elif self._data.dtype != object:
+            self._adjust_to_value(value)
+
+        if self._size == len(self._data):
+            self._grow(self._size + 1)
+
+        if self._data.dtype == object:
+            # avoid numpy broadcasting sequences into the object array
+            self._data[self._size] = None
+            self._data[self._size] = value
+        else:
+            self._data[self._size] = value
+        self._size += 1
+
+    def extend(self, values: Sequence[Any]) -> None:
+        """
+        add a sequence of values
+        """
+        for value in values:
+            self.append(value)
+
+    def extend_array(self, values: np.ndarray) -> None:
+        """
+        add a batch of values - the first dimension of the array is the sample.
+        For numeric columns, the entire slice is copied at once.
+        """
+        if len(values) == 0:
+            return
+        if values.dtype.kind not in "biufc":
+            self.extend(list(values))
+            return
+
+        if self._data is None:
+            self._data = np.empty((CollectedColumn._INITIAL_CAPACITY,) + values.shape[1:], values.dtype)
+        elif self._data.dtype != object:
+            self._adjust_to_value(values[0])
+        if self._data.dtype == object:
+            self.extend(list(values))
+            return
+
+        if self._size + len(values) > len(self._data):
+            self._grow(self._size + len(values))
+        self._data[self._size : self._size + len(values)] = values
+        self._size += len(values)
+
+    def get(self, rows: Optional[np.ndarray] = None) -> Union[np.ndarray, list]:
+        """
+        :param rows: Optional, the positions of the values to get. By default, all of the values.
+        :return: numpy array for numeric columns (numbers or numeric arrays of the same shape), list otherwise
+        """
+        if self._data is None:
+            return []
+        values = self._data[: self._size]
+        values = values.copy() if rows is None else values[rows]
+        if values.dtype == object:
+            return list(values)
+        return values
+
+    def _grow(self, min_capacity: int) -> None:
+        capacity = max(min_capacity, 2 * len(self._data))
+        data = np.empty((capacity,) + self._data.shape[1:], dtype=self._data.dtype)
+        data[: self._size] = self._data[: self._size]
+        self._data = data
+
+    def _adjust_to_value(self, value: Any) -> None:
+        """
+        upcast the numeric column if required, or convert it to an object column if the value does not fit
+        """
+        value_dtype = self._value_dtype(value)
+        if value_dtype != object and self._value_shape(value) == self._data.shape[1:]:
+            dtype = np.result_type(self._data.dtype, value_dtype)
+            if dtype != self._data.dtype:
+                self._data = self._data.astype(dtype)
+            return
+
+        data = np.empty(len(self._data), dtype=object)
+        data[: self._size] = list(self._data[: self._size])
+        self._data = data
+
+    @staticmethod
+    def _value_dtype(value: Any) -> np.dtype:
+        if isinstance(value, np.ndarray):
+            return value.dtype if value.dtype.kind in "biufc" else np.dtype(object)
+        if isinstance(value, (bool, int, float, np.number, np.bool_)):
+            try:
+                return np.asarray(value).dtype
+            except OverflowError:
+                return np.dtype(object)
+        return np.dtype(object)
+
+    @staticmethod
+    def _value_shape(value: Any) -> Tuple[int, ...]:
+        if isinstance(value, np.ndarray) and value.dtype.kind in "biufc":
+            return value.shape
+        return ()
+
+
 class MetricWithCollectorBase(MetricBase):
     """
     Base implementation of metric with built-in collector
@@ -317,6 +589,37 @@ class MetricWithCollectorBase(MetricBase):
 
         return arg_dict
 
+    def _extract_arguments_bootstrap(
+        self, results: Dict[str, Any], ids: Sequence[Hashable], boot_indices: np.ndarray
+    ) -> Optional[Dict]:
+        """
+        extract arguments for a vectorized bootstrap evaluation (see eval_bootstrap()):
+        the collected data of all the samples, plus "indices" - for each replicate, the positions of the drawn samples in the collected data.
+        :return: the arguments, or None if not supported (when per-sample results or ids are required)
+        """
+        if self._extract_ids:
+            return None
+
+        if not isinstance(results, NDict):
+            results = NDict(results)
+
+        arg_dict = {}
+        arg_dict.update(self._collector.get())
+
+        for name in self._keys_from_results:
+            res = results[self._keys_from_results[name]]
+            if isinstance(res, Callable):  # per-sample metric
+                return None
+            arg_dict[name] = res
+
+        for name in self._value_args:
+            arg_dict[name] = self._value_args[name]
+
+        rows = self._collector.get_rows(ids)
+        arg_dict["indices"] = rows[boot_indices]
+
+        return arg_dict
+
     @abstractmethod
     def eval(self, results: Dict[str, Any] = None, ids: Optional[Sequence[Hashable]] = None) -> None:
         """
@@ -331,12 +634,23 @@ class MetricDefault(MetricWithCollectorBase):
     Can be used for any metric getting as an input list of prediction, list of targets and optionally additional parameters
     """
 
-    def __init__(self, metric_func: Callable, pred: Optional[str] = None, target: Optional[str] = None, **kwargs):
+    def __init__(
+        self,
+        metric_func: Callable,
+        pred: Optional[str] = None,
+        target: Optional[str] = None,
+        bootstrap_metric_func: Optional[Callable] = None,
+        **kwargs,
+    ):
         """
         :param pred: prediction key to collect
         :param target: target key to collect
         :param metric_func: function getting as a input list of predictions, targets and optionally more arguments specified in kwargs
                             the function should return a single result or a dictionary of results
+        :param bootstrap_metric_func: Optional, vectorized version of metric_func, used to evaluate many bootstrap replicates at once (see CI).
+                            Gets the same arguments as metric_func (collected for all of the samples)
+                            plus "indices" - integer array [num_replicates, num_samples] with the indices of the samples drawn in each replicate.
+                            Should return an array with a result per replicate or a dictionary of such arrays.
         :param kwargs: additional keyword arguments for MetricWithCollectorBase.
                        The keyword expected to be an argument name of metric_func and the value a string that is a key to value store in batch dict.
                        If instead a value should be extracted from results dict use "results:<key in results dict>
@@ -349,6 +663,7 @@ class MetricDefault(MetricWithCollectorBase):
         """
         super().__init__(pred=pred, target=target, **kwargs)
         self._metric_func = metric_func
+        self._bootstrap_metric_func = bootstrap_metric_func
 
     def eval(self, results: Dict[str, Any] = None, ids: Optional[Sequence[Hashable]] = None) -> Union[Dict, Any]:
         """
@@ -361,6 +676,20 @@ class MetricDefault(MetricWithCollectorBase):
         # single evaluation method
         return self._metric_func(**kwargs)
 
+    def eval_bootstrap(
+        self, results: Dict[str, Any], ids: Sequence[Hashable], boot_indices: np.ndarray
+    ) -> Sequence[Union[Dict, Any]]:
+        """
+        See super class
+        """
+        kwargs = None
+        if self._bootstrap_metric_func is not None:
+            kwargs = self._extract_arguments_bootstrap(results, ids, boot_indices)
+        if kwargs is None:
+            return super().eval_bootstrap(results, ids, boot_indices)
+
+        return split_bootstrap_results(self._bootstrap_metric_func(**kwargs), len(boot_indices))
+
 
 class MetricPerSampleDefault(MetricWithCollectorBase):
     """
@@ -395,6 +724,87 @@ class MetricPerSampleDefault(MetricWithCollectorBase):
         return self._result_aggregate_func(kwargs["post_args"])
 
 
+class MetricStreamingBase(MetricBase):
+    """
+    Base implementation of an online (streaming) metric.
+    Instead of collecting the values of every sample, collect() updates a fixed size state (sufficient statistics, e.g. counts or histograms),
+    and eval() computes the result from the state. The memory used doesn't depend on the number of samples,
+    and there is no long computation at the end of the epoch.
+    Implement reset_state(), update() and compute().
+    Since the values of each sample are not kept, evaluating a subset of the samples (ids) is not supported -
+    so streaming metrics can't be wrapped by CI, GroupAnalysis or Filter.
+    """
+
+    def __init__(self, **kwargs) -> None:
+        """
+        :param kwargs: the values to extract from each batch - the keyword is the argument name of update() and the value is a key in batch dict.
+                       Arguments set to None are not extracted.
+        """
+        super().__init__()
+        self._keys_to_collect = {n: k for n, k in kwargs.items() if k is not None}
+        self.reset_state()
+
+    @abstractmethod
+    def reset_state(self) -> None:
+        """
+        initialize the state
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def update(self, **kwargs: np.ndarray) -> None:
+        """
+        update the state with a batch of samples
+        :param kwargs: array per argument - the first dimension is the sample
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def compute(self) -> Union[Dict[str, Any], Any]:
+        """
+        compute the result from the state
+        """
+        raise NotImplementedError
+
+    def collect(self, batch: Dict) -> None:
+        """
+        See super class
+        """
+        if not isinstance(batch, NDict):
+            batch = NDict(batch)
+
+        values = batch_to_numpy({name: batch[key] for name, key in self._keys_to_collect.items()})
+        self.update(**{name: np.asarray(value) for name, value in values.items()})
+
+    def set(self, data: pd.DataFrame) -> None:
+        """
+        See super class
+        """
+        self.reset()
+        values = {}
+        for name, key in self._keys_to_collect.items():
+            if key not in data.keys():
+                raise Exception(f"Error key {key} wasn't found. Available keys {data.keys()}")
+            values[name] = np.stack(data[key].values)
+        self.update(**values)
+
+    def reset(self) -> None:
+        """
+        See super class
+        """
+        self.reset_state()
+
+    def eval(self, results: Dict[str, Any] = None, ids: Optional[Sequence[Hashable]] = None) -> Union[Dict, Any]:
+        """
+        See super class
+        """
+        if ids is not None:
+            raise Exception(
+                f"Error: {type(self).__name__} is a streaming metric and does not support evaluating a subset of the samples"
+            )
+        return self.compute()
+
+
 class GroupAnalysis(MetricWithCollectorBase):
     """
     Evaluate a metric per group and compute basic statistics about the different per group results.
@@ -535,6 +945,9 @@ class CI(MetricWithCollectorBase):
     {'org': <>, 'mean': <>, 'std': <>, 'conf_interval': <>, 'conf_lower': <>, 'conf_upper': <>}
     """
 
+    # maximum number of elements in the bootstrap indices array evaluated at once
+    MAX_CHUNK_ELEMENTS = 2**22
+
     def __init__(
         self,
         metric: MetricBase,
@@ -543,6 +956,7 @@ class CI(MetricWithCollectorBase):
         rnd_seed: int = 1234,
         conf_interval: float = 95,
         ci_method: str = "PERCENTILE",
+        workers: Optional[int] = None,
         **super_kwargs,
     ) -> None:
         """
@@ -552,10 +966,15 @@ class CI(MetricWithCollectorBase):
         :param rnd_seed: seed for random number generator.
         :param conf_interval: Confidence interval. Default is 95.
         :param ci_method: specifies the method for computing the confidence intervals from bootstrap samples. Options: NORMAL (assuming normal distribution), PERCENTILE, PIVOTAL
+        :param workers: None to draw all of the replicates from a single random stream in the main process.
+                        Otherwise, the replicates are split to shards with independent random streams (see run_bootstrap_shards()),
+                        evaluated by the specified number of processes (0 for the main process).
+                        For a given seed, the results are identical for any number of workers, but differ from the results of workers=None.
         """
         super().__init__(stratum=stratum, **super_kwargs)
 
         self._metric = metric
+        self._workers = workers
         self._num_of_bootstraps = num_of_bootstraps
         self._rnd_seed = rnd_seed
         self._conf_interval = conf_interval
@@ -588,31 +1007,37 @@ class CI(MetricWithCollectorBase):
         See super class
         :return: dictionary of format - {'org': <>, 'mean': <>, 'std': <>, 'conf_interval': <>, 'conf_lower': <>, 'conf_upper': <>}
         """
-        data = self._collector.get()
         if ids is None:
             ids = self._collector.get_ids()
-        if not ids:
+            data = self._collector.get()
+        else:
+            data = self._collector.get(ids)
+        if len(ids) == 0:
             raise Exception(
                 "Error: confidence interval is supported only when a unique identifier is specified. Add key 'id' to your data"
             )
         ids = np.array(ids)
 
-        rnd = np.random.RandomState(self._rnd_seed)
         original_sample_results = self._metric.eval(results)
-        boot_results = []
         ci_results = {}
 
-        stratum_id = np.array(data["stratum"]) if "stratum" in data else np.ones(len(data["index"]))
-        unique_strata = np.unique(stratum_id)
+        stratum_id = np.array(data["stratum"]) if "stratum" in data else np.ones(len(ids))
+        # the positions of each stratum samples
+        strata_indices = [np.nonzero(stratum_id == stratum)[0] for stratum in np.unique(stratum_id)]
 
-        for _ in range(self._num_of_bootstraps):
-            sampled_ids = ids.copy()
-            for stratum in unique_strata:
-                stratum_filter = stratum_id == stratum
-                n_stratum = sum(stratum_filter)
-                random_sample = rnd.randint(0, n_stratum, size=n_stratum)
-                sampled_ids[stratum_filter] = ids[stratum_filter][random_sample]
-            boot_results.append(self._metric.eval(results, sampled_ids))
+        if self._workers is None:
+            rnd = np.random.RandomState(self._rnd_seed)
+            boot_results = CI.eval_replicates(
+                self._metric.eval_bootstrap, results, ids, strata_indices, rnd, self._num_of_bootstraps
+            )
+        else:
+            boot_results = run_bootstrap_shards(
+                _ci_bootstrap_shard,
+                dict(metric=self._metric, results=results, ids=ids, strata_indices=strata_indices),
+                self._num_of_bootstraps,
+                self._rnd_seed,
+                self._workers,
+            )
 
         # results can be either a list of floats or a list of dictionaries
         if isinstance(original_sample_results, dict):
@@ -629,6 +1054,48 @@ class CI(MetricWithCollectorBase):
 
         return ci_results
 
+    @staticmethod
+    def eval_replicates(
+        eval_bootstrap_func: Callable,
+        results: Dict[str, Any],
+        ids: np.ndarray,
+        strata_indices: Sequence[np.ndarray],
+        rnd: np.random.RandomState,
+        num_replicates: int,
+    ) -> List[Any]:
+        """
+        Draws the replicates as indices, and evaluates them in chunks (limits the memory used by the indices)
+        :param eval_bootstrap_func: evaluates a chunk of replicates - see MetricBase.eval_bootstrap()
+        :return: list with the result of each replicate
+        """
+        boot_results = []
+        chunk_size = max(1, CI.MAX_CHUNK_ELEMENTS // len(ids))
+        for chunk_start in range(0, num_replicates, chunk_size):
+            chunk_num_replicates = min(chunk_size, num_replicates - chunk_start)
+            boot_indices = CI.draw_bootstrap_indices(rnd, strata_indices, len(ids), chunk_num_replicates)
+            boot_results.extend(eval_bootstrap_func(results, ids, boot_indices))
+        return boot_results
+
+    @staticmethod
+    def draw_bootstrap_indices(
+        rnd: np.random.RandomState, strata_indices: Sequence[np.ndarray], num_samples: int, num_replicates: int
+    ) -> np.ndarray:
+        """
+        Stratified bootstrap sampling - each replicate draws, with replacement, the same number of samples from each stratum
+        :param rnd: random number generator
+        :param strata_indices: the indices of the samples in each stratum
+        :param num_samples: total number of samples
+        :param num_replicates: number of replicates to draw
+        :return: integer array [num_replicates, num_samples] including the indices of the samples drawn in each replicate
+        """
+        boot_indices = np.empty((num_replicates, num_samples), dtype=np.int64)
+        for replicate_index in range(num_replicates):
+            for stratum_indices in strata_indices:
+                n_stratum = len(stratum_indices)
+                random_sample = rnd.randint(0, n_stratum, size=n_stratum)
+                boot_indices[replicate_index, stratum_indices] = stratum_indices[random_sample]
+        return boot_indices
+
     @staticmethod
     def _compute_stats(
         ci_method: str, orig: Union[float, np.ndarray], samples: Sequence[Union[float, np.ndarray]], confidence: float
@@ -670,3 +1137,11 @@ class CI(MetricWithCollectorBase):
 
         assert method == "PIVOTAL"
         return 2 * org_statistic - bootstrap_statistic_high, 2 * org_statistic - bootstrap_statistic_low
+
+
+def _ci_bootstrap_shard(args: Tuple[np.random.RandomState, int]) -> List[Any]:
+    rnd, num_replicates = args
+    data = get_from_global_storage("bootstrap_shard_data")
+    return CI.eval_replicates(
+        data["metric"].eval_bootstrap, data["results"], data["ids"], data["strata_indices"], rnd, num_replicates
+    )
@@ -16,13 +16,14 @@ limitations under the License.
 Created on June 30, 2021
 
 """
-from typing import Any, Callable, Dict, Optional, Sequence, Union, Hashable
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union, Hashable
 
 import numpy as np
 import pandas as pd
 
-from fuse.eval.metrics.metrics_common import MetricBase, MetricWithCollectorBase
+from fuse.eval.metrics.metrics_common import CI, MetricBase, MetricWithCollectorBase, run_bootstrap_shards
 from fuse.eval.metrics.libs.model_comparison import ModelComparison
+from fuse.utils.multiprocessing import get_from_global_storage
 
 
 class PairedBootstrap(MetricWithCollectorBase):
@@ -45,6 +46,7 @@ class PairedBootstrap(MetricWithCollectorBase):
         num_of_bootstraps: int = 10000,
         rnd_seed: int = 1234,
         margin: float = 0.0,
+        workers: Optional[int] = None,
         **super_kwargs
     ) -> None:
         """
@@ -59,6 +61,10 @@ class PairedBootstrap(MetricWithCollectorBase):
         :param compare_method: callback that defines the hypothesis and compares the results.
                                Required prototype: func(name: str, test_values: Sequence[float], reference_values: Sequence[float]) -> Union[Dict[str, float], float]
                                See example: ModelComparison.bootstrap_margin_superiority , ModelComparison.bootstrap_margin_non_inferiority , ModelComparison.bootstrap_margin_equality
+        :param workers: None to draw all of the replicates from a single random stream in the main process.
+                        Otherwise, the replicates are split to shards with independent random streams (see run_bootstrap_shards()),
+                        evaluated by the specified number of processes (0 for the main process).
+                        For a given seed, the results are identical for any number of workers, but differ from the results of workers=None.
         """
 
         super().__init__(stratum=stratum, **super_kwargs)
@@ -71,6 +77,7 @@ class PairedBootstrap(MetricWithCollectorBase):
         self._metric_keys_to_compare = metric_keys_to_compare
         self._compare_method = compare_method
         self._margin = margin
+        self._workers = workers
 
     def collect(self, batch: Dict) -> None:
         "See super class"
@@ -105,9 +112,30 @@ class PairedBootstrap(MetricWithCollectorBase):
             )
         ids = np.array(ids)
 
-        rnd = np.random.RandomState(self._rnd_seed)
-        stratum_id = np.array(data["stratum"]) if "stratum" in data else np.ones(len(data["id"]))
-        unique_strata = np.unique(stratum_id)
+        stratum_id = np.array(data["stratum"]) if "stratum" in data else np.ones(len(ids))
+        # the positions of each stratum samples
+        strata_indices = [np.nonzero(stratum_id == stratum)[0] for stratum in np.unique(stratum_id)]
+
+        # evaluate both metrics on the same replicates
+        if self._workers is None:
+            rnd = np.random.RandomState(self._rnd_seed)
+            boot_results = _eval_paired_replicates(
+                self._metric_test, self._metric_reference, results, ids, strata_indices, rnd, self._num_of_bootstraps
+            )
+        else:
+            boot_results = run_bootstrap_shards(
+                _paired_bootstrap_shard,
+                dict(
+                    metric_test=self._metric_test,
+                    metric_reference=self._metric_reference,
+                    results=results,
+                    ids=ids,
+                    strata_indices=strata_indices,
+                ),
+                self._num_of_bootstraps,
+                self._rnd_seed,
+                self._workers,
+            )
 
         # initialize results
         if self._metric_keys_to_compare is None:
@@ -120,16 +148,7 @@ class PairedBootstrap(MetricWithCollectorBase):
             }
 
         # aggregate bootstrap results
-        for bs_index in range(self._num_of_bootstraps):
-            sampled_ids = ids.copy()
-            for stratum in unique_strata:
-                stratum_filter = stratum_id == stratum
-                n_stratum = sum(stratum_filter)
-                random_sample = rnd.randint(0, n_stratum, size=n_stratum)
-                sampled_ids[stratum_filter] = ids[stratum_filter][random_sample]
-            result_test = self._metric_test.eval(results, sampled_ids)
-            result_reference = self._metric_reference.eval(results, sampled_ids)
-
+        for bs_index, (result_test, result_reference) in enumerate(boot_results):
             # single-value metric case
             if self._metric_keys_to_compare is None:
                 assert not isinstance(
@@ -163,3 +182,42 @@ class PairedBootstrap(MetricWithCollectorBase):
                 key, bootstrap_results_test[key], bootstrap_results_reference[key], margin=self._margin
             )
         return metric_results
+
+
+def _eval_paired_replicates(
+    metric_test: MetricBase,
+    metric_reference: MetricBase,
+    results: Dict[str, Any],
+    ids: np.ndarray,
+    strata_indices: Sequence[np.ndarray],
+    rnd: np.random.RandomState,
+    num_replicates: int,
+) -> List[Tuple[Any, Any]]:
+    """
+    Draws the replicates and evaluates both metrics on each one of them
+    :return: list with a tuple (test result, reference result) per replicate
+    """
+
+    def eval_bootstrap_pair(results: Dict[str, Any], ids: np.ndarray, boot_indices: np.ndarray) -> List[Tuple]:
+        return list(
+            zip(
+                metric_test.eval_bootstrap(results, ids, boot_indices),
+                metric_reference.eval_bootstrap(results, ids, boot_indices),
+            )
+        )
+
+    return CI.eval_replicates(eval_bootstrap_pair, results, ids, strata_indices, rnd, num_replicates)
+
+
+def _paired_bootstrap_shard(args: Tuple[np.random.RandomState, int]) -> List[Tuple[Any, Any]]:
+    rnd, num_replicates = args
+    data = get_from_global_storage("bootstrap_shard_data")
+    return _eval_paired_replicates(
+        data["metric_test"],
+        data["metric_reference"],
+        data["results"],
+        data["ids"],
+        data["strata_indices"],
+        rnd,
+        num_replicates,
+    )
@@ -1,11 +1,11 @@
 from functools import partial
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Sequence, Union
 from collections import defaultdict
-from fuse.eval.metrics.libs.segmentation import MetricsSegmentation
+from fuse.eval.metrics.libs.segmentation import MetricsSegmentation, SEGMENTATION_SCORES
 
 import numpy as np
 
-from fuse.eval.metrics.metrics_common import MetricPerSampleDefault
+from fuse.eval.metrics.metrics_common import MetricPerSampleDefault, MetricStreamingBase
 
 
 def average_sample_results(
@@ -147,6 +147,69 @@ class Metric2DHausdorff(MetricPerSampleDefault):
         )
 
 
+class MetricHausdorff(MetricPerSampleDefault):
+    """
+    Compute the (symmetric) Hausdorff distance for every label - works for 2D, 3D or any dimension.
+    Set percentile=95 for HD95.
+    used for sematric and binary segmentation
+    """
+
+    def __init__(
+        self,
+        pred: str,
+        target: str,
+        spacing: Optional[Union[str, Sequence[float]]] = None,
+        percentile: float = 100,
+        class_weights: Optional[Dict[int, float]] = None,
+        **kwargs
+    ):
+        """
+        See super class for the missing params
+        :param spacing: Optional, the voxel spacing along each axis - either a fixed sequence or a dictionary key to collect (spacing per sample)
+        :param percentile: the percentile of the surface distances. 100 for Hausdorff distance and 95 for HD95.
+        :param class_weights: weight per segmentation class , we assume sum of total weights is 1 and each element is in 0-1 range
+        """
+        average = partial(average_sample_results, class_weights=class_weights)
+        metric_per_sample_func = partial(MetricsSegmentation.hausdorff_distance, percentile=percentile)
+        if isinstance(spacing, str):
+            kwargs["spacing"] = spacing
+        elif spacing is not None:
+            metric_per_sample_func = partial(metric_per_sample_func, spacing=spacing)
+        super().__init__(
+            pred, target, metric_per_sample_func=metric_per_sample_func, result_aggregate_func=average, **kwargs
+        )
+
+
+class MetricAverageSurfaceDistance(MetricPerSampleDefault):
+    """
+    Compute the average symmetric surface distance for every label - works for 2D, 3D or any dimension.
+    used for sematric and binary segmentation
+    """
+
+    def __init__(
+        self,
+        pred: str,
+        target: str,
+        spacing: Optional[Union[str, Sequence[float]]] = None,
+        class_weights: Optional[Dict[int, float]] = None,
+        **kwargs
+    ):
+        """
+        See super class for the missing params
+        :param spacing: Optional, the voxel spacing along each axis - either a fixed sequence or a dictionary key to collect (spacing per sample)
+        :param class_weights: weight per segmentation class , we assume sum of total weights is 1 and each element is in 0-1 range
+        """
+        average = partial(average_sample_results, class_weights=class_weights)
+        metric_per_sample_func = MetricsSegmentation.average_surface_distance
+        if isinstance(spacing, str):
+            kwargs["spacing"] = spacing
+        elif spacing is not None:
+            metric_per_sample_func = partial(metric_per_sample_func, spacing=spacing)
+        super().__init__(
+            pred, target, metric_per_sample_func=metric_per_sample_func, result_aggregate_func=average, **kwargs
+        )
+
+
 class MetricPixelAccuracy(MetricPerSampleDefault):
     """
     Compute pixel accuracy score for every label
@@ -175,3 +238,137 @@ class MetricPixelAccuracy(MetricPerSampleDefault):
             result_aggregate_func=average,
             **kwargs
         )
+
+
+class MetricSegmentationScores(MetricPerSampleDefault):
+    """
+    Compute several overlap scores for every label at once - dice, iou_jaccard, overlap and pixel_accuracy.
+    All of the scores are derived from a single confusion matrix per sample (see MetricsSegmentation.segmentation_scores()),
+    instead of scanning the masks again for each metric.
+    used for sematric and binary segmentation
+    """
+
+    def __init__(
+        self,
+        pred: str,
+        target: str,
+        metrics: Sequence[str] = SEGMENTATION_SCORES,
+        pixel_weight: Optional[str] = None,
+        class_weights: Optional[Dict[int, float]] = None,
+        **kwargs
+    ):
+        """
+        See super class for the missing params
+        :param metrics: the scores to compute, subset of: "dice", "iou_jaccard", "overlap", "pixel_accuracy"
+        :param class_weights: weight per segmentation class , we assume sum of total weights is 1 and each element is in 0-1 range
+        :param pixel_weight: Optional dictionary key to collect
+        """
+        scores = partial(MetricsSegmentation.segmentation_scores, metrics=metrics)
+        average = partial(_average_segmentation_scores, metrics=metrics, class_weights=class_weights)
+        super().__init__(
+            pred,
+            target,
+            pixel_weight=pixel_weight,
+            metric_per_sample_func=scores,
+            result_aggregate_func=average,
+            **kwargs
+        )
+
+
+def _average_segmentation_scores(
+    metric_result: List[Dict[str, Dict[str, float]]],
+    metrics: Sequence[str],
+    class_weights: Optional[Dict[int, float]] = None,
+) -> Dict[str, Dict[str, float]]:
+    return {
+        metric: average_sample_results([sample[metric] for sample in metric_result], class_weights)
+        for metric in metrics
+    }
+
+
+class MetricSegmentationScoreStreaming(MetricStreamingBase):
+    """
+    Streaming computation of a per sample, per label, overlap score averaged over the samples (see average_sample_results()).
+    Accumulates the sum of the scores and the number of samples per label.
+    As in MetricDice, a sample is scored only for the (non zero) labels that appear in its target.
+    """
+
+    def __init__(
+        self, pred: str, target: str, score_func: Callable, class_weights: Optional[Dict[int, float]] = None, **kwargs
+    ):
+        """
+        :param pred: key name for the predicted segmentation masks (labels)
+        :param target: key name for the target segmentation masks (labels)
+        :param score_func: computes the scores of a batch given the arrays: intersection, pred size and target size - number of pixels per sample.
+                           See MetricsSegmentation.score_from_sizes()
+        :param class_weights: weight per segmentation class , we assume sum of total weights is 1 and each element is in 0-1 range
+        """
+        self._score_func = score_func
+        self._class_weights = class_weights
+        super().__init__(pred=pred, target=target, **kwargs)
+
+    def reset_state(self) -> None:
+        self._sum_scores = {}
+        self._num_samples = {}
+
+    def update(self, pred: np.ndarray, target: np.ndarray) -> None:
+        num_labels = int(max(pred.max(initial=0), target.max(initial=0))) + 1
+        conf_matrix = MetricsSegmentation.batch_confusion_matrix(pred, target, num_labels)
+        target_size = conf_matrix.sum(axis=2)
+        pred_size = conf_matrix.sum(axis=1)
+        intersection = conf_matrix.diagonal(axis1=1, axis2=2)
+        for label in range(1, num_labels):
+            exists = target_size[:, label] > 0
+            if not exists.any():
+                continue
+            scores = self._score_func(intersection[exists, label], pred_size[exists, label], target_size[exists, label])
+
+            label = str(label)
+            self._sum_scores[label] = self._sum_scores.get(label, 0.0) + float(np.sum(scores))
+            self._num_samples[label] = self._num_samples.get(label, 0) + int(np.sum(exists))
+
+    def compute(self) -> Dict[str, float]:
+        average_results = {}
+        total_avarage = 0
+        for key in self._sum_scores:
+            average_results[key] = self._sum_scores[key] / self._num_samples[key]
+            weight = 1 if self._class_weights is None else self._class_weights[key]
+            total_avarage += weight * average_results[key]
+        average_results["average"] = total_avarage / len(self._sum_scores)
+        return average_results
+
+
+class MetricDiceStreaming(MetricSegmentationScoreStreaming):
+    """
+    Streaming version of MetricDice (without pixel weights)
+    """
+
+    def __init__(self, pred: str, target: str, class_weights: Optional[Dict[int, float]] = None, **kwargs):
+        """
+        See super class
+        """
+        super().__init__(
+            pred=pred,
+            target=target,
+            score_func=partial(MetricsSegmentation.score_from_sizes, "dice"),
+            class_weights=class_weights,
+            **kwargs
+        )
+
+
+class MetricIouJaccardStreaming(MetricSegmentationScoreStreaming):
+    """
+    Streaming computation of the per label intersection over union (|X&Y| / | XUY |), averaged over the samples
+    """
+
+    def __init__(self, pred: str, target: str, class_weights: Optional[Dict[int, float]] = None, **kwargs):
+        """
+        See super class
+        """
+        super().__init__(
+            pred=pred,
+            target=target,
+            score_func=partial(MetricsSegmentation.score_from_sizes, "iou_jaccard"),
+            class_weights=class_weights,
+            **kwargs
+        )
@@ -14,14 +14,31 @@ class PerSampleData:
     def __init__(self, data: Sequence[np.ndarray], ids: Sequence[Hashable]):
         self._data = data
         self._ids = ids
+        self._id_to_index = None  # built on first use
 
     def __call__(self, ids: Optional[Sequence[Hashable]] = None) -> Sequence[np.ndarray]:
         if ids is None:
             return copy.copy(self._data)
         else:
             # convert required ids to permutation
-            original_ids = self._ids
-            required_ids = ids
-            permutation = [original_ids.index(sample_id) for sample_id in required_ids]
+            if self._id_to_index is None:
+                self._id_to_index = {}
+                for index, sample_id in enumerate(self._ids):
+                    self._id_to_index.setdefault(sample_id, index)
+            permutation = [self._id_to_index[sample_id] for sample_id in ids]
 
             return [self._data[i] for i in permutation]
+
+
+def bootstrap_counts(indices: np.ndarray, num_samples: int) -> np.ndarray:
+    """
+    Converts bootstrap replicates from indices of the drawn samples to the number of times each sample was drawn
+    :param indices: integer array [num_replicates, num_replicate_samples] - each row includes the indices of the samples drawn in a replicate
+    :param num_samples: the number of samples in the population
+    :return: float array [num_replicates, num_samples]
+    """
+    indices = np.asarray(indices)
+    num_replicates = indices.shape[0]
+    flat_indices = (indices + np.arange(num_replicates)[:, None] * num_samples).ravel()
+    counts = np.bincount(flat_indices, minlength=num_replicates * num_samples)
+    return counts.reshape(num_replicates, num_samples).astype(np.float64)
@@ -18,8 +18,13 @@ Created on June 30, 2021
 """
 
 from distutils.log import warn
+from functools import partial
 import unittest
 
+import numpy as np
+import pandas as pd
+import torch
+
 
 from fuse.eval.examples.examples import (
     example_0,
@@ -38,6 +43,35 @@ from fuse.eval.examples.examples import (
     example_13,
 )
 
+from fuse.eval.metrics.metrics_common import CI, MetricCollector, MetricDefault
+from fuse.eval.metrics.classification.metrics_classification_common import (
+    MetricAccuracy,
+    MetricAccuracyStreaming,
+    MetricAUCROC,
+    MetricAUCROCBinned,
+    MetricConfusion,
+    MetricConfusionMatrix,
+    MetricConfusionMatrixStreaming,
+    MetricMultiClassDefault,
+)
+from fuse.eval.metrics.classification.metrics_calibration_common import MetricECE, MetricECEStreaming
+from fuse.eval.metrics.segmentation.metrics_segmentation_common import (
+    MetricDice,
+    MetricAverageSurfaceDistance,
+    MetricDiceStreaming,
+    MetricHausdorff,
+    MetricIouJaccard,
+    MetricIouJaccardStreaming,
+    MetricSegmentationScores,
+)
+from fuse.eval.metrics.libs.segmentation import MetricsSegmentation
+from fuse.eval.metrics.libs.calibration import Calibration
+from fuse.eval.metrics.libs.classification import MetricsLibClass
+from fuse.eval.metrics.metrics_model_comparison import PairedBootstrap
+from fuse.eval.metrics.classification.metrics_model_comparison_common import MetricDelongsTest
+from fuse.eval.metrics.libs.model_comparison import ModelComparison
+from fuse.utils import NDict
+
 from fuse.eval.examples.examples_segmentation import (
     example_seg_0,
     example_seg_1,
@@ -179,6 +213,430 @@ class TestEval(unittest.TestCase):
         self.assertAlmostEqual(results["metrics.reliability_calibrated"]["avg_accuracy"], 0.566, places=2)
         self.assertAlmostEqual(results["metrics.reliability_calibrated"]["avg_confidence"], 0.485, places=2)
 
+    def test_metric_collector(self):
+        collector = MetricCollector(pred="pred", target="target", name="name", seg="seg")
+        num_samples = 100
+        for batch_start in range(0, num_samples, 16):
+            batch_ids = list(range(batch_start, min(batch_start + 16, num_samples)))
+            collector.collect(
+                {
+                    "id": [f"id_{i}" for i in batch_ids],
+                    "pred": np.array([[i, -i] for i in batch_ids], dtype=np.float32),
+                    "target": [i % 2 if i < 50 else 0.5 for i in batch_ids],  # ints upcast to floats
+                    "name": [f"name_{i}" for i in batch_ids],
+                    "seg": [np.zeros((i % 3 + 1,)) for i in batch_ids],  # different shapes
+                }
+            )
+
+        data = collector.get()
+        self.assertEqual(data["pred"].shape, (num_samples, 2))
+        self.assertEqual(data["target"].dtype, np.float64)
+        self.assertListEqual(data["name"], [f"name_{i}" for i in range(num_samples)])
+        self.assertEqual(len(data["seg"]), num_samples)
+
+        ids = ["id_57", "id_3", "id_3", "id_99"]
+        data = collector.get(ids)
+        self.assertTrue(np.array_equal(data["pred"], np.array([[57, -57], [3, -3], [3, -3], [99, -99]])))
+        self.assertTrue(np.array_equal(data["target"], np.array([0.5, 1, 1, 0.5])))
+        self.assertListEqual(data["name"], ["name_57", "name_3", "name_3", "name_99"])
+        self.assertListEqual([s.shape for s in data["seg"]], [(1,), (1,), (1,), (1,)])
+
+    def test_metric_collector_batched(self):
+        """
+        Compares collecting entire batches to collecting sample by sample (forced by a pre collect process func)
+        """
+        batched = MetricCollector(pred="pred", target="target", name="name", mask="mask")
+        per_sample = MetricCollector(
+            pred="pred", target="target", name="name", mask="mask", pre_collect_process_func=lambda sample: sample
+        )
+        num_samples = 50
+        for batch_start in range(0, num_samples, 16):
+            batch_ids = list(range(batch_start, min(batch_start + 16, num_samples)))
+            batch = {
+                "id": [f"id_{i}" for i in batch_ids],
+                "pred": torch.tensor([[i, -i] for i in batch_ids], dtype=torch.float32),
+                "target": torch.tensor(batch_ids) if batch_start == 0 else torch.tensor(batch_ids) + 0.5,
+                "name": [f"name_{i}" for i in batch_ids],
+                "mask": [torch.full((i % 3 + 1,), i) for i in batch_ids],  # variable shape, collated to a list
+            }
+            batched.collect(batch)
+            per_sample.collect(batch)
+
+        batched_data = batched.get()
+        per_sample_data = per_sample.get()
+        for key in ["pred", "target"]:
+            self.assertEqual(batched_data[key].dtype, per_sample_data[key].dtype)
+            self.assertTrue(np.array_equal(batched_data[key], per_sample_data[key]))
+        self.assertListEqual(batched_data["name"], per_sample_data["name"])
+        self.assertEqual(len(batched_data["mask"]), num_samples)
+        for batched_mask, per_sample_mask in zip(batched_data["mask"], per_sample_data["mask"]):
+            self.assertIsInstance(batched_mask, np.ndarray)
+            self.assertTrue(np.array_equal(batched_mask, per_sample_mask))
+        self.assertTrue(np.array_equal(batched.get(["id_20", "id_3"])["pred"], np.array([[20, -20], [3, -3]])))
+
+    def test_metric_collector_get_types(self):
+        """
+        Numeric columns are returned as numpy arrays, other columns as lists
+        """
+        collector = MetricCollector(
+            label="label", prob="prob", pred="pred", seg="seg", name="name", mixed="mixed", mixed_shape="mixed_shape"
+        )
+        for i in range(20):
+            sample = {
+                "id": f"id_{i}",
+                "label": i % 2,
+                "prob": np.array([0.25, 0.75]),
+                "pred": 0.5 if i == 10 else i,  # upcast to float
+                "seg": np.zeros((i % 3 + 1, 2)),  # variable shape
+                "name": f"name_{i}",
+                "mixed": "missing" if i == 10 else i,
+                "mixed_shape": np.zeros(2) if i < 10 else np.zeros(3),
+            }
+            collector.collect(NDict({key: [value] for key, value in sample.items()}))
+        data = collector.get()
+
+        self.assertIsInstance(data["label"], np.ndarray)
+        self.assertTrue(np.issubdtype(data["label"].dtype, np.integer))
+        self.assertListEqual(data["label"].tolist(), [i % 2 for i in range(20)])
+        self.assertIsInstance(data["prob"], np.ndarray)
+        self.assertEqual(data["prob"].shape, (20, 2))
+        self.assertIsInstance(data["pred"], np.ndarray)
+        self.assertEqual(data["pred"].dtype, np.float64)
+        self.assertEqual(data["pred"][10], 0.5)
+        for name in ["seg", "name", "mixed", "mixed_shape"]:
+            self.assertIsInstance(data[name], list)
+            self.assertEqual(len(data[name]), 20)
+        self.assertEqual(data["mixed"][10], "missing")
+        self.assertEqual(data["mixed"][11], 11)
+        self.assertEqual(data["seg"][2].shape, (3, 2))
+
+        data = collector.get(["id_3", "id_0"])
+        self.assertIsInstance(data["label"], np.ndarray)
+        self.assertListEqual(data["label"].tolist(), [1, 0])
+        self.assertListEqual(data["name"], ["name_3", "name_0"])
+
+    def test_ci_vectorized_bootstrap(self):
+        """
+        Compares the vectorized bootstrap evaluation to evaluating each replicate separately
+        """
+        rnd = np.random.RandomState(0)
+        num_samples = 300
+        target = rnd.randint(0, 3, size=num_samples)
+        pred = rnd.dirichlet([1, 1, 1], size=num_samples) * 0.5 + np.eye(3)[target] * 0.5
+        prob = pred
+        pred = np.round(pred, 2)  # include ties
+        data = pd.DataFrame(
+            {
+                "id": list(range(num_samples)),
+                "prob": list(prob),
+                "pred": list(pred),
+                "cls_pred": list(pred.argmax(axis=1)),
+                "binary_pred": list(pred[:, 1]),
+                "binary_target": list((target == 1).astype(int)),
+                "target": list(target),
+                "weight": list(rnd.rand(num_samples)),
+            }
+        )
+        class_names = ["a", "b", "c"]
+        pairs = [
+            (
+                MetricAUCROC(pred="pred", target="target", class_names=class_names),
+                MetricMultiClassDefault(
+                    pred="pred", target="target", metric_func=MetricsLibClass.auc_roc, class_names=class_names
+                ),
+            ),
+            (
+                MetricAUCROC(pred="binary_pred", target="binary_target", sample_weight="weight"),
+                MetricDefault(
+                    pred="binary_pred",
+                    target="binary_target",
+                    sample_weight="weight",
+                    metric_func=MetricsLibClass.auc_roc,
+                ),
+            ),
+            (
+                MetricAccuracy(pred="cls_pred", target="target", sample_weight="weight"),
+                MetricDefault(
+                    pred="cls_pred", target="target", sample_weight="weight", metric_func=MetricsLibClass.accuracy
+                ),
+            ),
+            (
+                MetricConfusion(
+                    pred="cls_pred", target="target", class_names=class_names, metrics=("sensitivity", "ppv", "f1")
+                ),
+                MetricMultiClassDefault(
+                    pred="cls_pred",
+                    target="target",
+                    metric_func=MetricsLibClass.confusion_metrics,
+                    class_names=class_names,
+                    metrics=("sensitivity", "ppv", "f1"),
+                ),
+            ),
+            (
+                MetricECE(pred="prob", target="target", classwise=True),
+                MetricDefault(pred="prob", target="target", metric_func=partial(Calibration.ece, classwise=True)),
+            ),
+        ]
+
+        for vectorized_metric, metric in pairs:
+            results = []
+            for m in [vectorized_metric, metric]:
+                ci = CI(m, stratum="target", num_of_bootstraps=200, rnd_seed=1234)
+                ci.set(data)
+                results.append(NDict(ci.eval({})).flatten())
+            self.assertEqual(set(results[0].keys()), set(results[1].keys()))
+            for key in results[0]:
+                self.assertAlmostEqual(results[0][key], results[1][key], places=10)
+
+    def test_parallel_bootstrap(self):
+        """
+        Verifies that sharded bootstrap results do not depend on the number of workers
+        """
+        rnd = np.random.RandomState(0)
+        num_samples = 200
+        target = rnd.randint(0, 2, size=num_samples)
+        data = pd.DataFrame(
+            {
+                "id": list(range(num_samples)),
+                "pred_a": list(np.clip(target * 0.3 + rnd.rand(num_samples) * 0.7, 0, 1)),
+                "pred_b": list(np.clip(target * 0.2 + rnd.rand(num_samples) * 0.8, 0, 1)),
+                "target": list(target),
+            }
+        )
+
+        results = []
+        for workers in [0, 2]:
+            ci = CI(
+                MetricAUCROC(pred="pred_a", target="target"),
+                stratum="target",
+                num_of_bootstraps=600,
+                rnd_seed=1234,
+                workers=workers,
+            )
+            ci.set(data)
+            paired = PairedBootstrap(
+                MetricAUCROC(pred="pred_a", target="target"),
+                MetricAUCROC(pred="pred_b", target="target"),
+                stratum="target",
+                num_of_bootstraps=600,
+                rnd_seed=1234,
+                workers=workers,
+            )
+            paired.set(data)
+            results.append((ci.eval({}), paired.eval({})))
+
+        self.assertDictEqual(results[0][0], results[1][0])
+        self.assertDictEqual(results[0][1], results[1][1])
+
+    def test_delong_fast(self):
+        """
+        Compares the midrank based DeLong covariance to the pairwise definition, and the K models test to the pairwise test
+        """
+        rnd = np.random.RandomState(0)
+        num_samples = 300
+        target = rnd.randint(0, 2, size=num_samples)
+        preds = [np.round(rnd.rand(num_samples) * 0.6 + target * w, 2) for w in [0.1, 0.3, 0.4]]  # include ties
+
+        # pairwise definition (DeLong et al. 1988)
+        x = np.stack([p[target == 1] for p in preds])
+        y = np.stack([p[target == 0] for p in preds])
+        psi = (x[:, :, np.newaxis] > y[:, np.newaxis, :]) + 0.5 * (x[:, :, np.newaxis] == y[:, np.newaxis, :])
+        aucs = psi.mean(axis=(1, 2))
+        expected_cov = np.cov(psi.mean(axis=2)) / x.shape[1] + np.cov(psi.mean(axis=1)) / y.shape[1]
+
+        aucs_fast, cov_fast = ModelComparison.delong_covariance(np.stack(preds), target)
+        self.assertTrue(np.allclose(aucs_fast, aucs))
+        self.assertTrue(np.allclose(cov_fast, expected_cov))
+
+        multi = ModelComparison.delong_auc_test_multi([list(p) for p in preds], list(target))
+        pair = ModelComparison.delong_auc_test(list(preds[0]), list(preds[2]), list(target))
+        self.assertAlmostEqual(multi["z"][0, 2], pair["z"], places=10)
+        self.assertAlmostEqual(multi["p_value"][0, 2], pair["p_value"], places=10)
+
+        data = pd.DataFrame({"id": list(range(num_samples)), "target": list(target)})
+        for index, p in enumerate(preds):
+            data[f"pred{index}"] = list(p)
+        metric = MetricDelongsTest(target="target", preds={f"m{index}": f"pred{index}" for index in range(len(preds))})
+        metric.set(data)
+        results = metric.eval({})
+        self.assertAlmostEqual(results["auc_m1"], aucs[1], places=10)
+        self.assertAlmostEqual(results["p_value_m0_vs_m2"], pair["p_value"], places=10)
+
+    def test_streaming_metrics(self):
+        """
+        Compares the streaming metrics to the equivalent metrics computed on the collected data
+        """
+        rnd = np.random.RandomState(0)
+        num_samples = 250
+        target = rnd.randint(0, 3, size=num_samples)
+        pred = rnd.dirichlet([1, 1, 1], size=num_samples) * 0.5 + np.eye(3)[target] * 0.5
+        seg_target = rnd.randint(0, 3, size=(num_samples, 8, 8))
+        seg_pred = np.where(rnd.rand(num_samples, 8, 8) < 0.7, seg_target, rnd.randint(0, 3, size=(num_samples, 8, 8)))
+        class_names = ["a", "b", "c"]
+        pairs = [
+            (
+                MetricAccuracyStreaming(pred="cls_pred", target="target", sample_weight="weight"),
+                MetricAccuracy(pred="cls_pred", target="target", sample_weight="weight"),
+            ),
+            (
+                MetricConfusionMatrixStreaming(cls_pred="cls_pred", target="target", class_names=class_names),
+                MetricConfusionMatrix(cls_pred="cls_pred", target="target", class_names=class_names),
+            ),
+            (
+                MetricECEStreaming(pred="pred", target="target", num_bins=10),
+                MetricECE(pred="pred", target="target", num_bins=10),
+            ),
+            (
+                MetricAUCROCBinned(pred="pred", target="target", class_names=class_names, num_bins=10000),
+                MetricAUCROC(pred="pred", target="target", class_names=class_names),
+            ),
+            (
+                MetricDiceStreaming(pred="seg_pred", target="seg_target"),
+                MetricDice(pred="seg_pred", target="seg_target"),
+            ),
+        ]
+
+        for streaming_metric, metric in pairs:
+            for batch_start in range(0, num_samples, 32):
+                batch_slice = slice(batch_start, batch_start + 32)
+                batch = {
+                    "id": list(range(num_samples))[batch_slice],
+                    "pred": torch.tensor(pred[batch_slice]),
+                    "cls_pred": torch.tensor(pred[batch_slice].argmax(axis=1)),
+                    "target": torch.tensor(target[batch_slice]),
+                    "weight": torch.tensor(np.linspace(0.1, 1, num_samples)[batch_slice]),
+                    "seg_pred": torch.tensor(seg_pred[batch_slice]),
+                    "seg_target": torch.tensor(seg_target[batch_slice]),
+                }
+                streaming_metric.collect(batch)
+                metric.collect(batch)
+            results = [streaming_metric.eval({}), metric.eval({})]
+            results = [NDict(r if isinstance(r, dict) else {"value": r}).flatten() for r in results]
+            self.assertEqual(set(results[0].keys()), set(results[1].keys()))
+            for key in results[0]:
+                if isinstance(results[0][key], pd.DataFrame):
+                    self.assertTrue(np.allclose(results[0][key].values, results[1][key].values))
+                else:
+                    self.assertAlmostEqual(results[0][key], results[1][key], places=3)
+
+            # state is reset
+            streaming_metric.reset()
+            self.assertRaises(Exception, streaming_metric.eval, {}, [0, 1])
+
+    def test_segmentation_scores(self):
+        """
+        Compares the confusion matrix based segmentation scores to the definitions using per label masks
+        """
+        rnd = np.random.RandomState(0)
+        target = rnd.randint(0, 4, size=(5, 16, 16))
+        pred = np.where(rnd.rand(5, 16, 16) < 0.6, target, rnd.randint(0, 4, size=(5, 16, 16)))
+        pred[0][pred[0] == 3] = 0  # empty prediction for a label
+
+        for sample_pred, sample_target in zip(pred, target):
+            scores = MetricsSegmentation.segmentation_scores(sample_pred, sample_target)
+            for label in range(1, 4):
+                mask_pred = sample_pred == label
+                mask_gt = sample_target == label
+                intersection = np.sum(mask_pred & mask_gt)
+                expected = {
+                    "dice": 2 * intersection / (mask_pred.sum() + mask_gt.sum()),
+                    "iou_jaccard": intersection / np.sum(mask_pred | mask_gt),
+                    "overlap": intersection / min(mask_pred.sum(), mask_gt.sum()) if mask_pred.sum() > 0 else 0.0,
+                    "pixel_accuracy": intersection / mask_gt.sum(),
+                }
+                for metric, value in expected.items():
+                    self.assertAlmostEqual(scores[metric][str(label)], value, places=10)
+
+        # batched confusion matrix - numpy and torch
+        conf_matrix = MetricsSegmentation.batch_confusion_matrix(pred, target, 4)
+        conf_matrix_torch = MetricsSegmentation.batch_confusion_matrix(torch.tensor(pred), torch.tensor(target), 4)
+        self.assertTrue(np.array_equal(conf_matrix, conf_matrix_torch.numpy()))
+        self.assertTrue(np.array_equal(conf_matrix[2], MetricsSegmentation.confusion_matrix(pred[2], target[2])[1]))
+
+        # all of the scores at once, and the streaming versions
+        batch = {"id": list(range(5)), "pred": pred, "target": target}
+        metrics = [
+            MetricSegmentationScores(pred="pred", target="target"),
+            MetricDice(pred="pred", target="target"),
+            MetricIouJaccard(pred="pred", target="target"),
+            MetricDiceStreaming(pred="pred", target="target"),
+            MetricIouJaccardStreaming(pred="pred", target="target"),
+        ]
+        for metric in metrics:
+            metric.collect(batch)
+        results = [metric.eval({}) for metric in metrics]
+        for key in results[1]:
+            self.assertAlmostEqual(results[0]["dice"][key], results[1][key], places=10)
+            self.assertAlmostEqual(results[0]["iou_jaccard"][key], results[2][key], places=10)
+            self.assertAlmostEqual(results[3][key], results[1][key], places=10)
+            self.assertAlmostEqual(results[4][key], results[2][key], places=10)
+
+    def test_surface_distances(self):
+        """
+        Compares the distance transform based surface distances to brute force distances between the surface points
+        """
+        from scipy.spatial.distance import cdist
+
+        def surface_points(mask: np.ndarray, spacing: np.ndarray) -> np.ndarray:
+            padded = np.pad(mask, 1)
+            interior = padded.copy()
+            for axis in range(mask.ndim):
+                interior &= np.roll(padded, 1, axis=axis) & np.roll(padded, -1, axis=axis)
+            surface = (padded & ~interior)[1:-1, 1:-1, 1:-1]
+            return np.argwhere(surface) * spacing
+
+        rnd = np.random.RandomState(0)
+        grid = np.stack(np.meshgrid(*[np.arange(24)] * 3, indexing="ij"), axis=-1)
+        spacing = np.array([2.5, 0.7, 0.7])
+        for _ in range(3):
+            target = np.zeros((24, 24, 24), dtype=np.int64)
+            pred = np.zeros((24, 24, 24), dtype=np.int64)
+            for label in (1, 2):
+                center = rnd.randint(4, 20, size=3)
+                target[np.linalg.norm(grid - center, axis=-1) < rnd.randint(3, 6)] = label
+                pred[np.linalg.norm(grid - center - rnd.randint(-2, 3, size=3), axis=-1) < rnd.randint(3, 6)] = label
+            target[0, 5:9, 5:9] = 1  # touching the border of the volume
+
+            hd = MetricsSegmentation.hausdorff_distance(pred, target, spacing=spacing)
+            hd95 = MetricsSegmentation.hausdorff_distance(pred, target, spacing=spacing, percentile=95)
+            asd = MetricsSegmentation.average_surface_distance(pred, target, spacing=spacing)
+            for label in np.unique(target)[1:]:
+                distances = cdist(surface_points(pred == label, spacing), surface_points(target == label, spacing))
+                pred_to_target, target_to_pred = distances.min(axis=1), distances.min(axis=0)
+                key = str(label)
+                self.assertAlmostEqual(hd[key], max(pred_to_target.max(), target_to_pred.max()), places=6)
+                self.assertAlmostEqual(
+                    hd95[key],
+                    max(np.percentile(pred_to_target, 95), np.percentile(target_to_pred, 95)),
+                    places=6,
+                )
+                self.assertAlmostEqual(asd[key], np.concatenate([pred_to_target, target_to_pred]).mean(), places=6)
+
+        # empty prediction - the diagonal of the volume
+        hd = MetricsSegmentation.hausdorff_distance(np.zeros_like(target), target)
+        self.assertAlmostEqual(hd["1"], np.sqrt(3 * 24**2))
+
+        # metrics - fixed spacing or spacing per sample
+        batch = {
+            "id": [0, 1],
+            "pred": np.stack([pred, target]),
+            "target": np.stack([target, target]),
+            "spacing": [spacing] * 2,
+        }
+        metrics = [
+            MetricHausdorff(pred="pred", target="target", spacing=tuple(spacing), percentile=95),
+            MetricHausdorff(pred="pred", target="target", spacing="spacing", percentile=95),
+            MetricAverageSurfaceDistance(pred="pred", target="target", spacing="spacing"),
+        ]
+        for metric in metrics:
+            metric.collect(batch)
+        results = [metric.eval({}) for metric in metrics]
+        # the second sample is a perfect prediction
+        for key in ["1", "2", "average"]:
+            self.assertAlmostEqual(results[0][key], results[1][key])
+        self.assertAlmostEqual(results[1]["2"], hd95["2"] / 2)
+        self.assertAlmostEqual(results[2]["average"], (asd["1"] + asd["2"]) / 4)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,2 +1,3 @@
 from fuse.utils.cpu_profiling.profiler import Profiler
 from fuse.utils.cpu_profiling.timer import Timer
+from fuse.utils.cpu_profiling.ops_profiler import OpsProfiler
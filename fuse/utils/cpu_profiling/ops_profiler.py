@@ -0,0 +1,312 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import bisect
+import glob
+import json
+import os
+import socket
+import threading
+import time
+from multiprocessing import util as mp_util
+
+import numpy as np
+import pandas as pd
+import psutil
+import torch
+
+from fuse.utils.ndict import NDict
+
+# log scale histogram bins (seconds): 1us - 1000s, 4 bins per decade.
+# bin i counts values in [HISTOGRAM_EDGES[i-1], HISTOGRAM_EDGES[i]), the first and last bins count the values out of range.
+HISTOGRAM_EDGES = [10 ** (exponent / 4) for exponent in range(-24, 13)]
+
+
+class OpsProfiler:
+    """
+    Opt-in per op instrumentation of pipelines (see PipelineDefault.set_profiler() and DatasetDefault.set_profiler()).
+    Records per op id: number of calls, wall and CPU time (totals and histograms), the maximal increase of the resident memory during a call
+    and the size of the arrays / tensors produced by the op.
+
+    The records are aggregated per process and written periodically to a file per process in output_dir,
+    so records of DataLoader workers and run_multiprocessed() workers are aggregated as well by report().
+    Processes that are terminated (e.g. the workers of a multiprocessing pool) keep only the records written so far -
+    use a small flush_interval in such cases.
+    The memory increase is measured by sampling the resident memory before and after each call - it's not the true peak.
+
+    Usage example:
+        profiler = OpsProfiler("/tmp/ops_profile")
+        dataset.set_profiler(profiler)
+        for sample in DataLoader(dataset, num_workers=8, ...):
+            ...
+        profiler.print_summary()
+        profiler.save_report("/tmp/ops_profile/report")  # report.json and report.csv
+    """
+
+    def __init__(self, output_dir: str, flush_interval: float = 1.0, measure_memory: bool = True):
+        """
+        :param output_dir: directory to store the records of each process
+        :param flush_interval: minimal number of seconds between writes of the records of a process to output_dir
+        :param measure_memory: measure the resident memory and the size of the produced arrays - costs a few microseconds per call
+        """
+        self._output_dir = output_dir
+        self._flush_interval = flush_interval
+        self._measure_memory = measure_memory
+        os.makedirs(output_dir, exist_ok=True)
+        self._reset()
+
+    def _reset(self) -> None:
+        self._pid = os.getpid()
+        self._records: Dict[str, dict] = {}
+        self._last_flush = time.time()
+        self._process = None
+        self._finalizer = None
+        # ops might be called by a few threads (see DatasetPrefetch)
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # each process records separately
+        return {
+            "_output_dir": self._output_dir,
+            "_flush_interval": self._flush_interval,
+            "_measure_memory": self._measure_memory,
+        }
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._reset()
+
+    def start(self, sample_dict: Optional[dict] = None) -> Tuple:
+        """
+        Call before calling the op
+        :param sample_dict: the input of the op - used to identify the arrays produced by the op
+        :return: a state to pass to stop()
+        """
+        if self._pid != os.getpid():
+            # forked process - start with empty records
+            self._reset()
+        if not self._measure_memory:
+            return (time.perf_counter(), time.thread_time(), None, None)
+        if self._process is None:
+            self._process = psutil.Process()
+        input_arrays = set(id(value) for value in _iter_arrays(sample_dict))
+        return (time.perf_counter(), time.thread_time(), self._process.memory_info().rss, input_arrays)
+
+    def stop(self, state: Tuple, op_id: str, op_name: str, output: Any = None) -> None:
+        """
+        Call after calling the op
+        :param state: the value returned by start()
+        :param op_id: the op id
+        :param op_name: description of the op, typically the class name
+        :param output: the output of the op - sample_dict, list of sample_dict or None
+        """
+        wall_time = time.perf_counter() - state[0]
+        cpu_time = time.thread_time() - state[1]
+
+        if self._measure_memory:
+            rss_delta = self._process.memory_info().rss - state[2]
+            outputs = output if isinstance(output, list) else [output]
+            output_bytes = sum(
+                _get_array_size_bytes(value)
+                for sample in outputs
+                for value in _iter_arrays(sample)
+                if id(value) not in state[3]
+            )
+
+        with self._lock:
+            self._update_record(op_id, op_name, wall_time, cpu_time)
+            if self._measure_memory:
+                record = self._records[op_id]
+                record["max_rss_delta"] = max(record["max_rss_delta"], rss_delta)
+                record["output_bytes_total"] += output_bytes
+                record["output_bytes_max"] = max(record["output_bytes_max"], output_bytes)
+
+            if self._finalizer is None:
+                # flush when the process exits - including multiprocessing workers (that skip atexit)
+                self._finalizer = mp_util.Finalize(self, self.flush, exitpriority=10)
+            flush = time.time() - self._last_flush >= self._flush_interval
+        if flush:
+            self.flush()
+
+    def _update_record(self, op_id: str, op_name: str, wall_time: float, cpu_time: float) -> None:
+        record = self._records.get(op_id, None)
+        if record is None:
+            record = _empty_record(op_name)
+            self._records[op_id] = record
+
+        record["calls"] += 1
+        record["wall_total"] += wall_time
+        record["wall_max"] = max(record["wall_max"], wall_time)
+        record["wall_hist"][bisect.bisect_right(HISTOGRAM_EDGES, wall_time)] += 1
+        record["cpu_total"] += cpu_time
+        record["cpu_hist"][bisect.bisect_right(HISTOGRAM_EDGES, cpu_time)] += 1
+
+    def flush(self) -> None:
+        """
+        Writes the records of the current process to output_dir
+        """
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            self._last_flush = time.time()
+            if len(self._records) == 0:
+                return
+            data = json.dumps(self._records)
+        filename = os.path.join(self._output_dir, f"ops_profile_{socket.gethostname()}_{self._pid}.json")
+        tmp_filename = f"{filename}.{threading.get_ident()}.tmp"
+        with open(tmp_filename, "w") as f:
+            f.write(data)
+        os.replace(tmp_filename, filename)
+
+    def clear(self) -> None:
+        """
+        Deletes the records - of the current process and the files in output_dir
+        """
+        self._reset()
+        for filename in glob.glob(os.path.join(self._output_dir, "ops_profile_*.json")):
+            os.remove(filename)
+
+    def get_records(self) -> Dict[str, dict]:
+        """
+        :return: the records of all of the processes, aggregated per op id
+        """
+        self.flush()
+        ans: Dict[str, dict] = {}
+        for filename in glob.glob(os.path.join(self._output_dir, "ops_profile_*.json")):
+            with open(filename, "r") as f:
+                records = json.load(f)
+            for op_id, record in records.items():
+                if op_id not in ans:
+                    ans[op_id] = _empty_record(record["op"])
+                _merge_records(ans[op_id], record)
+        return ans
+
+    def report(self, sort_by: str = "wall_total_sec") -> pd.DataFrame:
+        """
+        :return: a dataframe with a row per op id, sorted by sort_by (descending)
+        """
+        rows = []
+        for op_id, record in self.get_records().items():
+            calls = max(record["calls"], 1)
+            rows.append(
+                dict(
+                    op_id=op_id,
+                    op=record["op"],
+                    calls=record["calls"],
+                    wall_total_sec=record["wall_total"],
+                    wall_mean_ms=record["wall_total"] / calls * 1000,
+                    wall_p50_ms=_histogram_percentile(record["wall_hist"], 50) * 1000,
+                    wall_p95_ms=_histogram_percentile(record["wall_hist"], 95) * 1000,
+                    wall_max_ms=record["wall_max"] * 1000,
+                    cpu_total_sec=record["cpu_total"],
+                    cpu_p95_ms=_histogram_percentile(record["cpu_hist"], 95) * 1000,
+                    max_rss_delta_mb=record["max_rss_delta"] / 1024**2,
+                    output_mean_mb=record["output_bytes_total"] / calls / 1024**2,
+                    output_max_mb=record["output_bytes_max"] / 1024**2,
+                )
+            )
+        df = pd.DataFrame(rows)
+        if len(df) > 0:
+            df = df.sort_values(sort_by, ascending=False).reset_index(drop=True)
+        return df
+
+    def save_report(self, path_prefix: str) -> None:
+        """
+        Saves <path_prefix>.json - the raw records including the histograms, and <path_prefix>.csv - the summary (see report())
+        """
+        with open(path_prefix + ".json", "w") as f:
+            json.dump({"histogram_edges_sec": HISTOGRAM_EDGES, "ops": self.get_records()}, f, indent=4)
+        self.report().to_csv(path_prefix + ".csv", index=False)
+
+    def print_summary(self, top: Optional[int] = 20) -> None:
+        """
+        Prints the summary of the ops, sorted by the total wall time
+        :param top: print just the top ops, None for all of them
+        """
+        df = self.report()
+        if len(df) == 0:
+            print("OpsProfiler: no records")
+            return
+        total = df["wall_total_sec"].sum()
+        df.insert(3, "wall_percent", df["wall_total_sec"] / total * 100)
+        if top is not None:
+            df = df.head(top)
+        with pd.option_context(
+            "display.max_columns", None, "display.width", 250, "display.float_format", "{:.3f}".format
+        ):
+            print(df.to_string(index=False))
+
+
+def _empty_record(op_name: str) -> dict:
+    return dict(
+        op=op_name,
+        calls=0,
+        wall_total=0.0,
+        wall_max=0.0,
+        wall_hist=[0] * (len(HISTOGRAM_EDGES) + 1),
+        cpu_total=0.0,
+        cpu_hist=[0] * (len(HISTOGRAM_EDGES) + 1),
+        max_rss_delta=0,
+        output_bytes_total=0,
+        output_bytes_max=0,
+    )
+
+
+def _merge_records(record: dict, other: dict) -> None:
+    """
+    Adds other to record (inplace)
+    """
+    for name in ["calls", "wall_total", "cpu_total", "output_bytes_total"]:
+        record[name] += other[name]
+    for name in ["wall_max", "max_rss_delta", "output_bytes_max"]:
+        record[name] = max(record[name], other[name])
+    for name in ["wall_hist", "cpu_hist"]:
+        record[name] = [a + b for a, b in zip(record[name], other[name])]
+
+
+def _histogram_percentile(hist: List[int], percentile: float) -> float:
+    """
+    :return: an upper bound of the percentile - the upper edge of the bin containing it
+    """
+    total = sum(hist)
+    if total == 0:
+        return 0.0
+    cumsum = np.cumsum(hist)
+    index = int(np.searchsorted(cumsum, total * percentile / 100.0))
+    return HISTOGRAM_EDGES[min(index, len(HISTOGRAM_EDGES) - 1)]
+
+
+def _iter_arrays(data: Any):
+    """
+    Iterates over the numpy arrays and torch tensors in a (nested) dict or list
+    """
+    if isinstance(data, (np.ndarray, torch.Tensor)):
+        yield data
+    elif isinstance(data, NDict):
+        yield from _iter_arrays(data.to_dict())
+    elif isinstance(data, dict):
+        for value in data.values():
+            yield from _iter_arrays(value)
+    elif isinstance(data, (list, tuple)):
+        for value in data:
+            yield from _iter_arrays(value)
+
+
+def _get_array_size_bytes(value: Any) -> int:
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return value.element_size() * value.nelement()
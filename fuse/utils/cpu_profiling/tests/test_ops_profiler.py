@@ -0,0 +1,79 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from fuse.data.ops.op_base import OpBase
+from fuse.data.pipelines.pipeline_default import PipelineDefault
+from fuse.utils.cpu_profiling import OpsProfiler
+from fuse.utils.multiprocessing.run_multiprocessed import run_multiprocessed, get_from_global_storage
+from fuse.utils.ndict import NDict
+
+
+class OpCreateArrayForTest(OpBase):
+    def __call__(self, sample_dict: NDict, key: str, size: int) -> NDict:
+        sample_dict[key] = np.zeros(size, dtype=np.float64)
+        return sample_dict
+
+
+class OpDoubleForTest(OpBase):
+    def __call__(self, sample_dict: NDict, key: str) -> NDict:
+        sample_dict[key] = sample_dict[key] * 2
+        return sample_dict
+
+
+def _run_pipeline(sample_id: int) -> int:
+    pipeline = get_from_global_storage("test_ops_profiler_pipeline")
+    pipeline(NDict({"data": {"sample_id": sample_id}}))
+    return sample_id
+
+
+class TestOpsProfiler(unittest.TestCase):
+    def test_ops_profiler(self):
+        """
+        Profile a pipeline, in the main process and in worker processes
+        """
+        output_dir = tempfile.mkdtemp()
+        # pool workers are terminated when done - flush on every call
+        profiler = OpsProfiler(output_dir, flush_interval=0.0)
+        nested_pipeline = PipelineDefault("nested", [(OpDoubleForTest(), dict(key="data.array"))])
+        pipeline = PipelineDefault(
+            "test",
+            [
+                (OpCreateArrayForTest(), dict(key="data.array", size=1000)),
+                (nested_pipeline, dict()),
+                (OpDoubleForTest(), dict(key="data.array")),
+            ],
+            verbose=True,
+        )
+        pipeline.set_profiler(profiler)
+
+        for sample_id in range(10):
+            pipeline(NDict({"data": {"sample_id": sample_id}}))
+        run_multiprocessed(
+            _run_pipeline,
+            list(range(20)),
+            workers=2,
+            copy_to_global_storage={"test_ops_profiler_pipeline": pipeline},
+        )
+
+        report = profiler.report()
+        self.assertListEqual(sorted(report["op_id"]), ["internal.test.0", "internal.test.1.0", "internal.test.2"])
+        self.assertTrue((report["calls"] == 30).all())
+        report = report.set_index("op_id")
+        self.assertEqual(report.loc["internal.test.1.0", "op"], "OpDoubleForTest")
+        self.assertAlmostEqual(report.loc["internal.test.0", "output_mean_mb"], 8000 / 1024**2)
+        self.assertLessEqual(report.loc["internal.test.0", "wall_p50_ms"], report.loc["internal.test.0", "wall_p95_ms"])
+
+        profiler.save_report(os.path.join(output_dir, "report"))
+        self.assertTrue(os.path.exists(os.path.join(output_dir, "report.json")))
+        self.assertTrue(os.path.exists(os.path.join(output_dir, "report.csv")))
+        profiler.print_summary()
+
+        profiler.clear()
+        self.assertEqual(len(profiler.report()), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
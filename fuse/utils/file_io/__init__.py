@@ -2,8 +2,12 @@ from .file_io import (
     save_pickle,
     load_pickle,
     save_pickle_safe,
+    append_pickle_record,
+    read_pickle_records,
     save_text_file_safe,
     save_text_file,
+    save_binary_file_safe,
+    read_binary_file,
     read_simple_float_file,
     read_simple_int_file,
     read_text_file,
@@ -11,7 +15,9 @@ from .file_io import (
     read_single_str_line_file,
     create_simple_timestamp_file,
     save_hdf5_safe,
+    save_npy_safe,
     load_hdf5,
+    get_hdf5_keys,
     delete_directory_tree,
 )
 
@@ -1,6 +1,7 @@
 import errno
-from typing import Iterable, List, Dict, Optional, Tuple, Union, Any
+from typing import BinaryIO, Iterable, List, Dict, Optional, Tuple, Union, Any
 import pickle
+import struct
 import bz2
 import gzip
 import socket
@@ -73,6 +74,36 @@ def save_pickle_safe(obj: Any, output_filename: str, compress: bool = False, ver
     return output_filename
 
 
+def append_pickle_record(f: BinaryIO, obj: Any, flush: bool = True) -> None:
+    """
+    Appends a single length-prefixed pickled record to a file opened in binary append mode.
+    The record is written using a single write() call, and read_pickle_records() ignores a partially written (trailing) record,
+    which makes it suitable for append-only logs/indices that need to survive a crash of the writing process.
+    """
+    payload = pickle.dumps(obj)
+    f.write(struct.pack("<Q", len(payload)) + payload)
+    if flush:
+        f.flush()
+
+
+def read_pickle_records(content: bytes) -> Tuple[List[Any], int]:
+    """
+    Parses records written by append_pickle_record()
+    :param content: the content of the file (or of a part of it which starts at a record boundary)
+    :return: a tuple of (the records, the number of bytes that were parsed). A trailing partially written record is not parsed.
+    """
+    records = []
+    pos = 0
+    header_size = struct.calcsize("<Q")
+    while pos + header_size <= len(content):
+        (payload_size,) = struct.unpack_from("<Q", content, pos)
+        if pos + header_size + payload_size > len(content):
+            break
+        records.append(pickle.loads(content[pos + header_size : pos + header_size + payload_size]))
+        pos += header_size + payload_size
+    return records, pos
+
+
 def save_text_file_safe(filename: str, str_content: str) -> None:
     """
     Saves str_content into a created text file.
@@ -85,6 +116,28 @@ def save_text_file_safe(filename: str, str_content: str) -> None:
     return filename
 
 
+def save_binary_file_safe(filename: str, content: Union[bytes, bytearray, memoryview]) -> str:
+    """
+    Saves binary content into a created file.
+    This function is multi-threading and multi-processing safe.
+    """
+    scrambed_filename = get_randomized_postfix_name(filename)
+    with open(scrambed_filename, "wb") as f:
+        f.write(content)
+    os.rename(scrambed_filename, filename)
+    return filename
+
+
+def read_binary_file(file_path: str) -> bytearray:
+    """
+    Reads the entire content of a binary file into a (writable) bytearray
+    """
+    with open(file_path, "rb") as f:
+        content = bytearray(os.fstat(f.fileno()).st_size)
+        f.readinto(content)
+    return content
+
+
 def save_text_file(file_path: str, content: str = "") -> None:
     """
     Saves str_content into a created text file.
@@ -201,6 +254,22 @@ def save_hdf5_safe(filename: str, use_blosc: bool = True, **kwarrays):
     return filename
 
 
+def save_npy_safe(filename: str, arr: np.ndarray) -> str:
+    """
+    multi-threading and multi-processing safe saving of a single array to an (uncompressed) npy file.
+    The array data in the file is aligned, so the file can be efficiently memory mapped using np.load(filename, mmap_mode=...)
+    """
+    if not isinstance(arr, np.ndarray):
+        raise Exception(f"only np.ndarray data is supported, instead got {type(arr)}")
+    scrambed_filename = get_randomized_postfix_name(filename)
+    with open(scrambed_filename, "wb") as f:
+        np.save(f, arr, allow_pickle=False)
+
+    os.rename(scrambed_filename, filename)
+
+    return filename
+
+
 # TODO: CONSIDER supporting slicing more "organically" - for example, changing this into a class instance,
 #      which supports something like: x = load_hdf5('blah'); x['a.b'][:2,10:20:3,...]
 
@@ -246,34 +315,42 @@ def load_hdf5(
     # import ipdb;ipdb.set_trace()
 
     ans = {}
-    h5f = h5py.File(filename, "r")
-    for k in h5f.keys():
-        if custom_extract is not None:
-            if k not in custom_extract:
-                continue
+    with h5py.File(filename, "r") as h5f:
+        for k in h5f.keys():
+            if custom_extract is not None:
+                if k not in custom_extract:
+                    continue
+                else:
+                    index = custom_extract[k]
+            else:
+                index = None
+
+            dset = h5f[k]
+
+            if index is None:
+                np_arr = dset[:]
+            elif isinstance(index, int):
+                np_arr = dset[index, ...]
             else:
-                index = custom_extract[k]
-        else:
-            index = None
-
-        dset = h5f[k]
-
-        if index is None:
-            np_arr = dset[:]
-        elif isinstance(index, int):
-            np_arr = dset[index, ...]
-        else:
-            assert isinstance(index, (list, tuple))
-            assert len(index) > 0
-            assert isinstance(
-                index[0], (slice, type(Ellipsis))
-            )  # checking just the first, but it should be all of them
-            np_arr = dset[tuple(index)]
-        ans[k] = np_arr
+                assert isinstance(index, (list, tuple))
+                assert len(index) > 0
+                assert isinstance(
+                    index[0], (slice, type(Ellipsis))
+                )  # checking just the first, but it should be all of them
+                np_arr = dset[tuple(index)]
+            ans[k] = np_arr
 
     return ans
 
 
+def get_hdf5_keys(filename: str) -> List[str]:
+    """
+    Returns the names of the datasets stored in an hdf5 file, without reading (or decompressing) any of the data
+    """
+    with h5py.File(filename, "r") as h5f:
+        return list(h5f.keys())
+
+
 def save_dataframe(df: pd.DataFrame, filename: str, **kwargs) -> None:
     """
     Save dataframe into a file. The file format inferred from filename suffix
@@ -1,2 +1,2 @@
-from .run_multiprocessed import run_multiprocessed, get_from_global_storage
+from .run_multiprocessed import run_multiprocessed, get_from_global_storage, WorkerPool
 from .helpers import get_chunks_ranges
@@ -1,6 +1,19 @@
 import functools
-from typing import Any, List, Optional
+import math
+import pickle
+import tempfile
+from multiprocessing.pool import ThreadPool
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Tuple
 from fuse.utils.utils_debug import FuseDebug
+from fuse.utils.multiprocessing.shared_arrays import (
+    from_shared_memory,
+    is_shared_memory_supported,
+    new_shared_memory_prefix,
+    start_resource_tracker,
+    to_shared_memory,
+    unlink_shared_memory_blocks,
+    verify_shared_memory_supported,
+)
 import torch
 from tqdm import tqdm
 import multiprocessing as mp
@@ -53,7 +66,7 @@ def __orig__run_multiprocessed(
     assert callable(worker_func)
 
     if verbose < 1:
-        tqdm_func = lambda x: x
+        tqdm_func = lambda x, **kwargs: x
     else:
         tqdm_func = tqdm
 
@@ -97,6 +110,9 @@ def run_multiprocessed(
     keep_results_order: bool = True,
     as_iterator=False,
     mp_context: Optional[str] = None,
+    chunksize: Optional[int] = None,
+    pool: Optional["WorkerPool"] = None,
+    shared_memory_min_bytes: Optional[int] = None,
 ) -> List[Any]:
     """
     Args:
@@ -119,6 +135,13 @@ def run_multiprocessed(
          or in the case that you want to parallelize some calculation with the generation.
          if False, the answers will be accumulated to a list and returned.
     :param mp_context: "fork", "spawn", "thread" or None for multiprocessing default
+    :param chunksize: number of elements of args_list sent to a worker at once.
+        None to set it according to the number of elements and workers, up to 16.
+    :param pool: a persistent pool of workers to use instead of creating a new one (see WorkerPool).
+        If not specified and workers > 1, the active WorkerPool (the one used as a context manager) is used if there is one.
+    :param shared_memory_min_bytes: if set, numpy arrays and torch tensors of at least this size (in bytes) in the results of worker_func
+        are returned from the worker processes via shared memory instead of being pickled (see shared_arrays.py).
+        Supported for arrays / tensors nested in dicts, NDicts, lists and tuples.
     Returns:
         if as_iterator is set to True, returns an iterator.
         Otherwise, returns a list of results from calling func
@@ -132,6 +155,9 @@ def run_multiprocessed(
         copy_to_global_storage=copy_to_global_storage,
         keep_results_order=keep_results_order,
         mp_context=mp_context,
+        chunksize=chunksize,
+        pool=pool,
+        shared_memory_min_bytes=shared_memory_min_bytes,
     )
 
     if as_iterator:
@@ -149,6 +175,9 @@ def _run_multiprocessed_as_iterator_impl(
     copy_to_global_storage: Optional[dict] = None,
     keep_results_order: bool = True,
     mp_context: Optional[str] = None,
+    chunksize: Optional[int] = None,
+    pool: Optional["WorkerPool"] = None,
+    shared_memory_min_bytes: Optional[int] = None,
 ) -> List[Any]:
     """
     an iterator version of run_multiprocessed - useful when the accumulated answer is too large to fit in memory
@@ -170,9 +199,14 @@ def _run_multiprocessed_as_iterator_impl(
         keep_results_order: determined if imap or imap_unordered is used. if strict_answers_order is set to False, then results will be ordered by their readiness.
             if strict_answers_order is set to True, the answers will be provided at the same order as defined in the args_list
     :param mp_context: "fork", "spawn", "thread" or None for multiprocessing default
+    :param chunksize: number of elements of args_list sent to a worker at once.
+        None to set it according to the number of elements and workers, up to 16.
+    :param pool: a persistent pool of workers to use instead of creating a new one (see WorkerPool)
+    :param shared_memory_min_bytes: return arrays / tensors of at least this size via shared memory, None to pickle them
     """
     if "DEBUG_SINGLE_PROCESS" in os.environ and os.environ["DEBUG_SINGLE_PROCESS"] in ["T", "t", "True", "true", 1]:
         workers = None
+        pool = None
         cprint(
             "Due to the env variable DEBUG_SINGLE_PROCESS being set, run_multiprocessed is not using multiprocessing",
             "red",
@@ -180,19 +214,26 @@ def _run_multiprocessed_as_iterator_impl(
 
     if FuseDebug().get_setting("multiprocessing") == "main_process":
         workers = None
+        pool = None
         cprint("Due to the FuseDebug mode, run_multiprocessed is not using multiprocessing", "red")
 
     assert callable(worker_func)
 
     if verbose < 1:
-        tqdm_func = lambda x: x
+        tqdm_func = lambda x, **kwargs: x
     else:
         tqdm_func = tqdm
 
     if copy_to_global_storage is None:
         copy_to_global_storage = {}
 
-    if workers is None or workers <= 1:
+    if shared_memory_min_bytes is not None:
+        verify_shared_memory_supported()
+
+    if pool is None and workers is not None and workers > 1:
+        pool = WorkerPool.get_active(mp_context)
+
+    if pool is None and (workers is None or workers <= 1):
         _store_in_global_storage(copy_to_global_storage)
         try:
             for i in tqdm_func(range(len(args_list))):
@@ -202,33 +243,296 @@ def _run_multiprocessed_as_iterator_impl(
             raise
         finally:
             _remove_from_global_storage(list(copy_to_global_storage.keys()))
-    else:
-        assert isinstance(workers, int)
-        assert workers >= 0
+        return
+
+    if not isinstance(args_list, (list, tuple)):
+        args_list = list(args_list)
+
+    if pool is not None:
+        if chunksize is None:
+            chunksize = _get_chunksize(len(args_list), pool.workers)
+        if verbose > 0:
+            cprint(f"using a multiprocess pool of {pool.workers} workers.", "cyan")
+        yield from pool._run(
+            worker_func,
+            args_list,
+            copy_to_global_storage,
+            chunksize,
+            keep_results_order,
+            verbose,
+            shared_memory_min_bytes,
+        )
+        return
+
+    assert isinstance(workers, int)
+    assert workers >= 0
+    if chunksize is None:
+        chunksize = _get_chunksize(len(args_list), workers)
 
+    # temporary pool - the global storage is passed once to each worker upon initialization (and inherited without copying when forking)
+    shared_memory_prefix = None
+    if mp_context == "thread":
+        _store_in_global_storage(copy_to_global_storage)
+        pool = ThreadPool(processes=workers)
+    else:
+        if shared_memory_min_bytes is not None:
+            start_resource_tracker()
+            shared_memory_prefix = new_shared_memory_prefix()
+        context = mp if mp_context is None else mp.get_context(mp_context)
+        pool = context.Pool(processes=workers, initializer=_init_worker, initargs=(copy_to_global_storage,))
+    try:
+        if verbose > 0:
+            cprint(f"multiprocess pool created with {workers} workers.", "cyan")
+        func = functools.partial(
+            _process_chunk,
+            worker_func=worker_func,
+            shared_memory_prefix=shared_memory_prefix,
+            shared_memory_min_bytes=shared_memory_min_bytes,
+        )
+        yield from _imap_chunks(pool, func, args_list, chunksize, keep_results_order, verbose, shared_memory_prefix)
+        pool.close()
+        pool.join()
+    finally:
+        pool.terminate()
         if mp_context == "thread":
-            from multiprocessing.pool import ThreadPool
+            _remove_from_global_storage(list(copy_to_global_storage.keys()))
+        if shared_memory_prefix is not None:
+            unlink_shared_memory_blocks(shared_memory_prefix)
+
+
+class WorkerPool:
+    """
+    A persistent pool of workers, reused by run_multiprocessed() calls - saves the creation of the workers (and importing torch) in each call.
+    Used as a context manager, the pool is active: run_multiprocessed() calls with workers > 1 use it,
+    so consecutive DatasetDefault.get_multi() / SamplesCacher.cache_samples() calls can share it without passing it explicitly.
+
+    The values to copy to the global storage (copy_to_global_storage) are serialized once per run_multiprocessed() call
+    and loaded once by each worker (instead of being inherited when the workers are forked).
+
+    Usage example:
+        with WorkerPool(workers=8):
+            dataset.create()
+            samples = dataset.get_multi(workers=8)
+    """
 
-            pool = ThreadPool
-        elif mp_context is None:  # os default
-            pool = mp.Pool
+    _active: List["WorkerPool"] = []
+
+    def __init__(self, workers: int, mp_context: Optional[str] = None, activate: bool = True):
+        """
+        :param workers: number of workers
+        :param mp_context: "fork", "spawn", "thread" or None for multiprocessing default
+        :param activate: when used as a context manager, use the pool in run_multiprocessed() calls that don't specify a pool
+        """
+        self.workers = workers
+        self.mp_context = mp_context
+        self._activate = activate
+        self._pool = None
+        self._pid = None
+        self._num_jobs = 0
+        self._shared_memory_prefix = None
+
+    @staticmethod
+    def get_active(mp_context: Optional[str] = None) -> Optional["WorkerPool"]:
+        """
+        :return: the most recent active pool created by the current process that is compatible with mp_context, None if there isn't any
+        """
+        for pool in reversed(WorkerPool._active):
+            if pool._pid == os.getpid() and mp_context in (None, pool.mp_context):
+                return pool
+        return None
+
+    def start(self) -> "WorkerPool":
+        if self._pool is None:
+            if self.mp_context == "thread":
+                self._pool = ThreadPool(processes=self.workers)
+            else:
+                if is_shared_memory_supported():
+                    # the workers might return arrays via shared memory in any of the jobs
+                    start_resource_tracker()
+                    self._shared_memory_prefix = new_shared_memory_prefix()
+                context = mp if self.mp_context is None else mp.get_context(self.mp_context)
+                self._pool = context.Pool(processes=self.workers, initializer=_init_worker, initargs=(None,))
+            self._pid = os.getpid()
+        return self
+
+    def close(self) -> None:
+        """
+        Waits for the workers to complete their tasks and exit
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+            self._unlink_shared_memory_blocks()
+
+    def terminate(self) -> None:
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+            self._unlink_shared_memory_blocks()
+
+    def _unlink_shared_memory_blocks(self) -> None:
+        # blocks of jobs that were stopped while the workers were still running
+        if self._shared_memory_prefix is not None:
+            unlink_shared_memory_blocks(self._shared_memory_prefix)
+            self._shared_memory_prefix = None
+
+    def __enter__(self) -> "WorkerPool":
+        self.start()
+        if self._activate:
+            WorkerPool._active.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb) -> None:
+        if self in WorkerPool._active:
+            WorkerPool._active.remove(self)
+        if exc_type is None:
+            self.close()
         else:
-            pool = mp.get_context(mp_context).Pool
+            self.terminate()
+
+    def _run(
+        self,
+        worker_func: Callable,
+        args_list: Sequence,
+        copy_to_global_storage: dict,
+        chunksize: int,
+        keep_results_order: bool,
+        verbose: int,
+        shared_memory_min_bytes: Optional[int] = None,
+    ) -> Iterator:
+        self.start()
+        self._num_jobs += 1
+
+        if self.mp_context == "thread":
+            # threads share the global storage with the main thread
+            _store_in_global_storage(copy_to_global_storage)
+            func = functools.partial(_process_chunk, worker_func=worker_func)
+            try:
+                yield from _imap_chunks(self._pool, func, args_list, chunksize, keep_results_order, verbose)
+            finally:
+                _remove_from_global_storage(list(copy_to_global_storage.keys()))
+            return
+
+        # large payloads are written to a file, so they will be sent just once to each worker
+        payload = pickle.dumps((worker_func, copy_to_global_storage), protocol=pickle.HIGHEST_PROTOCOL)
+        payload_filename = None
+        if len(payload) > _JOB_PAYLOAD_INLINE_MAX_BYTES:
+            fd, payload_filename = tempfile.mkstemp(prefix="fuse_worker_pool_job_", suffix=".pkl")
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload)
+            payload = None
+        job = (f"{self._pid}_{id(self)}_{self._num_jobs}", payload, payload_filename)
+        shared_memory_prefix = None
+        if shared_memory_min_bytes is not None:
+            shared_memory_prefix = f"{self._shared_memory_prefix}_{self._num_jobs:x}"
+        try:
+            func = functools.partial(
+                _process_chunk_of_job,
+                job=job,
+                shared_memory_prefix=shared_memory_prefix,
+                shared_memory_min_bytes=shared_memory_min_bytes,
+            )
+            yield from _imap_chunks(
+                self._pool, func, args_list, chunksize, keep_results_order, verbose, shared_memory_prefix
+            )
+        finally:
+            if payload_filename is not None:
+                os.remove(payload_filename)
+            if shared_memory_prefix is not None:
+                unlink_shared_memory_blocks(shared_memory_prefix)
 
-        worker_func = functools.partial(worker_func_wrapper, worker_func=worker_func)
-        with pool(processes=workers, initializer=_store_in_global_storage, initargs=(copy_to_global_storage,)) as pool:
-            if verbose > 0:
-                cprint(f"multiprocess pool created with {workers} workers.", "cyan")
-            map_func = pool.imap if keep_results_order else pool.imap_unordered
-            for curr_ans in tqdm_func(
-                map_func(worker_func, args_list), total=len(args_list), smoothing=0.1, disable=verbose < 1
-            ):
-                yield curr_ans
+
+# payloads of run_multiprocessed() calls up to this size are sent with each chunk instead of via a file
+_JOB_PAYLOAD_INLINE_MAX_BYTES = 64 * 1024
+
+# the job of a WorkerPool currently loaded by the worker process: (job id, worker_func, keys in the global storage)
+_worker_job = (None, None, [])
+
+
+# upper bound of the default chunksize - the results of a chunk are returned together once all of them are ready
+_MAX_DEFAULT_CHUNKSIZE = 16
+
+
+def _get_chunksize(num_elements: int, workers: int) -> int:
+    """
+    About 4 chunks per worker - large enough to amortize the communication overhead of cheap elements,
+    small enough to balance the load between the workers.
+    Bounded by _MAX_DEFAULT_CHUNKSIZE, so the results are streamed incrementally and the workers hold just a few results at once.
+    """
+    return max(1, min(math.ceil(num_elements / (max(workers, 1) * 4)), _MAX_DEFAULT_CHUNKSIZE))
+
+
+def _imap_chunks(
+    pool: Any,
+    func: Callable,
+    args_list: Sequence,
+    chunksize: int,
+    keep_results_order: bool,
+    verbose: int,
+    shared_memory_prefix: Optional[str] = None,
+) -> Iterator:
+    """
+    Sends chunks of args_list to the pool workers and yields the results as soon as they are ready.
+    The chunks complete out of order - if keep_results_order is set, they are reordered before being yielded.
+    The arrays returned via shared memory are mapped as soon as the chunk is received.
+    """
+    chunks = ((start, args_list[start : start + chunksize]) for start in range(0, len(args_list), chunksize))
+    pending = {}
+    next_start = 0
+    with tqdm(total=len(args_list), smoothing=0.1, disable=verbose < 1) as progress:
+        for start, results in pool.imap_unordered(func, chunks):
+            progress.update(len(results))
+            if shared_memory_prefix is not None:
+                results = [from_shared_memory(result) for result in results]
+            if not keep_results_order:
+                yield from results
+                continue
+            pending[start] = results
+            while next_start in pending:
+                results = pending.pop(next_start)
+                next_start += len(results)
+                yield from results
+
+
+def _process_chunk(
+    chunk: Tuple[int, Sequence],
+    worker_func: Callable,
+    shared_memory_prefix: Optional[str] = None,
+    shared_memory_min_bytes: Optional[int] = None,
+) -> Tuple[int, List[Any]]:
+    start, args_chunk = chunk
+    if shared_memory_prefix is None:
+        return start, [worker_func(args) for args in args_chunk]
+    return start, [
+        to_shared_memory(worker_func(args), shared_memory_prefix, shared_memory_min_bytes) for args in args_chunk
+    ]
+
+
+def _process_chunk_of_job(
+    chunk: Tuple[int, Sequence],
+    job: Tuple,
+    shared_memory_prefix: Optional[str] = None,
+    shared_memory_min_bytes: Optional[int] = None,
+) -> Tuple[int, List[Any]]:
+    global _worker_job
+    job_id, payload, payload_filename = job
+    if _worker_job[0] != job_id:
+        # first chunk of a new job in this worker - replace the global storage of the previous job
+        _remove_from_global_storage([key for key in _worker_job[2] if key in _multiprocess_global_storage])
+        _worker_job = (None, None, [])
+        if payload is None:
+            with open(payload_filename, "rb") as f:
+                payload = f.read()
+        worker_func, copy_to_global_storage = pickle.loads(payload)
+        _store_in_global_storage(copy_to_global_storage)
+        _worker_job = (job_id, worker_func, list(copy_to_global_storage.keys()))
+    return _process_chunk(chunk, _worker_job[1], shared_memory_prefix, shared_memory_min_bytes)
 
 
-def worker_func_wrapper(*args, worker_func, **kwargs):
+def _init_worker(store_me: Optional[dict]) -> None:
     torch.set_num_threads(1)
-    return worker_func(*args, **kwargs)
+    _store_in_global_storage(store_me)
 
 
 def _store_in_global_storage(store_me: dict) -> None:
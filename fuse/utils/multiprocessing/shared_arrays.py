@@ -0,0 +1,227 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Returning large numpy arrays and torch tensors from worker processes via shared memory (see run_multiprocessed()).
+The worker copies the arrays of a result into a single shared memory block and returns lightweight handles instead of the arrays.
+The main process maps the block once per result, without copying, and unlinks it right away -
+the memory is released once all of the arrays of the result are garbage collected.
+Where the blocks are exposed as files (/dev/shm), the mapping does not keep a file descriptor open,
+so the number of arrays kept alive is not limited by the open files limit.
+
+Lifetime of the blocks:
+ - the blocks are registered in the multiprocessing resource tracker, which removes the leftovers when the program exits.
+ - the names of the blocks start with a prefix per run_multiprocessed() call, so the blocks of a call that failed
+   (e.g. a worker crashed after creating a block, but before the main process got the handle) are removed once the call completes.
+
+Requires python 3.8 or later (multiprocessing.shared_memory) - the modules are imported only when used.
+"""
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+import glob
+import itertools
+import os
+import sys
+import weakref
+
+import numpy as np
+import torch
+
+from fuse.utils.ndict import NDict
+
+# numbering of the shared memory prefixes (main process) and blocks (worker process)
+_counter = itertools.count()
+
+# offsets of the arrays within a block are aligned to this number of bytes
+_ALIGNMENT = 64
+
+_SHARED_MEMORY_FILES_DIR = "/dev/shm"
+
+
+class SharedArray(NamedTuple):
+    """
+    Handle of a numpy array or torch tensor stored in a shared memory block
+    """
+
+    block_name: str
+    offset: int
+    shape: Tuple[int, ...]
+    dtype: str
+    is_tensor: bool
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape, dtype=np.int64)) * np.dtype(self.dtype).itemsize
+
+
+def is_shared_memory_supported() -> bool:
+    return sys.version_info >= (3, 8)
+
+
+def verify_shared_memory_supported() -> None:
+    if not is_shared_memory_supported():
+        raise Exception(
+            f"Returning arrays via shared memory (shared_memory_min_bytes) requires python 3.8 or later, found {sys.version.split()[0]}"
+        )
+
+
+def start_resource_tracker() -> None:
+    """
+    Call in the main process before creating the worker processes, so they will share the resource tracker of the main process.
+    Otherwise, each forked worker starts its own tracker and the blocks unlinked by the main process remain registered in it.
+    """
+    verify_shared_memory_supported()
+    if os.name == "posix":
+        from multiprocessing import resource_tracker
+
+        resource_tracker.ensure_running()
+
+
+def new_shared_memory_prefix() -> str:
+    """
+    :return: a unique prefix for the names of shared memory blocks - short enough for platforms that limit the names length
+    """
+    return f"fuse_{os.getpid():x}_{next(_counter):x}"
+
+
+def to_shared_memory(value: Any, prefix: str, min_bytes: int) -> Any:
+    """
+    Replaces the numpy arrays and torch tensors of at least min_bytes in (nested) dicts, lists and tuples with handles (SharedArray).
+    All of the arrays are stored in a single shared memory block.
+    Returns new containers - the original ones are not modified.
+    :param value: the value to return from the worker process
+    :param prefix: prefix for the names of the shared memory blocks (see new_shared_memory_prefix())
+    :param min_bytes: smaller arrays are returned as is
+    """
+    block_name = f"{prefix}_{os.getpid():x}_{next(_counter):x}"
+    arrays: List[Tuple[int, np.ndarray]] = []
+    block_size = 0
+
+    def to_handle(array: Any) -> Any:
+        nonlocal block_size
+        is_tensor = isinstance(array, torch.Tensor)
+        if is_tensor:
+            if array.element_size() * array.nelement() < min_bytes or array.device.type != "cpu":
+                return array
+            try:
+                array = array.detach().numpy()
+            except TypeError:  # no matching numpy dtype (e.g. bfloat16)
+                return array
+        elif array.nbytes < min_bytes or array.dtype.hasobject:
+            return array
+
+        offset = -(-block_size // _ALIGNMENT) * _ALIGNMENT
+        block_size = offset + array.nbytes
+        arrays.append((offset, array))
+        return SharedArray(block_name, offset, array.shape, array.dtype.str, is_tensor)
+
+    ans = _map_leaves(value, (np.ndarray, torch.Tensor), to_handle)
+    if len(arrays) == 0:
+        return value
+
+    shm = _shared_memory_class()(name=block_name, create=True, size=max(block_size, 1))
+    try:
+        _copy_to_block(shm.buf, arrays)
+    finally:
+        shm.close()
+    return ans
+
+
+def from_shared_memory(value: Any) -> Any:
+    """
+    Replaces the handles (SharedArray) created by to_shared_memory() with the arrays / tensors
+    """
+    handles: List[SharedArray] = []
+    _map_leaves(value, SharedArray, lambda handle: handles.append(handle))
+    if len(handles) == 0:
+        return value
+
+    blocks_sizes: Dict[str, int] = {}
+    for handle in handles:
+        blocks_sizes[handle.block_name] = max(blocks_sizes.get(handle.block_name, 1), handle.offset + handle.nbytes)
+    blocks = {name: _map_block(name, size) for name, size in blocks_sizes.items()}
+
+    def load(handle: SharedArray) -> Any:
+        array = blocks[handle.block_name][handle.offset : handle.offset + handle.nbytes]
+        array = array.view(handle.dtype).reshape(handle.shape)
+        if handle.is_tensor:
+            return torch.from_numpy(array)
+        return array
+
+    return _map_leaves(value, SharedArray, load)
+
+
+def unlink_shared_memory_blocks(prefix: str) -> None:
+    """
+    Removes the leftover shared memory blocks whose names start with the prefix. Supported on platforms that expose them in /dev/shm.
+    Other platforms rely on the resource tracker that removes the leftovers when the program exits.
+    """
+    for filename in glob.glob(os.path.join(_SHARED_MEMORY_FILES_DIR, f"{prefix}_*")):
+        try:
+            _shared_memory_class()(name=os.path.basename(filename)).unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _map_leaves(value: Any, leaf_types: Any, func: Callable) -> Any:
+    """
+    Applies func to the values of type leaf_types in (nested) dicts, NDicts, lists and tuples. Returns new containers.
+    """
+    if isinstance(value, leaf_types):
+        return func(value)
+    if isinstance(value, NDict):
+        return NDict(_map_leaves(value.to_dict(), leaf_types, func))
+    if type(value) is dict:
+        return {key: _map_leaves(item, leaf_types, func) for key, item in value.items()}
+    if type(value) in (list, tuple):
+        return type(value)(_map_leaves(item, leaf_types, func) for item in value)
+    return value
+
+
+def _copy_to_block(buf: memoryview, arrays: List[Tuple[int, np.ndarray]]) -> None:
+    block = np.ndarray((len(buf),), dtype=np.uint8, buffer=buf)
+    for offset, array in arrays:
+        block[offset : offset + array.nbytes].view(array.dtype).reshape(array.shape)[...] = array
+
+
+def _map_block(block_name: str, size: int) -> np.ndarray:
+    """
+    Maps the shared memory block and unlinks it - can be called just once per block.
+    :return: uint8 array of the block. The block is unmapped once the array (and the views of it) are garbage collected.
+    """
+    filename = os.path.join(_SHARED_MEMORY_FILES_DIR, block_name)
+    if os.path.isfile(filename):
+        # unlike python's mmap module, torch does not keep a file descriptor open per mapping
+        block = torch.from_file(filename, shared=True, size=size, dtype=torch.uint8).numpy()
+        from multiprocessing import resource_tracker
+
+        os.unlink(filename)
+        resource_tracker.unregister("/" + block_name, "shared_memory")
+        return block
+
+    shm = _shared_memory_class()(name=block_name)
+    shm.unlink()
+    if os.name == "posix":
+        # the mapping keeps its own (duplicated) file descriptor
+        os.close(shm._fd)
+        shm._fd = -1
+    block = np.ndarray((size,), dtype=np.uint8, buffer=shm.buf)
+    weakref.finalize(block, shm.close)
+    return block
+
+
+def _shared_memory_class() -> type:
+    verify_shared_memory_supported()
+    from multiprocessing.shared_memory import SharedMemory
+
+    return SharedMemory
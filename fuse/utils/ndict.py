@@ -23,7 +23,28 @@ import copy
 import types
 import numpy
 import torch
-from typing import Any, Callable, Iterator, Optional, Sequence, Union, List
+from typing import Any, Callable, Dict, Iterator, Optional, Sequence, Tuple, Union, List
+
+# memoized key.split(".") - the same keys are accessed over and over again by the ops and collate functions
+_SPLIT_KEYS_CACHE: Dict[str, Tuple[str, ...]] = {}
+_SPLIT_KEYS_CACHE_MAX_SIZE = 100000
+# returned by _get_value() when the key does not exist
+_MISSING = object()
+
+
+def _split_key(key: str) -> Tuple[str, ...]:
+    """
+    :return: the key path split on '.'
+    """
+    try:
+        return _SPLIT_KEYS_CACHE[key]
+    except KeyError:
+        pass
+    nested_key = tuple(key.split("."))
+    if len(_SPLIT_KEYS_CACHE) >= _SPLIT_KEYS_CACHE_MAX_SIZE:
+        _SPLIT_KEYS_CACHE.clear()
+    _SPLIT_KEYS_CACHE[key] = nested_key
+    return nested_key
 
 
 class NDict(dict):
@@ -95,10 +116,12 @@ class NDict(dict):
         in deep copy, all values are copied recursively
         :param deepcopy: if true, does deep copy, otherwise does shalow copy
         """
+        ans = NDict()
         if not deepcopy:
-            return NDict(copy.copy(self._stored))
+            ans._stored = _copy_nested_dicts(self._stored)
         else:
-            return NDict(copy.deepcopy(self._stored))
+            ans._stored = copy.deepcopy(self._stored)
+        return ans
 
     def flatten(self) -> dict:
         """
@@ -116,21 +139,16 @@ class NDict(dict):
         """
 
         all_keys = {}
-        for key in self._stored:
-            if isinstance(self._stored[key], dict):
-                all_sub_keys = NDict(self[key]).flatten()
-                keys_to_add = {f"{key}.{sub_key}": all_sub_keys[sub_key] for sub_key in all_sub_keys}
-                all_keys.update(keys_to_add)
-            else:
-                all_keys[key] = self._stored[key]
-
+        _flatten_into(self._stored, "", all_keys)
         return all_keys
 
     def keypaths(self) -> List[str]:
         """
         returns a list of keypaths (i.e. "a.b.c.d") to all values in the nested dict
         """
-        return list(self.flatten().keys())
+        all_keys = []
+        _keypaths_into(self._stored, "", all_keys)
+        return all_keys
 
     def merge(self, other: dict) -> NDict:
         """
@@ -148,17 +166,22 @@ class NDict(dict):
         optionally shows the possible closest options
         :param key: dot delimited keypath into the nested dict
         """
-        nested_key = key.split(".")
-        if not nested_key[0] in self._stored:
+        value = self._get_value(key)
+        if value is _MISSING:
             raise NestedKeyError(key, self)
+        return value
 
+    def _get_value(self, key: str) -> Any:
+        """
+        traverses the nested dict - O(depth)
+        :return: the value or _MISSING if the key does not exist
+        """
         value = self._stored
-        for sub_key in nested_key:
+        for sub_key in _split_key(key):
             if isinstance(value, dict) and sub_key in value:
-                value = value.get(sub_key)
+                value = value[sub_key]
             else:
-                raise NestedKeyError(key, self)
-
+                return _MISSING
         return value
 
     def __setitem__(self, key: str, value: Any) -> None:
@@ -173,7 +196,7 @@ class NDict(dict):
                 self[f"{key}.{sub_key}"] = value[sub_key]
             return
 
-        nested_key = key.split(".")
+        nested_key = _split_key(key)
         element = self._stored
         for key in nested_key[:-1]:
             if key not in element:
@@ -184,7 +207,7 @@ class NDict(dict):
         element[nested_key[-1]] = value
 
     def __delitem__(self, key: str) -> None:
-        nested_key = key.split(".")
+        nested_key = _split_key(key)
         steps = len(nested_key)
         value = self._stored
         for step_idx, sep_key in enumerate(nested_key):
@@ -200,7 +223,7 @@ class NDict(dict):
         """
         partial_key = []
         partial_ndict = self._stored
-        parts = key.split(".")
+        parts = _split_key(key)
         for k in parts:
             if isinstance(partial_ndict, dict) and k in partial_ndict:
                 partial_key.append(k)
@@ -265,12 +288,13 @@ class NDict(dict):
         return repr(self._stored)
 
     def __contains__(self, o: str) -> bool:
-        return o == self.get_closest_key(o)
+        return self._get_value(o) is not _MISSING
 
     def get(self, key: str, default_value: Any = None) -> Any:
-        if key not in self:
+        value = self._get_value(key)
+        if value is _MISSING:
             return default_value
-        return self[key]
+        return value
 
     def get_multi(self, keys: Optional[List[str]] = None) -> NDict:
         if keys is None:
@@ -303,6 +327,35 @@ class NDict(dict):
                 NDict._print_tree_static(data_dict[key], level)
 
 
+def _flatten_into(data_dict: dict, prefix: str, all_keys: dict) -> None:
+    """
+    adds the leaves of data_dict to all_keys (single pass over the nested dict)
+    """
+    for key, value in data_dict.items():
+        if isinstance(value, dict):
+            _flatten_into(value, f"{prefix}{key}.", all_keys)
+        else:
+            all_keys[f"{prefix}{key}"] = value
+
+
+def _keypaths_into(data_dict: dict, prefix: str, all_keys: list) -> None:
+    """
+    adds the keypaths of the leaves of data_dict to all_keys (single pass over the nested dict)
+    """
+    for key, value in data_dict.items():
+        if isinstance(value, dict):
+            _keypaths_into(value, f"{prefix}{key}.", all_keys)
+        else:
+            all_keys.append(f"{prefix}{key}")
+
+
+def _copy_nested_dicts(data_dict: dict) -> dict:
+    """
+    copies the nested dicts, the leaves are referenced
+    """
+    return {key: _copy_nested_dicts(value) if isinstance(value, dict) else value for key, value in data_dict.items()}
+
+
 class NestedKeyError(KeyError):
     def __init__(self, key: str, d: NDict) -> None:
         partial_key = d.get_closest_key(key)
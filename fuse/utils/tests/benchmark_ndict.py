@@ -0,0 +1,97 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Microbenchmarks of the NDict operations used by the pipeline ops and collate functions.
+Measures the cost per operation on a sample dict with a typical structure.
+
+Usage:
+    python fuse/utils/tests/benchmark_ndict.py --repeats 5 --number 20000
+"""
+from typing import Callable, Dict
+import argparse
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from fuse.utils.ndict import NDict
+
+
+def create_sample(num_keys_per_level: int = 4) -> NDict:
+    """
+    :return: a sample dict with a typical structure: data.<group>.<sub_group>.<key>
+    """
+    sample = NDict()
+    sample["data.sample_id"] = "sample_0"
+    for group in range(num_keys_per_level):
+        for sub_group in range(num_keys_per_level):
+            for key in range(num_keys_per_level):
+                sample[f"data.group_{group}.sub_group_{sub_group}.key_{key}"] = np.zeros(4)
+    return sample
+
+
+def get_benchmarks(sample: NDict) -> Dict[str, Callable]:
+    """
+    :return: map from a benchmark name to a function running the operation once
+    """
+    deep_key = "data.group_1.sub_group_2.key_3"
+    missing_key = "data.group_1.sub_group_2.missing"
+
+    def set_item() -> None:
+        sample["data.group_0.sub_group_0.new_key"] = 1
+
+    def pop_item() -> None:
+        sample["data.group_0.sub_group_0.pop_key"] = 1
+        sample.pop("data.group_0.sub_group_0.pop_key")
+
+    return {
+        "getitem (top level)": lambda: sample["data"],
+        "getitem (depth 4)": lambda: sample[deep_key],
+        "setitem (depth 4)": set_item,
+        "set and pop (depth 4)": pop_item,
+        "contains (hit)": lambda: deep_key in sample,
+        "contains (miss)": lambda: missing_key in sample,
+        "get (hit)": lambda: sample.get(deep_key),
+        "get (miss)": lambda: sample.get(missing_key),
+        "keypaths": sample.keypaths,
+        "flatten": sample.flatten,
+        "clone (shallow)": lambda: sample.clone(deepcopy=False),
+        "NDict view": lambda: NDict(sample),
+    }
+
+
+def run_benchmarks(repeats: int = 5, number: int = 20000, num_keys_per_level: int = 4) -> pd.DataFrame:
+    """
+    Runs each benchmark and reports the best time per operation (of the repeats)
+    :param repeats: number of measurements per benchmark
+    :param number: number of operations per measurement
+    :param num_keys_per_level: controls the size of the sample dict
+    :return: a dataframe with a row per benchmark
+    """
+    sample = create_sample(num_keys_per_level)
+    results = []
+    for name, func in get_benchmarks(sample).items():
+        times = timeit.repeat(func, repeat=repeats, number=number)
+        results.append(dict(operation=name, time_per_op_us=min(times) / number * 1e6))
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="NDict microbenchmarks")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--number", type=int, default=20000)
+    parser.add_argument("--num_keys_per_level", type=int, default=4)
+    args = parser.parse_args()
+    print(run_benchmarks(args.repeats, args.number, args.num_keys_per_level).to_string(index=False))
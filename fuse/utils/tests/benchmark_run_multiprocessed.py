@@ -0,0 +1,87 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Throughput of run_multiprocessed() on cheap elements - dominated by the dispatch overhead.
+Compares a new pool per call with an element per task (the previous implementation), a new pool per call with chunked dispatch
+and a persistent WorkerPool with chunked dispatch. Each configuration runs a few consecutive calls, like consecutive get_multi() calls.
+
+Usage:
+    python fuse/utils/tests/benchmark_run_multiprocessed.py --num_elements 100000 --workers 4 --calls 3
+"""
+from typing import Optional
+import argparse
+from time import perf_counter
+
+import pandas as pd
+
+from fuse.utils.multiprocessing.run_multiprocessed import WorkerPool, get_from_global_storage, run_multiprocessed
+
+
+def _cheap_worker(x: int) -> int:
+    return x * get_from_global_storage("benchmark_multiplier")
+
+
+def _run_calls(
+    num_elements: int, workers: int, calls: int, chunksize: Optional[int], pool: Optional[WorkerPool]
+) -> float:
+    """
+    :return: the total time of the calls in seconds
+    """
+    args_list = list(range(num_elements))
+    start = perf_counter()
+    for _ in range(calls):
+        ans = run_multiprocessed(
+            _cheap_worker,
+            args_list,
+            workers=workers,
+            copy_to_global_storage={"benchmark_multiplier": 2},
+            chunksize=chunksize,
+            pool=pool,
+        )
+        assert ans[-1] == (num_elements - 1) * 2
+    return perf_counter() - start
+
+
+def run_benchmark(num_elements: int = 100000, workers: int = 4, calls: int = 3) -> pd.DataFrame:
+    """
+    :return: a dataframe with a row per configuration
+    """
+    results = []
+
+    def add_result(name: str, elapsed: float) -> None:
+        results.append(
+            dict(
+                configuration=name,
+                total_sec=elapsed,
+                elements_per_sec=num_elements * calls / elapsed,
+                speedup=results[0]["total_sec"] / elapsed if len(results) > 0 else 1.0,
+            )
+        )
+
+    add_result("new pool, element per task", _run_calls(num_elements, workers, calls, chunksize=1, pool=None))
+    add_result("new pool, chunked", _run_calls(num_elements, workers, calls, chunksize=None, pool=None))
+    with WorkerPool(workers) as pool:
+        add_result("persistent pool, chunked", _run_calls(num_elements, workers, calls, chunksize=None, pool=pool))
+
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run_multiprocessed dispatch benchmark")
+    parser.add_argument("--num_elements", type=int, default=100000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--calls", type=int, default=3)
+    args = parser.parse_args()
+    print(run_benchmark(args.num_elements, args.workers, args.calls).to_string(index=False))
@@ -80,6 +80,27 @@ class TestNDict(unittest.TestCase):
         self.assertFalse("d" in self.nested_dict)
         self.assertFalse("e" in self.nested_dict)
 
+    def test_is_in_and_get_deep(self):
+        self.nested_dict["b.e.f"] = numpy.zeros(3)
+        self.assertTrue("b.e.f" in self.nested_dict)
+        self.assertFalse("b.e.g" in self.nested_dict)
+        # intermediate non-dict value
+        self.assertFalse("a.b" in self.nested_dict)
+        self.assertFalse("b.e.f.g" in self.nested_dict)
+        self.assertEqual(self.nested_dict.get("b.c"), 2)
+        self.assertEqual(self.nested_dict.get("b.e.g", 42), 42)
+        with self.assertRaises(KeyError):
+            self.nested_dict["b.e.g"]
+
+    def test_shallow_clone(self):
+        self.nested_dict["b.e"] = [1, 2]
+        nested_dict_copy = self.nested_dict.clone(deepcopy=False)
+        self.assertListEqual(nested_dict_copy.keypaths(), self.nested_dict.keypaths())
+        # nested dicts are copied, values are referenced
+        nested_dict_copy["b.c"] = 7
+        self.assertEqual(self.nested_dict["b.c"], 2)
+        self.assertIs(nested_dict_copy["b.e"], self.nested_dict["b.e"])
+
     def test_apply_on_all(self):
         nested_dict_copy = self.nested_dict.clone()
 
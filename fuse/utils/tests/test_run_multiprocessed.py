@@ -0,0 +1,170 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+import glob
+import os
+import time
+import unittest
+
+import numpy as np
+import torch
+
+from fuse.utils.multiprocessing.run_multiprocessed import WorkerPool, get_from_global_storage, run_multiprocessed
+from fuse.utils.ndict import NDict
+
+
+def _add_offset(x: int) -> int:
+    if x % 7 == 0:
+        # complete out of order
+        time.sleep(0.001)
+    return x + get_from_global_storage("test_offset")
+
+
+def _get_pid_and_data_sum(x: int) -> tuple:
+    return os.getpid(), float(get_from_global_storage("test_data").sum())
+
+
+def _sleep_and_get_time(x: int) -> float:
+    time.sleep(0.002)
+    return time.time()
+
+
+def _create_sample(x: int) -> NDict:
+    if x == 13:
+        raise Exception("test - failed worker")
+    sample = NDict()
+    sample["data.image"] = np.full((64, 64), x, dtype=np.float32)
+    sample["data.seg"] = torch.full((64, 64), x, dtype=torch.int64)
+    sample["data.small"] = np.array([x])
+    sample["data.list"] = [np.full((32, 32), x, dtype=np.float64), "text"]
+    return sample
+
+
+def _get_shared_memory_blocks() -> list:
+    return glob.glob("/dev/shm/fuse_*")
+
+
+class TestRunMultiprocessed(unittest.TestCase):
+    def test_chunks(self):
+        args_list = list(range(1000))
+        expected = [x + 5 for x in args_list]
+        for chunksize in [None, 1, 7, 2000]:
+            ans = run_multiprocessed(
+                _add_offset, args_list, workers=2, copy_to_global_storage={"test_offset": 5}, chunksize=chunksize
+            )
+            self.assertListEqual(ans, expected)
+        ans = run_multiprocessed(
+            _add_offset,
+            args_list,
+            workers=2,
+            copy_to_global_storage={"test_offset": 5},
+            keep_results_order=False,
+            chunksize=7,
+        )
+        self.assertListEqual(sorted(ans), expected)
+        ans = run_multiprocessed(
+            _add_offset, args_list, workers=2, copy_to_global_storage={"test_offset": 5}, mp_context="thread"
+        )
+        self.assertListEqual(ans, expected)
+
+    def test_streaming(self):
+        # the results are yielded incrementally - not after a large share of the elements (e.g. a chunk of len / (4 * workers)) is done
+        for curr_pool in [None, WorkerPool(workers=2)]:
+            results = run_multiprocessed(
+                _sleep_and_get_time, list(range(1000)), workers=2, pool=curr_pool, as_iterator=True
+            )
+            next(results)
+            first_result_time = time.time()
+            done_times = list(results)
+            self.assertLess(sum(done_time < first_result_time for done_time in done_times), 100)
+            if curr_pool is not None:
+                curr_pool.close()
+
+    def test_worker_pool(self):
+        with WorkerPool(workers=2) as pool:
+            # the active pool is used and its workers survive across calls, each call with its own global storage
+            pids = set()
+            for offset in [1, 2]:
+                ans = run_multiprocessed(
+                    _add_offset, list(range(100)), workers=2, copy_to_global_storage={"test_offset": offset}
+                )
+                self.assertListEqual(ans, [x + offset for x in range(100)])
+            for size in [10, 100000]:  # the large one is sent via a file
+                data = np.ones(size)
+                ans = run_multiprocessed(
+                    _get_pid_and_data_sum, list(range(20)), pool=pool, copy_to_global_storage={"test_data": data}
+                )
+                self.assertTrue(all(data_sum == size for _, data_sum in ans))
+                pids.update(pid for pid, _ in ans)
+            self.assertLessEqual(len(pids), 2)
+            self.assertNotIn(os.getpid(), pids)
+        self.assertIsNone(WorkerPool.get_active())
+
+    def test_shared_memory(self):
+        pool = WorkerPool(workers=2)
+        for curr_pool in [None, pool]:
+            samples = run_multiprocessed(
+                _create_sample, list(range(10)), workers=2, pool=curr_pool, shared_memory_min_bytes=1024
+            )
+            for x, sample in enumerate(samples):
+                self.assertIsInstance(sample, NDict)
+                self.assertTrue(np.all(sample["data.image"] == x))
+                self.assertEqual(sample["data.image"].dtype, np.float32)
+                self.assertTrue(torch.all(sample["data.seg"] == x))
+                self.assertEqual(sample["data.seg"].dtype, torch.int64)
+                self.assertTrue(np.all(sample["data.list"][0] == x))
+                self.assertEqual(sample["data.list"][1], "text")
+                self.assertEqual(sample["data.small"][0], x)
+                # mapped, not copied
+                self.assertFalse(sample["data.image"].flags.owndata)
+                self.assertTrue(sample["data.small"].flags.owndata)
+            # unlinked once mapped
+            self.assertListEqual(_get_shared_memory_blocks(), [])
+            del samples
+
+            # the blocks of a failed call are removed as well
+            with self.assertRaises(Exception):
+                run_multiprocessed(
+                    _create_sample,
+                    list(range(20)),
+                    workers=2,
+                    pool=curr_pool,
+                    shared_memory_min_bytes=1024,
+                    chunksize=20,
+                )
+            self.assertListEqual(_get_shared_memory_blocks(), [])
+        pool.close()
+
+    @unittest.skipUnless(os.name == "posix", "resource module is posix only")
+    def test_shared_memory_open_files_limit(self):
+        import resource
+
+        # each sample holds 3 mapped arrays - more arrays than the open files limit are kept alive
+        soft_limit, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(256, hard_limit), hard_limit))
+        try:
+            samples = run_multiprocessed(_create_sample, list(range(14, 114)), workers=2, shared_memory_min_bytes=1024)
+        finally:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (soft_limit, hard_limit))
+        for x, sample in zip(range(14, 114), samples):
+            self.assertTrue(np.all(sample["data.image"] == x))
+            self.assertTrue(torch.all(sample["data.seg"] == x))
+            self.assertTrue(np.all(sample["data.list"][0] == x))
+        self.assertListEqual(_get_shared_memory_blocks(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
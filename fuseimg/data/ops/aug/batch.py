@@ -0,0 +1,338 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Batch level augmentations - applied on an entire collated batch (on CPU or GPU), with different random parameters per sample.
+Typically used after the batch is moved to the GPU (see batch_augmentation in LightningModuleDefault):
+
+    batch_aug_pipeline = PipelineDefault(
+        "batch_aug",
+        [
+            (
+                OpAugAffineBatch(),
+                dict(
+                    keys=["data.input.img", "data.gt.seg"],
+                    interpolation=["bilinear", "nearest"],
+                    rotate=Uniform(-30.0, 30.0),
+                    scale=Uniform(0.9, 1.1),
+                    flip=(RandBool(0.3), RandBool(0.3)),
+                ),
+            ),
+            (OpAugColorBatch(), dict(key="data.input.img", add=Uniform(-0.06, 0.06), mul=Uniform(0.95, 1.05))),
+        ],
+    )
+"""
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+import math
+import random
+
+import torch
+import torch.nn.functional as F
+import torchvision.transforms as transforms
+
+from fuse.utils.ndict import NDict
+from fuse.utils.rand.param_sampler import draw_samples_recursively
+
+from fuse.data.ops.op_base import OpReversibleBase
+
+
+def sample_params_per_sample(batch_size: int, probability: float = 1.0, **kwargs) -> List[Optional[Dict[str, Any]]]:
+    """
+    Draws the parameters (see fuse.utils.rand.param_sampler) independently for each sample in the batch
+    :param batch_size: number of samples in the batch
+    :param probability: the probability to augment each sample
+    :param kwargs: the parameters - either fixed values or ParamSamplerBase instances
+    :return: the drawn parameters per sample, None for samples that should not be augmented
+    """
+    ans = []
+    for _ in range(batch_size):
+        if probability < 1.0 and random.random() >= probability:
+            ans.append(None)
+        else:
+            ans.append(draw_samples_recursively(kwargs))
+    return ans
+
+
+class OpAugAffineBatch(OpReversibleBase):
+    """
+    2D affine transformation of a batch - equivalent to OpAugAffine2D, but vectorized over the entire batch
+    using affine_grid() and grid_sample() with a different random transformation per sample.
+    Supports batches of images [batch_size, num_channels, height, width]
+    and of volumes [batch_size, num_channels, depth, height, width] - each slice is transformed with the same 2D transformation.
+    The sampled parameters are recorded in batch_dict[op_id] to support reverse().
+    """
+
+    def __init__(self, verify_arguments: bool = True):
+        """
+        :param verify_arguments: this op expects torch tensors with either 4 or 5 dimensions. Set to False to disable verification
+        """
+        super().__init__()
+        self._verify_arguments = verify_arguments
+
+    def __call__(
+        self,
+        batch_dict: NDict,
+        op_id: Optional[str],
+        keys: Union[str, Sequence[str]],
+        rotate: Any = 0.0,
+        translate: Any = (0.0, 0.0),
+        scale: Any = 1.0,
+        flip: Any = (False, False),
+        shear: Any = 0.0,
+        channels: Optional[List[int]] = None,
+        interpolation: Union[str, transforms.InterpolationMode, Sequence] = "bilinear",
+        probability: float = 1.0,
+    ) -> NDict:
+        """
+        The parameters might be fixed values or ParamSamplerBase instances (drawn per sample)
+        :param keys: key or list of keys to tensors stored in batch_dict - all of them are transformed with the same transformation per sample
+        :param rotate: angle [-360.0 - 360.0]
+        :param translate: translation per spatial axis (number of pixels). The sign used as the direction.
+        :param scale: scale factor
+        :param flip: flip per spatial axis flip[0] for vertical flip and flip[1] for horizontal flip
+        :param shear: shear factor
+        :param channels: apply the augmentation on the specified channels. Set to None to apply to all channels.
+        :param interpolation: "bilinear" or "nearest" (or transforms.InterpolationMode) - either one for all keys or per key
+        :param probability: the probability to augment each sample
+        :return: the augmented batch_dict
+        """
+        if isinstance(keys, str):
+            keys = [keys]
+        if isinstance(interpolation, (str, transforms.InterpolationMode)):
+            interpolation = [interpolation] * len(keys)
+        interpolation = [_interpolation_mode(mode) for mode in interpolation]
+
+        batch_size = batch_dict[keys[0]].shape[0]
+        params = sample_params_per_sample(
+            batch_size, probability, rotate=rotate, translate=translate, scale=scale, flip=flip, shear=shear
+        )
+
+        device = batch_dict[keys[0]].device
+        spatial_shape = batch_dict[keys[0]].shape[-2:]
+        theta = self.affine_matrices(params, spatial_shape, device)
+
+        for key, mode in zip(keys, interpolation):
+            aug_input = batch_dict[key]
+            if self._verify_arguments:
+                assert isinstance(
+                    aug_input, torch.Tensor
+                ), f"Error: OpAugAffineBatch expects torch Tensor, got {type(aug_input)}"
+                assert len(aug_input.shape) in [
+                    4,
+                    5,
+                ], f"Error: OpAugAffineBatch expects tensor with 4 or 5 dimensions. got {aug_input.shape}"
+
+            batch_dict[key] = self.warp(aug_input, theta, mode, channels)
+
+        batch_dict[op_id] = {
+            "params": params,
+            "theta": theta,
+            "keys": keys,
+            "interpolation": interpolation,
+            "channels": channels,
+        }
+        return batch_dict
+
+    def reverse(self, batch_dict: NDict, key_to_reverse: str, key_to_follow: str, op_id: Optional[str]) -> dict:
+        """
+        Applies the inverse transformation (as applied on key_to_follow) on key_to_reverse
+        """
+        info = batch_dict[op_id]
+        if key_to_follow not in info["keys"]:
+            return batch_dict
+
+        mode = info["interpolation"][info["keys"].index(key_to_follow)]
+        batch_dict[key_to_reverse] = self.warp(
+            batch_dict[key_to_reverse], self.invert_affine_matrices(info["theta"]), mode, info["channels"]
+        )
+        return batch_dict
+
+    @staticmethod
+    def affine_matrices(
+        params: List[Optional[Dict[str, Any]]], spatial_shape: Tuple[int, int], device: torch.device
+    ) -> torch.Tensor:
+        """
+        Computes the matrices expected by affine_grid() (mapping output coordinates to input coordinates),
+        using the same conventions as torchvision.transforms.functional.affine() followed by the flips
+        :param params: the parameters per sample as returned by sample_params_per_sample() (None for identity)
+        :param spatial_shape: [height, width]
+        :return: tensor of shape [batch_size, 2, 3]
+        """
+        identity = dict(rotate=0.0, translate=(0.0, 0.0), scale=1.0, flip=(False, False), shear=0.0)
+        params = [identity if p is None else p for p in params]
+        rotate = torch.tensor([math.radians(p["rotate"]) for p in params], dtype=torch.float64)
+        shear = torch.tensor([math.radians(p["shear"]) for p in params], dtype=torch.float64)
+        scale = torch.tensor([float(p["scale"]) for p in params], dtype=torch.float64)
+        translate = torch.tensor([[float(t) for t in p["translate"]] for p in params], dtype=torch.float64)
+        flip = torch.tensor(
+            [[-1.0 if p["flip"][1] else 1.0, -1.0 if p["flip"][0] else 1.0] for p in params], dtype=torch.float64
+        )
+
+        # inverse of rotation, scale and shear (see torchvision.transforms.functional._get_inverse_affine_matrix)
+        a = torch.cos(rotate)
+        b = -torch.cos(rotate) * torch.tan(shear) - torch.sin(rotate)
+        c = torch.sin(rotate)
+        d = -torch.sin(rotate) * torch.tan(shear) + torch.cos(rotate)
+        inverse = (
+            torch.stack([torch.stack([d, -b], dim=-1), torch.stack([-c, a], dim=-1)], dim=-2) / scale[:, None, None]
+        )
+
+        # flips are applied on the output of the transformation
+        linear = inverse * flip[:, None, :]
+        offset = -(inverse @ translate[:, :, None])[:, :, 0]
+
+        # pixels (relative to the center) to normalized coordinates (align_corners=False)
+        height, width = spatial_shape
+        to_normalized = torch.tensor([2.0 / width, 2.0 / height], dtype=torch.float64)
+        linear = to_normalized[None, :, None] * linear / to_normalized[None, None, :]
+        offset = to_normalized[None, :] * offset
+
+        theta = torch.cat([linear, offset[:, :, None]], dim=-1)
+        return theta.to(device=device, dtype=torch.float32)
+
+    @staticmethod
+    def invert_affine_matrices(theta: torch.Tensor) -> torch.Tensor:
+        """
+        :param theta: tensor of shape [batch_size, 2, 3]
+        :return: the matrices of the inverse transformations
+        """
+        last_row = torch.tensor([0.0, 0.0, 1.0], dtype=theta.dtype, device=theta.device).expand(theta.shape[0], 1, 3)
+        return torch.linalg.inv(torch.cat([theta, last_row], dim=1))[:, :2]
+
+    @staticmethod
+    def warp(
+        aug_input: torch.Tensor, theta: torch.Tensor, mode: str, channels: Optional[List[int]] = None
+    ) -> torch.Tensor:
+        """
+        Transforms a batch of images [B, C, H, W] or volumes [B, C, D, H, W] (2D transformation of each slice)
+        :param theta: 2D transformations - tensor of shape [batch_size, 2, 3]
+        :param mode: "bilinear" or "nearest"
+        :param channels: transform just the specified channels, None for all of them
+        """
+        if channels is not None:
+            aug_tensor = aug_input.clone()
+            aug_tensor[:, channels] = OpAugAffineBatch.warp(aug_input[:, channels], theta, mode)
+            return aug_tensor
+
+        if aug_input.dim() == 5:
+            # extend to 3D transformations that keep the depth axis as is
+            theta_3d = torch.zeros((theta.shape[0], 3, 4), dtype=theta.dtype, device=theta.device)
+            theta_3d[:, :2, :2] = theta[:, :, :2]
+            theta_3d[:, :2, 3] = theta[:, :, 2]
+            theta_3d[:, 2, 2] = 1.0
+            theta = theta_3d
+
+        # grid_sample() requires floating point input
+        values = aug_input if aug_input.is_floating_point() else aug_input.float()
+        theta = theta.to(device=values.device, dtype=values.dtype)
+        grid = F.affine_grid(theta, list(values.shape), align_corners=False)
+        aug_tensor = F.grid_sample(values, grid, mode=mode, padding_mode="zeros", align_corners=False)
+        if not aug_input.is_floating_point():
+            aug_tensor = aug_tensor.round().to(aug_input.dtype)
+        return aug_tensor
+
+
+class OpAugColorBatch(OpReversibleBase):
+    """
+    Color augmentation of a batch - equivalent to OpAugColor, but vectorized over the entire batch with different random parameters per sample
+    The sampled parameters are recorded in batch_dict[op_id]. The op does not modify the geometry, so reverse() keeps the values as is.
+    """
+
+    def __init__(self, verify_arguments: bool = True):
+        """
+        :param verify_arguments: this op expects torch tensor of range [0, 1]. Set to False to disable verification
+        """
+        super().__init__()
+        self._verify_arguments = verify_arguments
+
+    def __call__(
+        self,
+        batch_dict: NDict,
+        op_id: Optional[str],
+        key: str,
+        add: Any = None,
+        mul: Any = None,
+        gamma: Any = None,
+        contrast: Any = None,
+        channels: Optional[List[int]] = None,
+        probability: float = 1.0,
+    ) -> NDict:
+        """
+        The parameters might be fixed values or ParamSamplerBase instances (drawn per sample)
+        :param key: key to a batch of images stored in batch_dict: torch tensor of range [0, 1], shape [batch_size, num_channels, ...]
+        :param add: value to add to each pixel
+        :param mul: multiplication factor
+        :param gamma: gamma factor
+        :param contrast: contrast factor
+        :param channels: Apply just over the specified channels. If set to None will apply on all channels.
+        :param probability: the probability to augment each sample
+        """
+        aug_input = batch_dict[key]
+
+        # verify
+        if self._verify_arguments:
+            assert isinstance(
+                aug_input, torch.Tensor
+            ), f"Error: OpAugColorBatch expects torch Tensor, got {type(aug_input)}"
+            assert (
+                aug_input.min() >= 0.0 and aug_input.max() <= 1.0
+            ), f"Error: OpAugColorBatch expects tensor in range [0.0-1.0]. got [{aug_input.min()}-{aug_input.max()}]"
+
+        params = sample_params_per_sample(
+            aug_input.shape[0], probability, add=add, mul=mul, gamma=gamma, contrast=contrast
+        )
+        requested = dict(add=add, mul=mul, gamma=gamma, contrast=contrast)
+        neutral = dict(add=0.0, mul=1.0, gamma=1.0, contrast=1.0)
+
+        aug_tensor = aug_input if channels is None else aug_input[:, channels]
+        # parameters per sample, shaped to broadcast over the sample dimensions
+        param_shape = (aug_tensor.shape[0],) + (1,) * (aug_tensor.dim() - 1)
+        for name in ["add", "mul", "gamma", "contrast"]:
+            if requested[name] is None:
+                continue
+            values = [neutral[name] if p is None else p[name] for p in params]
+            value = torch.tensor(values, dtype=aug_tensor.dtype, device=aug_tensor.device).reshape(param_shape)
+            if name == "add":
+                aug_tensor = aug_tensor + value
+            elif name == "mul":
+                aug_tensor = aug_tensor * value
+            elif name == "gamma":
+                aug_tensor = aug_tensor**value
+            else:
+                calculated_mean = aug_tensor.mean(dim=tuple(range(1, aug_tensor.dim())), keepdim=True)
+                aug_tensor = ((aug_tensor - calculated_mean) * value) + calculated_mean
+            aug_tensor = aug_tensor.clamp(0.0, 1.0)
+
+        if channels is not None:
+            aug_output = aug_input.clone()
+            aug_output[:, channels] = aug_tensor
+            aug_tensor = aug_output
+
+        batch_dict[key] = aug_tensor
+        batch_dict[op_id] = {"params": params}
+        return batch_dict
+
+    def reverse(self, batch_dict: NDict, key_to_reverse: str, key_to_follow: str, op_id: Optional[str]) -> dict:
+        """
+        See super class - nothing to reverse
+        """
+        return batch_dict
+
+
+def _interpolation_mode(mode: Union[str, transforms.InterpolationMode]) -> str:
+    if isinstance(mode, transforms.InterpolationMode):
+        mode = mode.value
+    if mode not in ["bilinear", "nearest"]:
+        raise Exception(f"Error: unsupported interpolation mode {mode}, expecting bilinear or nearest")
+    return mode
@@ -3,6 +3,10 @@ import unittest
 from fuse.data.pipelines.pipeline_default import PipelineDefault
 from fuseimg.data.ops.color import OpClip, OpToRange
 from fuseimg.data.ops.shape_ops import OpPad
+from fuseimg.data.ops.aug.batch import OpAugAffineBatch, OpAugColorBatch
+from fuseimg.data.ops.aug.color import OpAugColor
+from fuse.utils.rand.param_sampler import RandBool, Uniform
+import torchvision.transforms.functional as TTF
 
 from fuse.utils.ndict import NDict
 
@@ -65,6 +69,68 @@ class TestOps(unittest.TestCase):
         self.assertTrue(np.array_equal(sample["data.input.tensor_img_2"], res_2))
         self.assertTrue(np.array_equal(sample["data.input.numpy_img_2"], res_2))
 
+    def test_batch_aug(self):
+        """
+        Test the batch augmentations against the per sample ops
+        """
+        yy, xx = torch.meshgrid(torch.linspace(0, 1, 40), torch.linspace(0, 1, 50), indexing="ij")
+        img = torch.stack([torch.sin(3 * xx + 2 * yy), torch.cos(2 * xx - yy)]) * 0.5 + 0.5
+        batch = NDict()
+        batch["data.input.img"] = img[None].repeat(4, 1, 1, 1)
+        batch["data.input.volume"] = img[None, :, None].repeat(4, 1, 3, 1, 1)
+        batch["data.gt.seg"] = (batch["data.input.img"][:, :1] > 0.5).long()
+
+        pipeline = PipelineDefault(
+            "test_batch_aug",
+            [
+                (
+                    OpAugAffineBatch(),
+                    dict(
+                        keys=["data.input.img", "data.input.volume", "data.gt.seg"],
+                        interpolation=["bilinear", "bilinear", "nearest"],
+                        rotate=Uniform(-30.0, 30.0),
+                        translate=(Uniform(-3.0, 3.0), Uniform(-3.0, 3.0)),
+                        scale=Uniform(0.9, 1.1),
+                        flip=(RandBool(0.5), RandBool(0.5)),
+                        shear=Uniform(-5.0, 5.0),
+                    ),
+                ),
+                (OpAugColorBatch(), dict(key="data.input.img", add=Uniform(-0.1, 0.1), contrast=Uniform(0.8, 1.2))),
+            ],
+        )
+        original = batch["data.input.img"].clone()
+        batch = pipeline(batch)
+
+        affine_info = batch["internal.test_batch_aug.0"]
+        color_params = batch["internal.test_batch_aug.1.params"]
+        for i, params in enumerate(affine_info["params"]):
+            expected = TTF.affine(
+                original[i],
+                angle=params["rotate"],
+                translate=list(params["translate"]),
+                scale=params["scale"],
+                shear=[params["shear"], 0.0],
+                interpolation=TTF.InterpolationMode.BILINEAR,
+            )
+            if params["flip"][0]:
+                expected = TTF.vflip(expected)
+            if params["flip"][1]:
+                expected = TTF.hflip(expected)
+            # every slice of the volume is transformed in the same way
+            self.assertTrue(torch.allclose(batch["data.input.volume"][i, :, 1], expected, atol=1e-4))
+
+            sample = NDict({"img": expected})
+            sample = OpAugColor()(sample, key="img", add=color_params[i]["add"], contrast=color_params[i]["contrast"])
+            self.assertTrue(torch.allclose(batch["data.input.img"][i], sample["img"], atol=1e-4))
+
+        self.assertEqual(batch["data.gt.seg"].dtype, torch.int64)
+        self.assertTrue(set(batch["data.gt.seg"].unique().tolist()) <= {0, 1})
+
+        # reverse - back to the original geometry (except the borders)
+        batch["data.input.volume"] = batch["data.input.volume"][:, :, 1]
+        batch = OpAugAffineBatch().reverse(batch, "data.input.volume", "data.input.img", "internal.test_batch_aug.0")
+        self.assertLess((batch["data.input.volume"] - original)[:, :, 15:25, 20:30].abs().max().item(), 0.01)
+
     def test_op_resize_to(self):
         pass
 
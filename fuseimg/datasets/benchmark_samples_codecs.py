@@ -0,0 +1,152 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Compares the serialization codecs supported by the samples cacher (see fuse/data/datasets/caching/samples_codecs.py)
+on the static pipelines of fuseimg datasets.
+For each dataset and codec, caches a subset of the samples and measures the caching time, the loading time and the cache size on disk.
+
+Usage:
+    python benchmark_samples_codecs.py --isic <isic data path> --kits21 <kits21 data path> --stoic21 <stoic21 data path> --num_samples 50
+Datasets without a provided data path are skipped.
+"""
+from typing import Callable, Dict, List, Sequence
+import argparse
+import os
+import shutil
+import tempfile
+from time import time
+
+import pandas as pd
+
+from fuse.data.datasets.caching.samples_cacher import SamplesCacher
+from fuse.data.datasets.caching.samples_codecs import CODECS, verify_codec
+from fuse.data.datasets.caching.samples_storage import SamplesStorageFiles, SamplesStoragePacked
+from fuse.data.pipelines.pipeline_default import PipelineDefault
+from fuseimg.datasets.isic import ISIC
+from fuseimg.datasets.kits21 import KITS21
+from fuseimg.datasets.stoic21 import STOIC21
+
+
+def _get_dir_size(path: str) -> int:
+    ans = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            ans += os.path.getsize(os.path.join(root, f))
+    return ans
+
+
+def benchmark_codecs(
+    static_pipeline: PipelineDefault,
+    sample_ids: Sequence,
+    codecs: Sequence[str] = CODECS,
+    storages: Dict[str, Callable] = None,
+    workers: int = 0,
+    repeats: int = 3,
+) -> pd.DataFrame:
+    """
+    Caches the samples with each codec and measures caching time, loading time and cache size
+    :param static_pipeline: the static pipeline to cache
+    :param sample_ids: the samples to cache
+    :param codecs: the codecs to compare. Codecs with missing dependencies are skipped.
+    :param storages: map from storage name to a function creating a storage given a codec
+    :param workers: number of caching processes
+    :param repeats: number of times all of the samples are loaded. The reported loading time is the average.
+    :return: a dataframe with a row per storage and codec
+    """
+    if storages is None:
+        storages = {
+            "files": lambda codec: SamplesStorageFiles(codec=codec),
+            "packed": lambda codec: SamplesStoragePacked(codec=codec),
+        }
+
+    results = []
+    for storage_name, storage_factory in storages.items():
+        for codec in codecs:
+            try:
+                verify_codec(codec)
+            except Exception as e:
+                print(f"skipping codec {codec}: {e}")
+                continue
+
+            tmpdir = tempfile.mkdtemp()
+            try:
+                cacher = SamplesCacher(
+                    f"benchmark_codecs_{codec}",
+                    static_pipeline,
+                    [tmpdir],
+                    restart_cache=True,
+                    workers=workers,
+                    storage=storage_factory(codec),
+                )
+                start = time()
+                output_info = cacher.cache_samples(list(sample_ids))
+                caching_time = time() - start
+
+                final_sample_ids = []
+                for out in output_info.values():
+                    if out is None:
+                        continue
+                    final_sample_ids.extend(out if isinstance(out, list) else [out])
+
+                start = time()
+                for _ in range(repeats):
+                    for sample_id in final_sample_ids:
+                        cacher.load_sample(sample_id)
+                loading_time = (time() - start) / max(repeats * len(final_sample_ids), 1)
+
+                results.append(
+                    dict(
+                        storage=storage_name,
+                        codec=codec,
+                        num_samples=len(final_sample_ids),
+                        caching_time_sec=caching_time,
+                        loading_time_per_sample_ms=loading_time * 1000,
+                        cache_size_mb=_get_dir_size(tmpdir) / 1024**2,
+                    )
+                )
+            finally:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return pd.DataFrame(results)
+
+
+def main(args: argparse.Namespace) -> None:
+    datasets: List[tuple] = []
+    if args.isic is not None:
+        datasets.append(("ISIC", ISIC.static_pipeline(args.isic), ISIC.sample_ids(args.isic)))
+    if args.kits21 is not None:
+        datasets.append(("KITS21", KITS21.static_pipeline(args.kits21), KITS21.sample_ids()))
+    if args.stoic21 is not None:
+        datasets.append(("STOIC21", STOIC21.static_pipeline(args.stoic21), STOIC21.sample_ids(args.stoic21)))
+
+    if len(datasets) == 0:
+        raise Exception("Please provide at least one dataset path (--isic, --kits21 or --stoic21)")
+
+    for name, static_pipeline, sample_ids in datasets:
+        sample_ids = sample_ids[: args.num_samples]
+        results = benchmark_codecs(static_pipeline, sample_ids, workers=args.workers, repeats=args.repeats)
+        print(f"\n{name} ({len(sample_ids)} samples):")
+        print(results.to_string(index=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the samples cacher serialization codecs")
+    parser.add_argument("--isic", type=str, default=None, help="path to ISIC data (see ISIC.download())")
+    parser.add_argument("--kits21", type=str, default=None, help="path to KITS21 data (see KITS21.download())")
+    parser.add_argument("--stoic21", type=str, default=None, help="path to STOIC21 data")
+    parser.add_argument("--num_samples", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=3)
+    main(parser.parse_args())